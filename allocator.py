@@ -0,0 +1,540 @@
+import logging
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+# 每个字的位数
+WORD_BITS = 64
+FULL_WORD = (1 << WORD_BITS) - 1
+# 按段扫描位图时每段的字节数(64个字)，全满或全空的段整体跳过
+CHUNK_BYTES = WORD_BITS * 8
+FULL_CHUNK = b'\xff' * CHUNK_BYTES
+ZERO_CHUNK = bytes(CHUNK_BYTES)
+# 空闲区间索引中每块的元素个数
+CHUNK_LOAD = 512
+# 可选的分配策略
+POLICIES = ('first_fit', 'next_fit', 'best_fit')
+
+
+# 返回字中最低的0位
+def _low_zero(word):
+    return (~word & (word + 1)).bit_length() - 1
+
+
+# 多级位图
+# levels[0]每一位对应一个磁盘块，levels[k]每一位表示levels[k-1]中对应的字是否已满
+class Bitmap(object):
+    def __init__(self, size):
+        self.size = size
+        # 已占用的块数
+        self.count = 0
+        # 下一个可能空闲的块号
+        self.hint = 0
+        # 上次同步后修改过的字号
+        self.dirty = set()
+        self.levels = []
+        bits = size
+        while True:
+            words = (bits + WORD_BITS - 1) // WORD_BITS
+            level = array('Q', bytes(8 * words))
+            # 超出范围的位视为已占用
+            if bits % WORD_BITS:
+                level[-1] = FULL_WORD ^ ((1 << (bits % WORD_BITS)) - 1)
+            self.levels.append(level)
+            if words == 1:
+                break
+            bits = words
+        # 第0级位图，保存到卷镜像的就是这一级
+        self.words = self.levels[0]
+
+    # 从保存的第0级位图恢复，重建上层位图
+    def load(self, data):
+        self.__init__(self.size)
+        words = self.levels[0]
+        padding = words[-1]
+        words[:] = array('Q', bytes(data))
+        words[-1] |= padding
+        # 整个位图作为一个大整数统计1的个数
+        self.count = bin(int.from_bytes(words.tobytes(), 'little')).count('1') - bin(padding).count('1')
+        for upper in range(1, len(self.levels)):
+            lower = self.levels[upper - 1]
+            raw = lower.tobytes()
+            # 每段对应上一级的一个字
+            for begin in range(0, len(raw), CHUNK_BYTES):
+                chunk = raw[begin:begin + CHUNK_BYTES]
+                if chunk == ZERO_CHUNK[:len(chunk)]:
+                    continue
+                first = begin >> 3
+                if chunk == FULL_CHUNK[:len(chunk)]:
+                    self.levels[upper][first >> 6] |= (1 << (len(chunk) >> 3)) - 1
+                    continue
+                for word_index in range(first, first + (len(chunk) >> 3)):
+                    if lower[word_index] == FULL_WORD:
+                        self.levels[upper][word_index >> 6] |= 1 << (word_index & 63)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return (self.levels[0][index >> 6] >> (index & 63)) & 1
+
+    # 将某一块标记为占用
+    def set(self, index):
+        for level in self.levels:
+            word_index = index >> 6
+            word = level[word_index]
+            bit = 1 << (index & 63)
+            if word & bit:
+                return
+            word |= bit
+            level[word_index] = word
+            if level is self.levels[0]:
+                self.count += 1
+                self.dirty.add(word_index)
+            # 只有字变满时才需要更新上一级
+            if word != FULL_WORD:
+                return
+            index = word_index
+
+    # 将某一块标记为空闲
+    def clear(self, index):
+        if index < self.hint:
+            self.hint = index
+        for level in self.levels:
+            word_index = index >> 6
+            word = level[word_index]
+            bit = 1 << (index & 63)
+            if not word & bit:
+                return
+            level[word_index] = word & ~bit
+            if level is self.levels[0]:
+                self.count -= 1
+                self.dirty.add(word_index)
+            # 只有字原来是满的才需要更新上一级
+            if word != FULL_WORD:
+                return
+            index = word_index
+
+    # 将[start, end)整体标记为占用，按字合并后重建上层位图
+    def fill(self, start, end):
+        if start >= end:
+            return
+        words = array('Q', self.levels[0])
+        dirty = self.dirty | set(range(start >> 6, ((end - 1) >> 6) + 1))
+        for word_index in range(start >> 6, ((end - 1) >> 6) + 1):
+            low = max(start, word_index << 6) - (word_index << 6)
+            high = min(end, (word_index + 1) << 6) - (word_index << 6)
+            words[word_index] |= ((1 << high) - 1) ^ ((1 << low) - 1)
+        self.load(words.tobytes())
+        self.dirty = dirty
+
+    # 在第level级中寻找start之后的第一个0位，没有则返回-1
+    def _find(self, level, start):
+        words = self.levels[level]
+        word_index = start >> 6
+        if word_index >= len(words):
+            return -1
+        word = words[word_index] | ((1 << (start & 63)) - 1)
+        if word != FULL_WORD:
+            return (word_index << 6) + _low_zero(word)
+        if level + 1 == len(self.levels):
+            return -1
+        word_index = self._find(level + 1, word_index + 1)
+        if word_index == -1:
+            return -1
+        return (word_index << 6) + _low_zero(words[word_index])
+
+    # 返回start之后的第一个空闲块，没有则返回-1
+    def find_zero(self, start=None):
+        if start is None:
+            index = self._find(0, self.hint)
+            self.hint = self.size if index == -1 else index
+            return index
+        return self._find(0, start)
+
+    # 按地址顺序返回全部空闲区间(起始块号，长度)
+    def free_runs(self):
+        run_start = -1
+        words = self.words
+        raw = words.tobytes()
+        for begin in range(0, len(raw), CHUNK_BYTES):
+            chunk = raw[begin:begin + CHUNK_BYTES]
+            # 区间外的全满段和区间内的全空段不会改变区间
+            if run_start == -1 and chunk == FULL_CHUNK[:len(chunk)]:
+                continue
+            if run_start != -1 and chunk == ZERO_CHUNK[:len(chunk)]:
+                continue
+            for word_index in range(begin >> 3, (begin + len(chunk)) >> 3):
+                word = words[word_index]
+                if word == FULL_WORD and run_start == -1:
+                    continue
+                if word == 0 and run_start != -1:
+                    continue
+                for bit in range(WORD_BITS):
+                    index = (word_index << 6) + bit
+                    if index >= self.size:
+                        break
+                    if (word >> bit) & 1:
+                        if run_start != -1:
+                            yield run_start, index - run_start
+                            run_start = -1
+                    elif run_start == -1:
+                        run_start = index
+        if run_start != -1:
+            yield run_start, self.size - run_start
+
+
+# 分块有序表
+# 元素按顺序分成若干块，每块最多2 * CHUNK_LOAD个，另存各块的最大元素
+# 查找先在各块最大元素中二分再在块内二分，插入删除只移动一块内的元素，代价为O(log n + CHUNK_LOAD)
+class SortedList(object):
+    def __init__(self, values=()):
+        values = sorted(values)
+        self.chunks = [values[i:i + CHUNK_LOAD] for i in range(0, len(values), CHUNK_LOAD)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+        self.size = len(values)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            for value in chunk:
+                yield value
+
+    def __reversed__(self):
+        for chunk in reversed(self.chunks):
+            for value in reversed(chunk):
+                yield value
+
+    def add(self, value):
+        self.size += 1
+        if not self.chunks:
+            self.chunks.append([value])
+            self.maxes.append(value)
+            return
+        index = min(bisect_left(self.maxes, value), len(self.maxes) - 1)
+        chunk = self.chunks[index]
+        chunk.insert(bisect_left(chunk, value), value)
+        self.maxes[index] = chunk[-1]
+        self._split(index)
+
+    # 块过大时对半拆分
+    def _split(self, index):
+        chunk = self.chunks[index]
+        if len(chunk) > 2 * CHUNK_LOAD:
+            self.chunks[index:index + 1] = [chunk[:CHUNK_LOAD], chunk[CHUNK_LOAD:]]
+            self.maxes[index:index + 1] = [chunk[CHUNK_LOAD - 1], chunk[-1]]
+
+    # 删除一个已有的元素
+    def remove(self, value):
+        index = bisect_left(self.maxes, value)
+        chunk = self.chunks[index]
+        del chunk[bisect_left(chunk, value)]
+        self.size -= 1
+        if not chunk:
+            del self.chunks[index]
+            del self.maxes[index]
+            return
+        self.maxes[index] = chunk[-1]
+        # 块过小时与相邻的块合并，块数保持在O(n / CHUNK_LOAD)
+        if len(chunk) < CHUNK_LOAD // 2 and len(self.chunks) > 1:
+            if index + 1 == len(self.chunks):
+                index -= 1
+            self.chunks[index] += self.chunks.pop(index + 1)
+            self.maxes[index] = self.maxes.pop(index + 1)
+            self._split(index)
+
+    # 不小于value的最小元素，没有则返回None
+    def ceiling(self, value):
+        index = bisect_left(self.maxes, value)
+        if index == len(self.maxes):
+            return None
+        chunk = self.chunks[index]
+        return chunk[bisect_left(chunk, value)]
+
+    # 不大于value的最大元素，没有则返回None
+    def floor(self, value):
+        index = bisect_left(self.maxes, value)
+        if index < len(self.maxes):
+            chunk = self.chunks[index]
+            position = bisect_right(chunk, value)
+            if position:
+                return chunk[position - 1]
+        return self.maxes[index - 1] if index else None
+
+    # 从不小于value的元素开始按顺序返回
+    def irange(self, value):
+        index = bisect_left(self.maxes, value)
+        if index == len(self.maxes):
+            return
+        chunk = self.chunks[index]
+        for position in range(bisect_left(chunk, value), len(chunk)):
+            yield chunk[position]
+        for chunk in self.chunks[index + 1:]:
+            for value in chunk:
+                yield value
+
+    def last(self):
+        return self.maxes[-1] if self.maxes else None
+
+
+# 空闲区间索引
+# 同时按起始块号和按长度排序，分别用于首次/循环首次适应和最佳适应
+class ExtentIndex(object):
+    def __init__(self, runs=()):
+        runs = list(runs)
+        self.starts = SortedList(start for start, num in runs)
+        self.length = dict(runs)
+        self.by_size = SortedList((num, start) for start, num in runs)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _put(self, start, num):
+        self.starts.add(start)
+        self.length[start] = num
+        self.by_size.add((num, start))
+
+    def _drop(self, start):
+        self.starts.remove(start)
+        num = self.length.pop(start)
+        self.by_size.remove((num, start))
+        return num
+
+    # 加入空闲区间，与前后相邻区间合并
+    def add(self, start, num):
+        if start + num in self.length:
+            num += self._drop(start + num)
+        prev = self.starts.floor(start)
+        if prev is not None and prev + self.length[prev] == start:
+            num += self._drop(prev)
+            start = prev
+        self._put(start, num)
+
+    # 从所在的空闲区间中移除[start, start + num)
+    def remove(self, start, num):
+        extent_start = self.starts.floor(start)
+        extent_num = 0 if extent_start is None else self.length[extent_start]
+        if extent_start is None or start + num > extent_start + extent_num:
+            raise ValueError('块%d~%d不在同一空闲区间内' % (start, start + num - 1))
+        self._drop(extent_start)
+        if start > extent_start:
+            self._put(extent_start, start - extent_start)
+        if start + num < extent_start + extent_num:
+            self._put(start + num, extent_start + extent_num - start - num)
+
+    # 从包含block或在block之后的第一个空闲区间开始按地址顺序返回起始块号，到末尾后回到开头
+    def starts_from(self, block):
+        first = self.starts.floor(block)
+        if first is None or first + self.length[first] <= block:
+            first = self.starts.ceiling(block)
+        if first is None:
+            first = self.starts.ceiling(0)
+        if first is None:
+            return
+        for start in self.starts.irange(first):
+            yield start
+        for start in self.starts:
+            if start >= first:
+                return
+            yield start
+
+    # 返回能容纳num块的最小空闲区间的起始块号，没有则返回-1
+    def best(self, num):
+        extent = self.by_size.ceiling((num, -1))
+        return -1 if extent is None else extent[1]
+
+    # 最大空闲区间的长度
+    def largest(self):
+        extent = self.by_size.last()
+        return extent[0] if extent else 0
+
+
+# 空闲块分配器
+# group为分配组(起始块号，结束块号)，给出时只在组内分配，组外的块视为已占用
+class Allocator(object):
+    def __init__(self, block_num, reserved=0, policy='first_fit', group=None):
+        self.block_num = block_num
+        self.reserved = reserved
+        start, end = group or (0, block_num)
+        start = max(start, reserved)
+        self.group = (start, end)
+        self.bitmap = Bitmap(block_num)
+        self.extents = ExtentIndex()
+        self.set_policy(policy)
+        # 多个线程同时分配释放时保护位图和空闲区间索引
+        self._lock = threading.RLock()
+        # 循环首次适应的起始位置
+        self.rotor = start
+        # 统计信息
+        self.allocations = 0
+        self.allocated = 0
+        self.freed = 0
+        # 保留区和分配组以外的块不参与分配
+        self.bitmap.fill(0, start)
+        self.bitmap.fill(end, block_num)
+        if end > start:
+            self.extents.add(start, end - start)
+
+    # 设置分配策略
+    def set_policy(self, policy):
+        if policy not in POLICIES:
+            raise ValueError('分配策略必须是%s之一' % '/'.join(POLICIES))
+        self.policy = policy
+
+    # 空闲块数
+    def free_count(self):
+        return self.block_num - self.bitmap.count
+
+    # 分配num块，返回若干连续区间(起始块号，长度)
+    # contiguous为真时只返回一个区间，空间不足时抛出IOError
+    # 给出below时只在起始块号小于below的空闲区间中按地址顺序选取一个区间，用于向前搬移
+    def allocate_runs(self, num, contiguous=False, below=None):
+        with self._lock:
+            if num <= 0:
+                return []
+            if num > self.free_count():
+                raise IOError('磁盘空间不足，无法分配%d块' % num)
+            if below is not None:
+                runs = self._lowest(num, below)
+            elif contiguous:
+                runs = self._contiguous(num)
+            elif num == 1 and self.policy != 'best_fit':
+                # 单块直接在多级位图中查找，首次适应从hint开始，循环首次适应从rotor开始，到末尾后回到开头
+                block = self.bitmap.find_zero(None if self.policy == 'first_fit' else self.rotor)
+                if block == -1:
+                    block = self.bitmap.find_zero()
+                runs = [(block, 1)]
+            elif self.policy == 'best_fit':
+                runs = self._best_fit(num)
+            else:
+                start = self.rotor if self.policy == 'next_fit' else 0
+                runs = self._address_order(num, start)
+            for start, length in runs:
+                self.extents.remove(start, length)
+                for i in range(start, start + length):
+                    self.bitmap.set(i)
+            self.rotor = runs[-1][0] + runs[-1][1]
+            self.allocations += 1
+            self.allocated += num
+            logging.debug('分配磁盘块区间%s', runs)
+            return runs
+
+    # 从start开始按地址顺序选取区间，到末尾后回到开头
+    def _address_order(self, num, start):
+        extents = self.extents
+        first = None
+        runs = []
+        for extent_start in extents.starts_from(start):
+            extent_num = extents.length[extent_start]
+            # 循环首次适应时第一个区间可能从中间开始
+            if first is None:
+                first = extent_start
+                if extent_start < start < extent_start + extent_num:
+                    extent_num -= start - extent_start
+                    extent_start = start
+            length = min(num, extent_num)
+            runs.append((extent_start, length))
+            num -= length
+            if not num:
+                return runs
+        # 循环首次适应时跳过的前半个区间
+        runs.append((first, num))
+        return runs
+
+    # 优先选取能容纳全部块的最小区间，否则从最大的区间开始依次选取
+    def _best_fit(self, num):
+        start = self.extents.best(num)
+        if start != -1:
+            return [(start, num)]
+        runs = []
+        for extent_num, extent_start in reversed(self.extents.by_size):
+            length = min(num, extent_num)
+            runs.append((extent_start, length))
+            num -= length
+            if not num:
+                break
+        runs.sort()
+        return runs
+
+    def _contiguous(self, num):
+        if self.policy == 'best_fit':
+            start = self.extents.best(num)
+        else:
+            start = -1
+            first = self.rotor if self.policy == 'next_fit' else 0
+            for extent_start in self.extents.starts_from(first):
+                if self.extents.length[extent_start] >= num:
+                    start = extent_start
+                    break
+        if start == -1:
+            raise IOError('没有%d块连续的空闲空间' % num)
+        return [(start, num)]
+
+    # 起始块号小于below、能容纳num块的第一个空闲区间
+    def _lowest(self, num, below):
+        for extent_start in self.extents.starts:
+            if extent_start >= below:
+                break
+            if self.extents.length[extent_start] >= num:
+                return [(extent_start, num)]
+        raise IOError('块%d之前没有%d块连续的空闲空间' % (below, num))
+
+    # 释放一组磁盘块
+    def free(self, blocks):
+        with self._lock:
+            run_start = run_end = -1
+            for block in sorted(blocks):
+                if not self.bitmap[block]:
+                    continue
+                self.bitmap.clear(block)
+                self.freed += 1
+                if block == run_end:
+                    run_end += 1
+                    continue
+                if run_start != -1:
+                    self.extents.add(run_start, run_end - run_start)
+                run_start, run_end = block, block + 1
+            if run_start != -1:
+                self.extents.add(run_start, run_end - run_start)
+            logging.debug('释放磁盘块%s', blocks)
+
+    # 将一组磁盘块标记为占用，用于从磁盘恢复
+    def mark_used(self, blocks):
+        with self._lock:
+            for block in blocks:
+                self.bitmap.set(block)
+            self.rebuild_extents()
+
+    # 将一组空闲块标记为占用，逐个区间更新空闲区间索引
+    def claim(self, blocks):
+        with self._lock:
+            run_start = run_end = -1
+            for block in sorted(blocks):
+                self.bitmap.set(block)
+                if block == run_end:
+                    run_end += 1
+                    continue
+                if run_start != -1:
+                    self.extents.remove(run_start, run_end - run_start)
+                run_start, run_end = block, block + 1
+            if run_start != -1:
+                self.extents.remove(run_start, run_end - run_start)
+
+    # 依据位图重建空闲区间索引
+    def rebuild_extents(self):
+        with self._lock:
+            self.extents = ExtentIndex(self.bitmap.free_runs())
+
+    # 返回统计信息
+    def stats(self):
+        return {
+            'policy': self.policy,
+            'free': self.free_count(),
+            'extents': len(self.extents),
+            'largest_extent': self.extents.largest(),
+            'allocations': self.allocations,
+            'allocated': self.allocated,
+            'freed': self.freed,
+        }
@@ -0,0 +1,7 @@
+# 文件系统接口的基准测试
+# 用法: python -m bench --block-num 100000 --files 1000 --output result.json
+#       python -m bench.compare base.json result.json
+#       python -m bench.loadgen --clients 1000 --duration 10
+#       python -m bench.shards --shards 1,2,4,8
+#       python -m bench.allocsim --policies first_fit,best_fit --block-sizes 32,64,128 --jobs 4
+#       python -m bench.allocsim --fragmented 50000,500000,2000000 --ops 20000
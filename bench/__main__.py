@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 对外的测试负载，mount由mount_build和mount_load两步组成
+WORKLOADS = ('small_files', 'append_stream', 'random_reads', 'churn', 'mount')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m bench', description='文件系统接口基准测试')
+    parser.add_argument('--block-num', type=int, default=100000, help='磁盘块数')
+    parser.add_argument('--block-size', type=int, default=64, help='磁盘块大小')
+    parser.add_argument('--files', type=int, default=500, help='小文件个数')
+    parser.add_argument('--file-size', type=int, default=200, help='小文件大小(字节)')
+    parser.add_argument('--stream-bytes', type=int, default=200000, help='追加流和随机读文件的大小(字节)')
+    parser.add_argument('--reads', type=int, default=5000, help='随机读次数')
+    parser.add_argument('--rounds', type=int, default=20, help='新建删除的轮数')
+    parser.add_argument('--seed', type=int, default=1, help='随机数种子')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS), help='逗号分隔的负载列表')
+    parser.add_argument('--output', help='结果JSON文件，默认输出到标准输出')
+    return parser.parse_args()
+
+
+# 在workdir中用独立子进程运行一步负载
+def run_step(step, params, env, workdir):
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'bench.worker', step, json.dumps(params)], cwd=workdir, env=env)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+# 运行一个负载，每个负载使用新的工作目录和进程
+def run_workload(name, params, env):
+    with tempfile.TemporaryDirectory(prefix='fsbench-') as workdir:
+        if name != 'mount':
+            return run_step(name, params, env, workdir)
+        build = run_step('mount_build', params, env, workdir)
+        load = run_step('mount_load', params, env, workdir)
+        build['ops'].update(load['ops'])
+        build['wall_seconds'] += load['wall_seconds']
+        build['peak_rss_kb'] = max(build['peak_rss_kb'] or 0, load['peak_rss_kb'] or 0)
+        return build
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    params = {
+        'files': args.files,
+        'file_size': args.file_size,
+        'stream_bytes': args.stream_bytes,
+        'reads': args.reads,
+        'rounds': args.rounds,
+        'seed': args.seed,
+    }
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    env['FS_BLOCK_NUM'] = str(args.block_num)
+    env['FS_BLOCK_SIZE'] = str(args.block_size)
+    # 每个文件占用一个文件描述符
+    env['FS_FD_NUM'] = str(args.files + 16)
+    result = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'config': dict(params, block_num=args.block_num, block_size=args.block_size),
+        'results': {},
+    }
+    for name in args.workloads.split(','):
+        if name not in WORKLOADS:
+            sys.exit('未知的负载%s，可选%s' % (name, ','.join(WORKLOADS)))
+        result['results'][name] = run_workload(name, params, env)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from allocator import POLICIES, Allocator
+from bench.workloads import Timer, percentile
+
+# 分配策略模拟：在同样容量的卷上用不同的块大小、保留区大小和分配策略运行同一串操作，
+# 经过真实的File和分配器路径分配磁盘块，定期记录碎片、尾部浪费和分配器自身的分配、释放延迟
+# trace负载用--trace给出replay格式的操作轨迹
+# --fragmented直接在分配器上测量碎片很多时的分配、释放延迟，检查延迟不随空闲区间数增长
+WORKLOADS = ('sizes', 'churn', 'logs', 'trace')
+DISTRIBUTIONS = ('lognormal', 'uniform', 'bimodal')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m bench.allocsim', description='磁盘块分配策略模拟')
+    parser.add_argument('--policies', default=','.join(POLICIES), help='逗号分隔的分配策略列表')
+    parser.add_argument('--block-sizes', default='32,64,128', help='逗号分隔的块大小列表')
+    parser.add_argument('--reserved', default='20', help='逗号分隔的保留区大小(块数)列表')
+    parser.add_argument('--volume-bytes', type=int, default=2 << 20, help='卷容量(字节)，块数由块大小算出')
+    parser.add_argument('--workloads', default='sizes,churn,logs', help='逗号分隔的负载列表')
+    parser.add_argument('--trace', help='trace负载重放的操作轨迹文件')
+    parser.add_argument('--ops', type=int, default=5000, help='每个负载生成的文件操作数')
+    parser.add_argument('--dist', default='lognormal', choices=DISTRIBUTIONS, help='文件大小分布')
+    parser.add_argument('--file-size', type=int, default=2048, help='文件大小分布的中位数(字节)')
+    parser.add_argument('--write-size', type=int, default=4096, help='每次追加的最大字节数')
+    parser.add_argument('--fill', type=float, default=0.8, help='负载维持的卷使用率')
+    parser.add_argument('--logs', type=int, default=8, help='logs负载同时追加的日志文件数')
+    parser.add_argument('--record-size', type=int, default=100, help='logs负载每条记录的平均字节数')
+    parser.add_argument('--sample-every', type=int, default=500, help='每隔多少个操作记录一次统计')
+    parser.add_argument('--seed', type=int, default=1, help='随机数种子，各配置使用相同的操作序列')
+    parser.add_argument('--fragmented', default='', help='逗号分隔的空闲区间数列表，给出时只测量碎片化分配器的延迟')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='并行运行配置的进程数')
+    parser.add_argument('--output', help='结果JSON文件，默认输出到标准输出')
+    return parser.parse_args()
+
+
+# 按分布抽取一个文件大小(字节)
+def draw_size(rnd, params):
+    median = params['file_size']
+    if params['dist'] == 'uniform':
+        return rnd.randint(1, 2 * median)
+    if params['dist'] == 'bimodal':
+        return rnd.randint(1, median // 2 or 1) if rnd.random() < 0.9 else rnd.randint(median * 4, median * 16)
+    return max(1, min(int(rnd.lognormvariate(0, 1) * median), params['volume_bytes'] // 8))
+
+
+# 以下负载产生(操作名，接口名，参数)，各配置得到相同的序列
+# 新建文件并分若干次追加size个字节
+def write_file(name, size, params, payload):
+    yield 'create', 'create', (name,)
+    yield 'open', 'open_file', (name,)
+    while size > 0:
+        num = min(size, params['write_size'])
+        yield 'append', 'append_data', (name, payload[:num])
+        size -= num
+    yield 'close', 'close_file', (name,)
+
+
+# 按大小分布写满卷，删除随机一半的文件后再写满，考察空洞的再利用
+def sizes(rnd, params, payload):
+    target = params['fill'] * params['volume_bytes']
+    files = {}
+    count = 0
+    for phase in range(2):
+        used = sum(files.values())
+        while used < target and count < params['ops']:
+            name = 'f%d' % count
+            files[name] = draw_size(rnd, params)
+            used += files[name]
+            count += 1
+            for op in write_file(name, files[name], params, payload):
+                yield op
+        if phase == 0:
+            for name in rnd.sample(sorted(files), len(files) // 2):
+                del files[name]
+                yield 'destroy', 'destroy', (name,)
+
+
+# 使用率低于目标时多新建，高于目标时多删除，已有文件有时继续增长
+def churn(rnd, params, payload):
+    target = params['fill'] * params['volume_bytes']
+    files = {}
+    used = 0
+    for count in range(params['ops']):
+        action = rnd.random()
+        if files and action < 0.25:
+            name = rnd.choice(sorted(files))
+            size = min(draw_size(rnd, params), params['write_size'])
+            files[name] += size
+            used += size
+            yield 'open', 'open_file', (name,)
+            yield 'append', 'append_data', (name, payload[:size])
+            yield 'close', 'close_file', (name,)
+        elif not files or (used < target and action < 0.7) or (used < target / 2):
+            name = 'c%d' % count
+            files[name] = draw_size(rnd, params)
+            used += files[name]
+            for op in write_file(name, files[name], params, payload):
+                yield op
+        else:
+            name = rnd.choice(sorted(files))
+            used -= files.pop(name)
+            yield 'destroy', 'destroy', (name,)
+
+
+# 多个日志文件交替追加小记录，写满上限后删除并新建，模拟日志轮转
+def logs(rnd, params, payload):
+    limit = int(params['fill'] * params['volume_bytes'] / params['logs'])
+    sizes = {}
+    generation = 0
+    for index in range(params['logs']):
+        name = 'log%d_0' % index
+        sizes[index] = (name, 0)
+        yield 'create', 'create', (name,)
+        yield 'open', 'open_file', (name,)
+    for count in range(params['ops']):
+        index = rnd.randrange(params['logs'])
+        name, size = sizes[index]
+        num = max(1, min(int(rnd.expovariate(1.0 / params['record_size'])), params['write_size']))
+        if size + num > limit:
+            generation += 1
+            yield 'close', 'close_file', (name,)
+            yield 'destroy', 'destroy', (name,)
+            name, size = 'log%d_%d' % (index, generation), 0
+            yield 'create', 'create', (name,)
+            yield 'open', 'open_file', (name,)
+        yield 'append', 'append_data', (name, payload[:num])
+        sizes[index] = (name, size + num)
+
+
+# 重放录制的操作轨迹
+def trace(rnd, params, payload):
+    from replay import OPS, load_trace
+    for record in load_trace(params['trace']):
+        if record.get('op') in OPS:
+            function, args = OPS[record['op']]
+            yield record['op'], function, tuple(record[arg] for arg in args)
+
+
+GENERATORS = {
+    'sizes': sizes,
+    'churn': churn,
+    'logs': logs,
+    'trace': trace,
+}
+
+
+# 给obj上名为name的方法套上计时，每次调用的耗时记入samples
+def measure(obj, name, samples, clock):
+    method = getattr(obj, name)
+
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            samples.append(clock() - start)
+    setattr(obj, name, wrapper)
+
+
+# 记录一次统计：使用率、外部碎片、平均区间数、尾部浪费和这段时间内分配器的分配、释放延迟
+def sample(fs, ops, failures, window):
+    report = fs.fragmentation()
+    allocatable = fs.block_num - fs.reserved
+    free = report['free_blocks']
+    # 各文件最后一块中未使用的字节
+    tail = 0
+    for path, item in report['files'].items():
+        info = fs.stat(path)
+        if info['codec'] == 'none':
+            tail += item['blocks'] * fs.block_size - info['size']
+    allocs = sorted(window['alloc'])
+    frees = sorted(window['free'])
+    return {
+        'ops': ops,
+        'files': len(report['files']),
+        'utilization': (allocatable - free) / allocatable,
+        # 最大空闲区间之外的空闲块比例，空闲块全部连续时为0
+        'external_fragmentation': 1 - report['largest_free_extent'] / free if free else 0.0,
+        'free_extents': report['free_extents'],
+        'extents_per_file': report['extents_per_file'],
+        'tail_waste_bytes': tail,
+        'alloc_mean_us': sum(allocs) / len(allocs) * 1e6 if allocs else 0.0,
+        'alloc_p99_us': percentile(allocs, 99) * 1e6 if allocs else 0.0,
+        'free_mean_us': sum(frees) / len(frees) * 1e6 if frees else 0.0,
+        'free_p99_us': percentile(frees, 99) * 1e6 if frees else 0.0,
+        'failures': failures,
+    }
+
+
+# 在有extents个单块空闲区间的分配器上交替分配和释放，返回分配和释放的延迟
+# 释放的块回到原来的位置，测量期间空闲区间数不变
+def fragmented(extents, policy, params):
+    allocator = Allocator(2 * extents, 0, policy)
+    allocator.allocate_runs(2 * extents)
+    allocator.free(range(0, 2 * extents, 2))
+    rnd = random.Random(params['seed'])
+    clock = time.thread_time
+    allocs = []
+    frees = []
+    for _ in range(params['ops']):
+        start = clock()
+        runs = allocator.allocate_runs(rnd.choice((1, 2, 4, 8)))
+        allocs.append(clock() - start)
+        blocks = [block for run_start, num in runs for block in range(run_start, run_start + num)]
+        start = clock()
+        allocator.free(blocks)
+        frees.append(clock() - start)
+    allocs.sort()
+    frees.sort()
+    return {
+        'extents': len(allocator.extents),
+        'alloc_mean_us': sum(allocs) / len(allocs) * 1e6,
+        'alloc_p99_us': percentile(allocs, 99) * 1e6,
+        'free_mean_us': sum(frees) / len(frees) * 1e6,
+        'free_p99_us': percentile(frees, 99) * 1e6,
+    }
+
+
+# 在一个配置上运行一个负载，在进程池的工作进程中执行
+def simulate(workload, policy, block_size, reserved, params):
+    logging.disable(logging.INFO)
+    from file import FileSystem
+    fs = FileSystem(block_num=params['volume_bytes'] // block_size, block_size=block_size, reserved=reserved,
+                    alloc_policy=policy)
+    rnd = random.Random(params['seed'])
+    payload = memoryview(b'x' * params['write_size'])
+    timer = Timer()
+    timeline = []
+    window = {'alloc': [], 'free': []}
+    ops = failures = 0
+    begin = time.perf_counter()
+    # 延迟按本线程的CPU时间计，多个配置并行争用CPU时结果不受影响
+    clock = time.thread_time
+    # 分配延迟只计分配器本身，不含文件系统写入数据和记日志的时间
+    measure(fs.allocator, 'allocate_runs', window['alloc'], clock)
+    measure(fs.allocator, 'free', window['free'], clock)
+    for op, function, args in GENERATORS[workload](rnd, params, payload):
+        start = clock()
+        try:
+            getattr(fs, function)(*args)
+        except IOError:
+            # 磁盘空间不足
+            failures += 1
+        timer.samples[op].append(clock() - start)
+        ops += 1
+        if ops % params['sample_every'] == 0:
+            timeline.append(sample(fs, ops, failures, window))
+            for samples in window.values():
+                del samples[:]
+    final = sample(fs, ops, failures, window)
+    timeline.append(final)
+    return {
+        'workload': workload,
+        'policy': policy,
+        'block_size': block_size,
+        'reserved': reserved,
+        'block_num': fs.block_num,
+        'wall_seconds': time.perf_counter() - begin,
+        'final': final,
+        'peak_external_fragmentation': max(item['external_fragmentation'] for item in timeline),
+        'mean_extents_per_file': sum(item['extents_per_file'] for item in timeline) / len(timeline),
+        'allocator': fs.allocator.stats(),
+        'ops': timer.report(),
+        'timeline': timeline,
+    }
+
+
+# 各策略在不同空闲区间数下的延迟，growth为最多与最少区间数时平均分配延迟之比
+def run_fragmented(args, policies, params):
+    counts = [int(n) for n in args.fragmented.split(',')]
+    configs = [(count, policy) for policy in policies for count in counts]
+    result = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': params,
+        'fragmented': {},
+    }
+    with ProcessPoolExecutor(max(1, args.jobs), mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(fragmented, count, policy, params) for count, policy in configs]
+        for (count, policy), future in zip(configs, futures):
+            result['fragmented'].setdefault(policy, {'runs': {}})['runs'][str(count)] = future.result()
+    for item in result['fragmented'].values():
+        runs = [item['runs'][str(count)] for count in sorted(counts)]
+        item['growth'] = runs[-1]['alloc_mean_us'] / runs[0]['alloc_mean_us'] if runs[0]['alloc_mean_us'] else 0.0
+    output(args, result)
+
+
+# 结果写入--output指定的文件，没有时输出到标准输出
+def output(args, result):
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+def main():
+    args = parse_args()
+    workloads = args.workloads.split(',')
+    policies = args.policies.split(',')
+    for name in workloads:
+        if name not in WORKLOADS:
+            raise SystemExit('未知的负载%s，可选%s' % (name, ','.join(WORKLOADS)))
+    for policy in policies:
+        if policy not in POLICIES:
+            raise SystemExit('未知的分配策略%s，可选%s' % (policy, ','.join(POLICIES)))
+    if 'trace' in workloads and not args.trace:
+        raise SystemExit('trace负载需要--trace给出操作轨迹文件')
+    params = {
+        'volume_bytes': args.volume_bytes,
+        'ops': args.ops,
+        'dist': args.dist,
+        'file_size': args.file_size,
+        'write_size': args.write_size,
+        'fill': args.fill,
+        'logs': args.logs,
+        'record_size': args.record_size,
+        'sample_every': args.sample_every,
+        'seed': args.seed,
+        'trace': args.trace,
+    }
+    if args.fragmented:
+        run_fragmented(args, policies, params)
+        return
+    configs = [(workload, policy, block_size, reserved)
+               for workload in workloads
+               for policy in policies
+               for block_size in [int(n) for n in args.block_sizes.split(',')]
+               for reserved in [int(n) for n in args.reserved.split(',')]]
+    result = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': params,
+        'results': {},
+    }
+    # 与分片文件系统一样用spawn启动工作进程
+    with ProcessPoolExecutor(max(1, args.jobs), mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(simulate, *config, params) for config in configs]
+        for config, future in zip(configs, futures):
+            workload, policy, block_size, reserved = config
+            result['results'].setdefault(workload, {})['%s/%d/%d' % (policy, block_size, reserved)] = \
+                future.result()
+    output(args, result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import argparse
+import json
+import sys
+
+
+# 比较两次基准测试结果，吞吐量下降或p99延迟上升超过阈值时视为性能回退
+def compare(base, new, threshold):
+    regressions = []
+    for workload, result in sorted(new['results'].items()):
+        old_ops = base['results'].get(workload, {}).get('ops', {})
+        for op, stats in sorted(result['ops'].items()):
+            old = old_ops.get(op)
+            if old is None or not old['ops_per_sec'] or not old['p99_us']:
+                continue
+            speed = stats['ops_per_sec'] / old['ops_per_sec'] - 1
+            latency = stats['p99_us'] / old['p99_us'] - 1
+            flag = speed < -threshold or latency > threshold
+            print('%-14s %-18s ops/s %+7.1f%%  p99 %+7.1f%%%s' %
+                  (workload, op, speed * 100, latency * 100, '  <-- 回退' if flag else ''))
+            if flag:
+                regressions.append((workload, op))
+        old_rss = base['results'].get(workload, {}).get('peak_rss_kb')
+        if old_rss and result.get('peak_rss_kb'):
+            print('%-14s %-18s %+7.1f%%' % (workload, 'peak_rss', (result['peak_rss_kb'] / old_rss - 1) * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m bench.compare', description='比较两次基准测试结果')
+    parser.add_argument('base', help='基准结果JSON')
+    parser.add_argument('new', help='新结果JSON')
+    parser.add_argument('--threshold', type=float, default=0.1, help='允许的相对变化，默认0.1')
+    args = parser.parse_args()
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare(base, new, args.threshold)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
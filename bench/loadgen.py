@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from bench.workloads import percentile
+from client import Client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m bench.loadgen', description='文件服务压力测试')
+    parser.add_argument('--unix', metavar='PATH', help='已启动服务的Unix域套接字，不指定时自动启动服务')
+    parser.add_argument('--host', default='127.0.0.1', help='已启动服务的TCP地址')
+    parser.add_argument('--port', type=int, help='已启动服务的TCP端口')
+    parser.add_argument('--clients', type=int, default=1000, help='并发客户端数')
+    parser.add_argument('--pipeline', type=int, default=4, help='每个客户端同时未完成的请求数')
+    parser.add_argument('--files', type=int, default=16, help='文件个数')
+    parser.add_argument('--file-size', type=int, default=4096, help='文件初始大小(字节)')
+    parser.add_argument('--io-size', type=int, default=256, help='每次读写的字节数')
+    parser.add_argument('--read-ratio', type=float, default=0.9, help='读请求的比例')
+    parser.add_argument('--duration', type=float, default=5.0, help='测试时长(秒)')
+    parser.add_argument('--workers', type=int, default=8, help='自动启动的服务的线程数')
+    parser.add_argument('--seed', type=int, default=1, help='随机数种子')
+    return parser.parse_args()
+
+
+async def connect(args):
+    return await Client.connect(args.unix, args.host, args.port)
+
+
+# 新建测试文件并写入初始内容
+async def prepare(args):
+    client = await connect(args)
+    names = ['load%d' % i for i in range(args.files)]
+    chunk = bytes(random.Random(args.seed).randrange(1, 256) for _ in range(args.file_size))
+    for name in names:
+        await client.create(name)
+        handle = await client.open(name)
+        await client.append(handle, chunk)
+        await client.close(handle)
+    await client.aclose()
+    return names
+
+
+# 一个客户端：打开一个文件，持续发送随机读写请求直到deadline
+async def run_client(args, number, name, deadline, samples):
+    rnd = random.Random(args.seed + number)
+    client = await connect(args)
+    handle = await client.open(name)
+    data = bytes(rnd.randrange(1, 256) for _ in range(args.io_size))
+    limit = args.file_size - args.io_size
+    clock = time.perf_counter
+
+    async def loop():
+        while clock() < deadline:
+            offset = rnd.randrange(0, max(1, limit))
+            begin = clock()
+            if rnd.random() < args.read_ratio:
+                await client.pread(handle, offset, args.io_size)
+                samples['pread'].append(clock() - begin)
+            else:
+                await client.pwrite(handle, offset, data)
+                samples['pwrite'].append(clock() - begin)
+
+    await asyncio.gather(*[loop() for _ in range(args.pipeline)])
+    await client.close(handle)
+    await client.aclose()
+
+
+async def run(args):
+    names = await prepare(args)
+    samples = defaultdict(list)
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*[run_client(args, i, names[i % len(names)], deadline, samples)
+                           for i in range(args.clients)])
+    elapsed = time.perf_counter() - start
+    report = {'clients': args.clients, 'pipeline': args.pipeline, 'seconds': elapsed, 'ops': {}}
+    total = 0
+    for op, values in samples.items():
+        values.sort()
+        total += len(values)
+        report['ops'][op] = {
+            'count': len(values),
+            'ops_per_sec': len(values) / elapsed,
+            'p50_us': percentile(values, 50) * 1e6,
+            'p99_us': percentile(values, 99) * 1e6,
+            'max_us': values[-1] * 1e6,
+        }
+    report['ops_per_sec'] = total / elapsed
+    return report
+
+
+# 在临时目录中启动文件服务，等待套接字出现
+def start_server(args, workdir):
+    args.unix = os.path.join(workdir, 'fs.sock')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    # 块数足够存放全部文件
+    env.setdefault('FS_BLOCK_NUM', str(max(1000, args.files * (args.file_size // 10 + 2) * 2)))
+    env.setdefault('FS_FD_NUM', str(args.files + 16))
+    process = subprocess.Popen([sys.executable, '-m', 'server', '--unix', args.unix,
+                                '--workers', str(args.workers)], cwd=workdir, env=env)
+    for _ in range(200):
+        if os.path.exists(args.unix):
+            return process
+        time.sleep(0.05)
+    process.kill()
+    sys.exit('文件服务启动失败')
+
+
+def main():
+    args = parse_args()
+    process = None
+    workdir = None
+    if not args.unix and not args.port:
+        workdir = tempfile.TemporaryDirectory(prefix='fsload-')
+        process = start_server(args, workdir.name)
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+            workdir.cleanup()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from shard import ShardedFileSystem
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m bench.shards', description='分片文件系统的多核扩展测试')
+    parser.add_argument('--shards', default='1,2,4', help='逗号分隔的分片数列表')
+    parser.add_argument('--block-size', type=int, default=64, help='磁盘块大小')
+    parser.add_argument('--files', type=int, default=64, help='文件个数')
+    parser.add_argument('--file-size', type=int, default=65536, help='文件大小(字节)')
+    parser.add_argument('--io-size', type=int, default=8192, help='每次读写的字节数')
+    parser.add_argument('--rounds', type=int, default=4, help='每个文件重写、读取和校验的轮数')
+    parser.add_argument('--seed', type=int, default=1, help='随机数种子')
+    parser.add_argument('--output', help='结果JSON文件，默认输出到标准输出')
+    return parser.parse_args()
+
+
+# 在shards个分片上运行一轮负载：整块重写、分段读取、计算摘要
+def run(args, shards):
+    rnd = random.Random(args.seed)
+    names = ['f%d' % i for i in range(args.files)]
+    data = bytes(rnd.randrange(1, 256) for _ in range(args.io_size))
+    blocks = args.file_size // args.block_size + 2
+    # 文件按名称哈希分布到各分片，每个分配组留出一倍余量
+    block_num = 20 + blocks * args.files * 2 + blocks * shards * 4
+    with tempfile.TemporaryDirectory(prefix='fsshard-') as workdir:
+        fs = ShardedFileSystem(workdir, shards, block_num, args.block_size, fd_num=args.files + 16)
+        fs.mount()
+        try:
+            fs.call_many([('create', name) for name in names])
+            fs.call_many([('open_file', name) for name in names])
+            offsets = range(0, args.file_size, args.io_size)
+            report = {}
+            steps = (
+                ('pwrite', [('pwrite', name, offset, data) for name in names for offset in offsets]),
+                ('pread', [('pread', name, offset, args.io_size) for name in names for offset in offsets]),
+                ('digest', [('file_digest', name) for name in names]),
+            )
+            for op, calls in steps:
+                begin = time.perf_counter()
+                for _ in range(args.rounds):
+                    fs.call_many(calls)
+                elapsed = time.perf_counter() - begin
+                report[op] = {
+                    'count': len(calls) * args.rounds,
+                    'seconds': elapsed,
+                    'ops_per_sec': len(calls) * args.rounds / elapsed,
+                }
+            fs.call_many([('close_file', name) for name in names])
+        finally:
+            fs.unmount()
+    return report
+
+
+def main():
+    args = parse_args()
+    result = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cpus': os.cpu_count(),
+        'config': {'files': args.files, 'file_size': args.file_size, 'io_size': args.io_size,
+                   'rounds': args.rounds, 'block_size': args.block_size},
+        'results': {},
+    }
+    base = None
+    for shards in [int(n) for n in args.shards.split(',')]:
+        report = run(args, shards)
+        if base is None:
+            base = report
+        # 相对第一个分片数的加速比
+        for op, item in report.items():
+            item['speedup'] = item['ops_per_sec'] / base[op]['ops_per_sec']
+        result['results'][str(shards)] = report
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
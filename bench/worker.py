@@ -0,0 +1,42 @@
+import json
+import logging
+import sys
+import time
+
+# 在子进程中运行一个测试负载，结果以JSON输出到标准输出
+# 磁盘参数由父进程通过环境变量传入
+
+
+# 进程的峰值常驻内存(KB)
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS上单位是字节
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def main():
+    workload, params = sys.argv[1], json.loads(sys.argv[2])
+    logging.disable(logging.INFO)
+    from file import FileSystem
+    from bench.workloads import WORKLOADS, Timer
+    fs = FileSystem()
+    # 挂载测试的第二步由负载自己挂载
+    if workload != 'mount_load':
+        fs.mount()
+    timer = Timer()
+    begin = time.perf_counter()
+    WORKLOADS[workload](fs, params, timer)
+    wall = time.perf_counter() - begin
+    print(json.dumps({
+        'wall_seconds': wall,
+        'peak_rss_kb': peak_rss_kb(),
+        'ops': timer.report(),
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import random
+import time
+from collections import defaultdict
+
+# 每次追加或读取的字节数，受内存区大小限制
+CHUNK = 90
+
+
+# 计时器，按操作名记录每次调用的耗时
+class Timer(object):
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def call(self, op, function, *args):
+        begin = time.perf_counter()
+        result = function(*args)
+        self.samples[op].append(time.perf_counter() - begin)
+        return result
+
+    # 每种操作的次数、吞吐量和延迟分位数(微秒)
+    def report(self):
+        report = {}
+        for op, samples in self.samples.items():
+            samples = sorted(samples)
+            total = sum(samples)
+            report[op] = {
+                'count': len(samples),
+                'seconds': total,
+                'ops_per_sec': len(samples) / total if total else 0.0,
+                'mean_us': total / len(samples) * 1e6,
+                'p50_us': percentile(samples, 50) * 1e6,
+                'p90_us': percentile(samples, 90) * 1e6,
+                'p99_us': percentile(samples, 99) * 1e6,
+                'max_us': samples[-1] * 1e6,
+            }
+        return report
+
+
+# 已排序样本的第p百分位数
+def percentile(samples, p):
+    index = min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))
+    return samples[index]
+
+
+# 向文件追加size个字节
+def fill(fs, name, size, timer=None):
+    while size > 0:
+        num = min(size, CHUNK)
+        if timer is None:
+            fs.append(name, 0, num)
+        else:
+            timer.call('append', fs.append, name, 0, num)
+        size -= num
+
+
+# 大量小文件：新建、打开、写入、关闭，再逐个查看
+def small_files(fs, params, timer):
+    names = ['small%d' % i for i in range(params['files'])]
+    for name in names:
+        timer.call('create', fs.create, name)
+        timer.call('open', fs.open_file, name)
+        fill(fs, name, params['file_size'], timer)
+        timer.call('close', fs.close_file, name)
+    for name in names:
+        timer.call('view', fs.view_file, name)
+
+
+# 一个文件持续追加
+def append_stream(fs, params, timer):
+    fs.create('stream')
+    fs.open_file('stream')
+    fill(fs, 'stream', params['stream_bytes'], timer)
+    timer.call('close', fs.close_file, 'stream')
+
+
+# 在大文件中随机定位读取
+def random_reads(fs, params, timer):
+    fs.create('data')
+    fs.open_file('data')
+    fill(fs, 'data', params['stream_bytes'])
+    fs.close_file('data')
+    fs.open_file('data')
+    rnd = random.Random(params['seed'])
+    for i in range(params['reads']):
+        timer.call('seek', fs.read_write_seek, 'data', rnd.randrange(params['stream_bytes']))
+        timer.call('read', fs.read, 'data', 0, CHUNK)
+        timer.call('pread', fs.pread, 'data', rnd.randrange(params['stream_bytes']), CHUNK)
+    fs.close_file('data')
+
+
+# 反复新建和删除文件
+def churn(fs, params, timer):
+    batch = min(params['files'], fs.fd_num - 1)
+    for round_index in range(params['rounds']):
+        names = ['churn%d_%d' % (round_index, i) for i in range(batch)]
+        for name in names:
+            timer.call('create', fs.create, name)
+            fs.open_file(name)
+            fill(fs, name, params['file_size'])
+            fs.close_file(name)
+        for name in names:
+            timer.call('destroy', fs.destroy, name)
+
+
+# 挂载测试第一步：生成卷并保存，再修改一个文件后增量保存
+def mount_build(fs, params, timer):
+    for i in range(params['files']):
+        name = 'mount%d' % i
+        fs.create(name)
+        fs.open_file(name)
+        fill(fs, name, params['file_size'])
+        fs.close_file(name)
+    timer.call('dump', fs.dump_disk)
+    fs.open_file('mount0')
+    fill(fs, 'mount0', params['file_size'])
+    fs.close_file('mount0')
+    timer.call('dump_incremental', fs.dump_disk)
+
+
+# 挂载测试第二步：在新进程中挂载上一步保存的卷并访问一个文件
+def mount_load(fs, params, timer):
+    timer.call('load', fs.mount)
+    timer.call('first_view', fs.view_file, 'mount0')
+
+
+WORKLOADS = {
+    'small_files': small_files,
+    'append_stream': append_stream,
+    'random_reads': random_reads,
+    'churn': churn,
+    'mount_build': mount_build,
+    'mount_load': mount_load,
+}
@@ -0,0 +1,229 @@
+import logging
+import threading
+from collections import OrderedDict
+
+# 可选的淘汰策略
+POLICIES = ('lru', 'clock')
+
+
+# 磁盘块缓存，所有打开文件共享
+# 以块号为键缓存块内容，写操作只修改缓存并标记为脏，淘汰或同步时写回磁盘
+class BlockCache(object):
+    def __init__(self, disk, capacity, policy='lru'):
+        if policy not in POLICIES:
+            raise ValueError('淘汰策略必须是%s之一' % '/'.join(POLICIES))
+        if capacity < 1:
+            raise ValueError('缓存容量至少为1块')
+        self.disk = disk
+        self.capacity = capacity
+        self.policy = policy
+        self.block_size = disk.block_size
+        # 多个线程共享缓存，修改缓存的操作都要持有
+        self._lock = threading.RLock()
+        # 块号到块内容，LRU策略下按访问顺序排列
+        self.entries = OrderedDict()
+        self.dirty = set()
+        # CLOCK策略使用的槽位、访问位和指针
+        self.slots = []
+        self.slot_of = dict()
+        self.ref = bytearray()
+        self.free_slots = []
+        self.hand = 0
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writebacks = 0
+        # 预读进来但尚未被访问的块
+        self.prefetched = set()
+        self.prefetch_count = 0
+        self.prefetch_hits = 0
+
+    def __contains__(self, block):
+        return block in self.entries
+
+    def _touch(self, block):
+        if self.policy == 'lru':
+            self.entries.move_to_end(block)
+        else:
+            self.ref[self.slot_of[block]] = 1
+
+    # 将块降为最先淘汰，用于顺序读已读过的块
+    def demote(self, block):
+        with self._lock:
+            if block not in self.entries:
+                return
+            if self.policy == 'lru':
+                self.entries.move_to_end(block, last=False)
+            else:
+                self.ref[self.slot_of[block]] = 0
+
+    # 选出被淘汰的块
+    def _victim(self):
+        if self.policy == 'lru':
+            return next(iter(self.entries))
+        while True:
+            self.hand = (self.hand + 1) % len(self.slots)
+            if self.slots[self.hand] == -1:
+                continue
+            if not self.ref[self.hand]:
+                return self.slots[self.hand]
+            self.ref[self.hand] = 0
+
+    def _insert(self, block, entry):
+        if len(self.entries) >= self.capacity:
+            self.evict(self._victim())
+        self.entries[block] = entry
+        if self.policy == 'clock':
+            if self.free_slots:
+                slot = self.free_slots.pop()
+                self.slots[slot] = block
+                self.ref[slot] = 1
+            else:
+                slot = len(self.slots)
+                self.slots.append(block)
+                self.ref.append(1)
+            self.slot_of[block] = slot
+
+    def _remove(self, block):
+        del self.entries[block]
+        self.dirty.discard(block)
+        self.prefetched.discard(block)
+        if self.policy == 'clock':
+            slot = self.slot_of.pop(block)
+            self.slots[slot] = -1
+            self.free_slots.append(slot)
+
+    # 返回从start开始num块中块号最小的脏块，没有时返回None
+    def first_dirty(self, start, num):
+        with self._lock:
+            dirty = [block for block in self.dirty if start <= block < start + num]
+        return min(dirty) if dirty else None
+
+    # 返回块的缓存内容，不在缓存中时返回None，不读磁盘也不计入统计
+    def peek(self, block):
+        return self.entries.get(block)
+
+    # 返回块的缓存内容，不在缓存中时从磁盘读入
+    def get(self, block):
+        with self._lock:
+            entry = self.entries.get(block)
+            if entry is not None:
+                self.hits += 1
+                if block in self.prefetched:
+                    self.prefetched.discard(block)
+                    self.prefetch_hits += 1
+                self._touch(block)
+                return entry
+            self.misses += 1
+            entry = bytearray(self.disk[block])
+            self._insert(block, entry)
+            return entry
+
+    # 将一组不在缓存中的块读入缓存，物理上连续的块一次读出
+    def prefetch(self, blocks):
+        with self._lock:
+            missing = [block for block in blocks if block not in self.entries]
+            i = 0
+            while i < len(missing):
+                j = i + 1
+                while j < len(missing) and missing[j] == missing[j - 1] + 1:
+                    j += 1
+                run = self.disk.read_run(missing[i], j - i)
+                for k in range(i, j):
+                    offset = (k - i) * self.block_size
+                    self._insert(missing[k], bytearray(run[offset:offset + self.block_size]))
+                    self.prefetched.add(missing[k])
+                i = j
+            self.prefetch_count += len(missing)
+
+    # 从块的offset处写入data
+    def write(self, block, data, offset=0):
+        with self._lock:
+            entry = self.get(block)
+            entry[offset:offset + len(data)] = data
+            self.dirty.add(block)
+
+    # 淘汰一块，脏块先写回磁盘
+    def evict(self, block):
+        with self._lock:
+            if block in self.dirty:
+                self.disk[block] = self.entries[block]
+                self.writebacks += 1
+            self._remove(block)
+            self.evictions += 1
+
+    # 丢弃一块的缓存内容，不写回，用于释放磁盘块
+    def invalidate(self, block):
+        with self._lock:
+            if block in self.entries:
+                self._remove(block)
+
+    # 将脏块写回磁盘，blocks为空时写回全部脏块
+    def flush(self, blocks=None):
+        with self._lock:
+            if blocks is None:
+                targets = sorted(self.dirty)
+            else:
+                targets = [block for block in blocks if block in self.dirty]
+            for block in targets:
+                self.disk[block] = self.entries[block]
+                self.dirty.discard(block)
+            self.writebacks += len(targets)
+            if targets:
+                logging.debug('缓存写回%d块', len(targets))
+
+    # 返回统计信息
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'capacity': self.capacity,
+            'size': len(self.entries),
+            'dirty': len(self.dirty),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'evictions': self.evictions,
+            'writebacks': self.writebacks,
+            'prefetched': self.prefetch_count,
+            'prefetch_hits': self.prefetch_hits,
+        }
+
+
+# 顺序预读状态，每个打开文件一个
+# 连续两次访问相邻块后认为是顺序读，预读窗口从min_window开始每次翻倍直到max_window，
+# 出现跳跃访问时关闭预读
+class ReadAhead(object):
+    def __init__(self, min_window=4, max_window=64):
+        self.min_window = min_window
+        self.max_window = max_window
+        self.window = 0
+        # 连续访问相邻块的次数
+        self.streak = 0
+        # 上次访问的块序号
+        self.last = -1
+        # 已预读到的块序号(不含)
+        self.prefetched_until = 0
+
+    # 记录访问文件第index块，返回需要预读的块序号范围，不需要预读时返回None
+    def access(self, index, block_count):
+        if index == self.last:
+            return None
+        if index == self.last + 1:
+            self.streak += 1
+            if self.streak >= 2:
+                self.window = min(max(self.window * 2, self.min_window), self.max_window)
+        else:
+            self.streak = 0
+            self.window = 0
+            self.prefetched_until = index + 1
+        self.last = index
+        # 读到已预读部分的后一半时再预读一个窗口
+        if not self.window or index + 1 + self.window // 2 < self.prefetched_until:
+            return None
+        begin = max(index + 1, self.prefetched_until)
+        end = min(begin + self.window, block_count)
+        if begin >= end:
+            return None
+        self.prefetched_until = end
+        return begin, end
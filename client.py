@@ -0,0 +1,106 @@
+import asyncio
+
+from protocol import (COUNT, HANDLE, OP_APPEND, OP_CLOSE, OP_CREATE, OP_DESTROY, OP_OPEN, OP_PREAD,
+                      OP_PWRITE, OP_SEEK, OP_STAT, PREAD, PWRITE, REQUEST, RESPONSE, SEEK, STAT,
+                      STATUS_OK, split_frames)
+
+# 发送缓冲超过该字节数时等待写出
+HIGH_WATER = 1 << 16
+
+
+# 文件服务的异步客户端
+# 请求不等待响应即可发送，多个协程可以在同一连接上并发调用
+class Client(object):
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.number = 0
+        # 请求号到等待响应的future
+        self.waiting = dict()
+        self._receiver = asyncio.ensure_future(self._receive())
+
+    # 连接到Unix域套接字path，或TCP地址host:port
+    @classmethod
+    async def connect(cls, path=None, host='127.0.0.1', port=7070):
+        if path:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def _receive(self):
+        buffer = bytearray()
+        error = ConnectionError('连接已关闭')
+        try:
+            while True:
+                data = await self.reader.read(1 << 16)
+                if not data:
+                    break
+                buffer += data
+                responses, used = split_frames(buffer, RESPONSE)
+                del buffer[:used]
+                for number, status, body in responses:
+                    future = self.waiting.pop(number, None)
+                    if future is None or future.done():
+                        continue
+                    if status == STATUS_OK:
+                        future.set_result(body)
+                    else:
+                        future.set_exception(IOError(body.decode('utf-8')))
+        except (ConnectionError, ValueError) as e:
+            error = e
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_exception(error)
+        self.waiting.clear()
+
+    async def call(self, op, payload=b''):
+        if self._receiver.done():
+            raise ConnectionError('连接已关闭')
+        self.number = (self.number + 1) & 0xffffffff
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[self.number] = future
+        self.writer.write(REQUEST.pack(len(payload), self.number, op))
+        self.writer.write(payload)
+        if self.writer.transport.get_write_buffer_size() > HIGH_WATER:
+            await self.writer.drain()
+        return await future
+
+    async def create(self, path):
+        await self.call(OP_CREATE, path.encode('utf-8'))
+
+    async def destroy(self, path):
+        await self.call(OP_DESTROY, path.encode('utf-8'))
+
+    # 打开文件，返回句柄
+    async def open(self, path):
+        return HANDLE.unpack(await self.call(OP_OPEN, path.encode('utf-8')))[0]
+
+    async def close(self, handle):
+        await self.call(OP_CLOSE, HANDLE.pack(handle))
+
+    async def pread(self, handle, offset, length):
+        return await self.call(OP_PREAD, PREAD.pack(handle, offset, length))
+
+    async def pwrite(self, handle, offset, data):
+        return COUNT.unpack(await self.call(OP_PWRITE, PWRITE.pack(handle, offset) + bytes(data)))[0]
+
+    async def append(self, handle, data):
+        return COUNT.unpack(await self.call(OP_APPEND, HANDLE.pack(handle) + bytes(data)))[0]
+
+    async def seek(self, handle, pos):
+        await self.call(OP_SEEK, SEEK.pack(handle, pos))
+
+    # 返回文件描述符、类型、长度和块数
+    async def stat(self, path):
+        fd, kind, size, blocks = STAT.unpack(await self.call(OP_STAT, path.encode('utf-8')))
+        return {'fd': fd, 'type': kind, 'size': size, 'blocks': blocks}
+
+    # 关闭连接，服务端会关闭该连接打开的全部文件
+    async def aclose(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+        await self._receiver
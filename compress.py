@@ -0,0 +1,148 @@
+import logging
+import lzma
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# 可选的压缩算法，在索引节点中以序号保存，none表示不压缩
+CODECS = ('none', 'zlib', 'lzma')
+
+
+def compress(codec, data):
+    if codec == 'zlib':
+        return zlib.compress(data)
+    if codec == 'lzma':
+        return lzma.compress(data)
+    raise ValueError('压缩算法必须是%s之一' % '/'.join(CODECS[1:]))
+
+
+def decompress(codec, data):
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'lzma':
+        return lzma.decompress(data)
+    raise ValueError('压缩算法必须是%s之一' % '/'.join(CODECS[1:]))
+
+
+# 压缩文件的解压簇缓存
+# 压缩文件按固定长度的簇压缩存放，缓存以(文件，簇序号)为键保存解压后的内容，
+# 写操作只修改缓存并标记为脏，淘汰或同步时压缩后交给store写回，
+# load返回簇的(压缩算法，压缩数据)，簇不存在时返回None
+class ClusterCache(object):
+    def __init__(self, capacity, load, store):
+        if capacity < 1:
+            raise ValueError('缓存容量至少为1簇')
+        self.capacity = capacity
+        self.load = load
+        self.store = store
+        # 读写压缩文件的簇信息时都要持有
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()
+        self.dirty = set()
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writebacks = 0
+        self.compressed = 0
+        self.decompressed = 0
+        self.compress_seconds = 0.0
+        self.decompress_seconds = 0.0
+        # 压缩前后的累计字节数
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    # 返回簇的解压内容，不在缓存中时读入并解压
+    def get(self, file, index):
+        key = (file, index)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry
+            self.misses += 1
+            stored = self.load(file, index)
+            if stored is None:
+                entry = bytearray()
+            else:
+                begin = time.perf_counter()
+                try:
+                    entry = bytearray(decompress(*stored))
+                except (zlib.error, lzma.LZMAError):
+                    # 只记录元数据的日志重放后，簇中的数据可能不完整
+                    logging.info(msg='文件%s的第%d簇已损坏，按空簇处理' % (file.file_name, index))
+                    entry = bytearray()
+                self.decompress_seconds += time.perf_counter() - begin
+                self.decompressed += 1
+            if len(self.entries) >= self.capacity:
+                self.evict(next(iter(self.entries)))
+            self.entries[key] = entry
+            return entry
+
+    # 从簇的offset处写入data，可以写到簇的末尾之后
+    def write(self, file, index, data, offset=0):
+        with self.lock:
+            entry = self.get(file, index)
+            entry[offset:offset + len(data)] = data
+            self.dirty.add((file, index))
+
+    def _writeback(self, key):
+        file, index = key
+        entry = self.entries[key]
+        begin = time.perf_counter()
+        data = compress(file.codec, bytes(entry))
+        self.compress_seconds += time.perf_counter() - begin
+        self.compressed += 1
+        self.raw_bytes += len(entry)
+        self.stored_bytes += len(data)
+        self.store(file, index, data)
+        self.dirty.discard(key)
+        self.writebacks += 1
+
+    # 淘汰一簇，脏簇先压缩写回
+    def evict(self, key):
+        with self.lock:
+            if key in self.dirty:
+                self._writeback(key)
+            del self.entries[key]
+            self.evictions += 1
+
+    # 丢弃文件的全部缓存簇，不写回，用于删除和清空文件
+    def invalidate(self, file):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] is file]:
+                del self.entries[key]
+                self.dirty.discard(key)
+
+    # 将脏簇压缩写回，file为None时写回全部文件的脏簇
+    def flush(self, file=None):
+        with self.lock:
+            targets = sorted((key for key in self.dirty if file is None or key[0] is file),
+                             key=lambda key: (key[0].fd, key[1]))
+            for key in targets:
+                self._writeback(key)
+            if targets:
+                logging.debug('压缩写回%d簇', len(targets))
+
+    # 返回统计信息
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'capacity': self.capacity,
+            'size': len(self.entries),
+            'dirty': len(self.dirty),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'evictions': self.evictions,
+            'writebacks': self.writebacks,
+            'compressed': self.compressed,
+            'decompressed': self.decompressed,
+            'compress_seconds': self.compress_seconds,
+            'decompress_seconds': self.decompress_seconds,
+            'raw_bytes': self.raw_bytes,
+            'stored_bytes': self.stored_bytes,
+            'ratio': self.raw_bytes / self.stored_bytes if self.stored_bytes else 0.0,
+        }
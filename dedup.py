@@ -0,0 +1,115 @@
+import hashlib
+import threading
+from array import array
+
+# 每个散列桶平均容纳的块数
+BUCKET_LOAD = 16
+
+
+# 按内容寻址的块去重索引
+# refs保存每个物理块被文件引用的次数，keys保存已登记块的64位摘要前缀(0表示未登记)，
+# 摘要前缀按低位分到散列桶中，每个桶是前缀和块号两个紧凑数组，
+# 前缀只用于筛选候选块，相同与否由调用者比较块内容确认
+class DedupIndex(object):
+    def __init__(self, block_num):
+        self.refs = array('I', bytes(4 * block_num))
+        self.keys = array('Q', bytes(8 * block_num))
+        bits = max(1, block_num // BUCKET_LOAD).bit_length()
+        self.mask = (1 << bits) - 1
+        # 桶在第一次登记时才创建
+        self.bucket_keys = [None] * (self.mask + 1)
+        self.bucket_blocks = [None] * (self.mask + 1)
+        # 检查共享、写入和合并一块期间持有，保证共享的块不会被原地修改
+        self.lock = threading.RLock()
+        # 统计信息
+        self.indexed = 0
+        self.used = 0
+        self.references = 0
+        self.lookups = 0
+        self.hits = 0
+        self.copies = 0
+
+    # 块内容的64位摘要前缀，非0
+    @staticmethod
+    def key(data):
+        return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little') or 1
+
+    # 摘要前缀为key的已登记块
+    def candidates(self, key):
+        self.lookups += 1
+        bucket = key & self.mask
+        keys = self.bucket_keys[bucket]
+        if keys is None:
+            return []
+        blocks = self.bucket_blocks[bucket]
+        return [blocks[i] for i, item in enumerate(keys) if item == key]
+
+    # 登记块的摘要前缀，已登记的块先撤销原来的登记
+    def add(self, block, key):
+        if self.keys[block]:
+            self.remove(block)
+        bucket = key & self.mask
+        if self.bucket_keys[bucket] is None:
+            self.bucket_keys[bucket] = array('Q')
+            self.bucket_blocks[bucket] = array('I')
+        self.bucket_keys[bucket].append(key)
+        self.bucket_blocks[bucket].append(block)
+        self.keys[block] = key
+        self.indexed += 1
+
+    # 撤销块的登记，块的内容即将改变或已被释放
+    def remove(self, block):
+        key = self.keys[block]
+        if not key:
+            return
+        bucket = key & self.mask
+        position = self.bucket_blocks[bucket].index(block)
+        del self.bucket_blocks[bucket][position]
+        del self.bucket_keys[bucket][position]
+        self.keys[block] = 0
+        self.indexed -= 1
+
+    # 增加块的引用
+    def acquire(self, blocks):
+        refs = self.refs
+        for block in blocks:
+            if not refs[block]:
+                self.used += 1
+            refs[block] += 1
+            self.references += 1
+
+    # 减少块的引用，返回引用计数减到0、可以归还分配器的块
+    def release(self, blocks):
+        refs = self.refs
+        freed = []
+        for block in blocks:
+            if refs[block] > 1:
+                refs[block] -= 1
+                self.references -= 1
+                continue
+            if refs[block]:
+                self.used -= 1
+                self.references -= 1
+            refs[block] = 0
+            self.remove(block)
+            freed.append(block)
+        return freed
+
+    # 块是否被多个文件引用
+    def shared(self, block):
+        return self.refs[block] > 1
+
+    # 返回统计信息，saved为去重节省的块数
+    def stats(self):
+        buckets = sum(len(keys) for keys in self.bucket_keys if keys is not None)
+        return {
+            'indexed': self.indexed,
+            'used': self.used,
+            'references': self.references,
+            'saved': self.references - self.used,
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'copies': self.copies,
+            'memory_bytes': (self.refs.itemsize * len(self.refs) + self.keys.itemsize * len(self.keys) +
+                             buckets * (8 + 4)),
+        }
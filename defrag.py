@@ -0,0 +1,102 @@
+import logging
+import threading
+
+# 每轮最多搬移的块数和后台整理两轮之间的间隔秒数
+DEFRAG_BUDGET = 256
+DEFRAG_INTERVAL = 0.05
+
+
+# 在线碎片整理
+# 每轮按区间数从多到少选取文件，交给relocate搬到一段连续的空闲区间，
+# compact为真时再把已连续的文件按位置从后往前搬到更靠前的空闲区间，使空闲空间集中。
+# 每轮搬移的块数不超过budget，超过budget的单个文件独占一轮
+# report返回{路径: {'blocks': 块数, 'extents': 区间数, 'start': 第一块}}，
+# relocate(路径, compact)返回搬移的块数，无法搬移时返回0
+class Defragmenter(object):
+    def __init__(self, report, relocate, budget=DEFRAG_BUDGET, interval=DEFRAG_INTERVAL, compact=False):
+        if budget < 1:
+            raise ValueError('每轮至少搬移1块')
+        self.report = report
+        self.relocate = relocate
+        self.budget = budget
+        self.interval = interval
+        self.compact = compact
+        self._stop = threading.Event()
+        self._thread = None
+        # 统计信息
+        self.rounds = 0
+        self.files = 0
+        self.moved = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # 待整理的文件路径
+    def candidates(self):
+        files = self.report()
+        fragmented = sorted((path for path, item in files.items() if item['extents'] > 1),
+                            key=lambda path: -files[path]['extents'])
+        if self.compact:
+            fragmented += sorted((path for path, item in files.items() if item['extents'] == 1),
+                                 key=lambda path: -files[path]['start'])
+        return [(path, files[path]['blocks']) for path in fragmented]
+
+    # 整理一轮，返回搬移的块数，0表示已没有可以整理的文件
+    def step(self):
+        moved = 0
+        for path, blocks in self.candidates():
+            if moved and moved + blocks > self.budget:
+                break
+            num = self.relocate(path, self.compact)
+            if num:
+                moved += num
+                self.files += 1
+        self.rounds += 1
+        self.moved += moved
+        return moved
+
+    # 前台整理到没有可以整理的文件为止，返回搬移的块数
+    def run(self):
+        total = 0
+        while not self._stop.is_set():
+            moved = self.step()
+            if not moved:
+                break
+            total += moved
+        return total
+
+    def _loop(self):
+        try:
+            while not self._stop.is_set():
+                if not self.step():
+                    break
+                self._stop.wait(self.interval)
+        except IOError as e:
+            logging.info(msg='碎片整理中止：%s' % e)
+        logging.info(msg='后台碎片整理结束，共搬移%d块' % self.moved)
+
+    # 启动后台整理线程，整理完成后线程自行结束
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='defrag', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # 返回统计信息
+    def stats(self):
+        return {
+            'running': self.running,
+            'budget': self.budget,
+            'compact': self.compact,
+            'rounds': self.rounds,
+            'files': self.files,
+            'moved': self.moved,
+        }
@@ -0,0 +1,105 @@
+import mmap
+import os
+
+
+# 磁盘类：全部磁盘块存放在一段连续内存中
+# 默认使用匿名映射，页面在第一次访问时才分配，给出镜像文件路径时使用mmap映射该文件
+class Disk(object):
+    def __init__(self, block_num, block_size, path=None):
+        self.block_num = block_num
+        self.block_size = block_size
+        self.size = block_num * block_size
+        self.path = path
+        self._file = None
+        if path is None:
+            self.data = mmap.mmap(-1, self.size)
+        else:
+            # 镜像文件不足磁盘大小时补零
+            self._file = open(path, 'a+b')
+            if os.fstat(self._file.fileno()).st_size < self.size:
+                self._file.truncate(self.size)
+            self.data = mmap.mmap(self._file.fileno(), self.size)
+        self.view = memoryview(self.data)
+        self._zero = bytes(block_size)
+        # 上次同步后修改过的块号
+        self.dirty = set()
+
+    def __len__(self):
+        return self.block_num
+
+    # 返回第index块的内存视图，不发生拷贝
+    def __getitem__(self, index):
+        begin = index * self.block_size
+        return self.view[begin:begin + self.block_size]
+
+    # 用data整体覆盖第index块，不足部分补零
+    def __setitem__(self, index, data):
+        begin = index * self.block_size
+        self.view[begin:begin + len(data)] = data
+        self.view[begin + len(data):begin + self.block_size] = self._zero[len(data):]
+        self.dirty.add(index)
+
+    def __iter__(self):
+        for index in range(self.block_num):
+            yield self[index]
+
+    # 返回从第index块开始连续num块的视图
+    def read_run(self, index, num):
+        begin = index * self.block_size
+        return self.view[begin:begin + num * self.block_size]
+
+    # 将从source开始的num块整体复制到从target开始的num块
+    def copy_run(self, source, target, num):
+        size = num * self.block_size
+        begin = target * self.block_size
+        self.view[begin:begin + size] = self.read_run(source, num)
+        self.dirty.update(range(target, target + num))
+
+    # 从第index块开头起连续写入data，最后一块不足部分保持原样
+    def write_run(self, index, data):
+        begin = index * self.block_size
+        self.view[begin:begin + len(data)] = data
+        self.dirty.update(range(index, index + -(-len(data) // self.block_size)))
+
+    # 从第index块的offset处写入data
+    def write(self, index, data, offset=0):
+        begin = index * self.block_size + offset
+        self.view[begin:begin + len(data)] = data
+        self.dirty.add(index)
+
+    # 清空第index块
+    def clear(self, index):
+        begin = index * self.block_size
+        self.view[begin:begin + self.block_size] = self._zero
+        self.dirty.add(index)
+
+    # 返回第index块中已使用的字节数，0表示空闲字节
+    def used(self, index):
+        begin = index * self.block_size
+        end = self.data.find(b'\0', begin, begin + self.block_size)
+        return self.block_size if end == -1 else end - begin
+
+    # 将mmap的修改同步到镜像文件
+    def flush(self):
+        if self._file is not None:
+            self.data.flush()
+
+    # 改用data存放磁盘块，懒挂载时用于换成卷镜像数据区的映射，原来的匿名映射随即关闭
+    def attach(self, data):
+        old = self.data
+        self.view.release()
+        self.data = data
+        self.view = memoryview(data)
+        if self._file is None:
+            old.close()
+
+    def close(self):
+        self.view.release()
+        try:
+            self.data.close()
+        except BufferError:
+            # 调用者仍持有流式读取得到的磁盘视图，映射在视图全部释放后由垃圾回收关闭
+            pass
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1,158 +1,340 @@
+import functools
+import hashlib
 import logging
 import os
+import threading
 from collections import OrderedDict
 
-logging.basicConfig(level=logging.DEBUG)
-
-# 磁盘块的数量和大小
-BLOCK_NUM = 1000
-BLOCK_SIZE = 10
+from allocator import Allocator
+from cache import BlockCache, ReadAhead
+from compress import CODECS, ClusterCache
+from dedup import DedupIndex
+from defrag import DEFRAG_BUDGET, Defragmenter
+from disk import Disk
+from inode import ExtentMap
+from journal import REC_BLOCK, REC_FREE, REC_INODE, FD, Journal
+from locks import RWLock
+from metrics import Lazy, Metrics, timed
+from volume import TYPE_DIR, TYPE_FILE, Volume, from_runs, pack_inodes, to_runs, unpack_inodes
+
+# 以下为新建文件系统时的默认参数
+# 卷镜像文件名
+IMAGE_NAME = 'disk.img'
+# 日志文件名
+JOURNAL_NAME = 'disk.journal'
+# 是否将数据块内容也写入日志，为假时是有序模式：数据块先写入卷镜像，再提交引用它们的日志记录
+JOURNAL_DATA = False
+# 磁盘块的数量和大小，可以用环境变量FS_BLOCK_NUM和FS_BLOCK_SIZE覆盖
+BLOCK_NUM = int(os.environ.get('FS_BLOCK_NUM', 1000))
+BLOCK_SIZE = int(os.environ.get('FS_BLOCK_SIZE', 10))
 # 保留区大小
-RESERVED_SIZE = 20
-# 文件描述符个数
-FD_NUM = 10
-# 文件分配到的磁盘块号数组的长度
-FILE_BLOCK_ARRAY_SIZE = 3
+RESERVED_SIZE = int(os.environ.get('FS_RESERVED_SIZE', 20))
+# 空闲块分配策略：first_fit/next_fit/best_fit
+ALLOC_POLICY = 'first_fit'
+# 磁盘块缓存的容量(块数)和淘汰策略：lru/clock
+CACHE_SIZE = 64
+CACHE_POLICY = 'lru'
+# 默认的压缩算法：none/zlib/lzma，可以用环境变量FS_COMPRESSION覆盖
+# 压缩文件按簇压缩，簇的大小(字节)和解压簇缓存的容量(簇数)
+COMPRESSION = os.environ.get('FS_COMPRESSION', 'none')
+CLUSTER_SIZE = 4096
+CLUSTER_CACHE_SIZE = 64
+# 是否懒挂载：挂载时只读入超级块、位图和索引节点表，数据块在第一次访问时才读入，
+# 可以用环境变量FS_LAZY_MOUNT=1打开
+LAZY_MOUNT = os.environ.get('FS_LAZY_MOUNT', '0') == '1'
+# 是否对未压缩文件的磁盘块按内容去重，可以用环境变量FS_DEDUP=1打开
+DEDUP = os.environ.get('FS_DEDUP', '0') == '1'
+# 顺序预读窗口的初始和最大块数
+READAHEAD_MIN = 4
+READAHEAD_MAX = 64
+# 文件描述符表的初始容量，可以用环境变量FS_FD_NUM覆盖，用完时自动扩大，最多FD_LIMIT个
+FD_NUM = int(os.environ.get('FS_FD_NUM', 10))
+FD_LIMIT = 1 << 32
+# 每个打开文件表中保持活动的句柄数，超出时按LRU淘汰空闲句柄，可以用环境变量FS_OPEN_FILE_MAX覆盖
+OPEN_FILE_MAX = int(os.environ.get('FS_OPEN_FILE_MAX', 1024))
 # 文件夹名称
 DIR_NAME = 'HOME'
-# 内存块大小和内容
+# 保存卷快照的顶层目录名
+SNAPSHOT_DIR = '.snapshots'
+# 目录项缓存容量
+DENTRY_CACHE_SIZE = 4096
+# 内存块大小
 MEM_SIZE = 100
-MEMORY = [str(i) for i in range(1, MEM_SIZE + 1)]
-# 磁盘
-DISK = [[0] * BLOCK_SIZE for i in range(BLOCK_NUM)]
-# 位图
-BIT_MAP = [0] * BLOCK_NUM
-# 已生成的全部文件
-CREATED_FILE = dict()
-# 打开文件表,有序字典
-OPEN_FILE_TABLE = OrderedDict()
+# 流式读取时每次产生的最大字节数
+STREAM_CHUNK = 1 << 16
+# 是否统计接口耗时，追踪事件最多保留的条数
+METRICS_ENABLED = True
+TRACE_SIZE = 1024
+
+
+# 方法装饰器，调用期间共享持有文件系统的命名空间锁，释放锁后等到本次操作的日志落盘才返回
+def shared(method):
+    @functools.wraps(method)
+    def locked(fs, *args, **kwargs):
+        journal = fs.journal
+        fs.namespace_lock.acquire_read()
+        try:
+            with journal.deferred():
+                result = method(fs, *args, **kwargs)
+        finally:
+            fs.namespace_lock.release_read()
+        journal.wait()
+        return result
+    return locked
+
+
+# 方法装饰器，调用期间独占持有文件系统的命名空间锁，释放锁后等到本次操作的日志落盘才返回
+def exclusive(method):
+    @functools.wraps(method)
+    def locked(fs, *args, **kwargs):
+        journal = fs.journal
+        fs.namespace_lock.acquire_write()
+        try:
+            with journal.deferred():
+                result = method(fs, *args, **kwargs)
+        finally:
+            fs.namespace_lock.release_write()
+        journal.wait()
+        return result
+    return locked
 
 
 # 文件类
 class File(object):
-    def __init__(self, fd, file_name, new=1):
-        # 文件描述符，磁盘块号列表
+    def __init__(self, fs, fd, file_name, new=1, codec=None):
+        # 所属文件系统，文件描述符，文件长度，块映射
+        self.fs = fs
         self.fd = fd
         self.file_name = file_name
-        self.block_array = list()
-        # 文件初始化即分配一个内存块
-        if new:
+        # 所在目录
+        self.parent = None
+        self.size = 0
+        self.block_array = ExtentMap()
+        # 压缩算法，None表示不压缩
+        self.codec = codec
+        # 压缩文件的各簇(物理区间列表，压缩后长度)，block_array按簇的顺序保存全部物理块
+        self.clusters = []
+        # 读文件时共享持有，写文件时独占持有
+        self.lock = RWLock()
+        # 文件初始化即分配一个内存块，压缩文件在写回簇时才分配
+        if new and codec is None:
             self.add_new_block()
 
     # 返回文件的第index块的内容
     def get_block(self, index):
         return self.block_array[index]
 
-    # 关闭文件时刷新某一文件的内容
-    def refresh_block(self, index, new_block):
-        self.block_array[index] = new_block
-
-    # 为文件添加新的磁盘块
-    def add_new_block(self):
-        # 寻找保留区后的第一个空闲块
-        new_block_index = BIT_MAP[RESERVED_SIZE:].index(0) + RESERVED_SIZE
-        logging.info(msg='为文件%s分配空闲块%d' % (self.file_name, new_block_index))
-        BIT_MAP[new_block_index] = 1
-        self.block_array.append(new_block_index)
+    # 为文件添加num个新的磁盘块
+    def add_new_block(self, num=1):
+        runs = self.fs.allocator.allocate_runs(num)
+        logging.info('为文件%s分配空闲区间%s', self.file_name, runs)
+        for start, length in runs:
+            self.block_array.add_run(start, length)
+        if self.fs.dedup is not None:
+            self.fs.dedup.acquire(from_runs(runs))
+
+    # 一次性分配足够存放length个字节的磁盘块，文件至少占用一块
+    def reserve(self, length):
+        if self.codec:
+            return
+        need = max(1, -(-length // self.fs.block_size)) - len(self.block_array)
+        if need > 0:
+            self.add_new_block(need)
 
     # 返回文件长度
     def get_file_length(self):
-        if self.block_array:
-            last_block_length = len([i for i in DISK[self.block_array[-1]] if i != 0])
-            return last_block_length + BLOCK_SIZE * (len(self.block_array) - 1)
-        else:
-            return 0
+        return self.size
 
     # 初始化文件，清空内容
     def initial(self):
-        for i in self.block_array[1:]:
-            BIT_MAP[i] = 0
-            DISK[i] = [0] * 10
-            logging.debug(msg='文件%s释放块%d' % (self.file_name, i))
-        self.block_array = [self.block_array[0]]
-        DISK[self.block_array[0]] = [0] * 10
+        fs = self.fs
+        if self.codec:
+            fs.cluster_cache.invalidate(self)
+            fs.release_blocks(self.block_array)
+            self.block_array = ExtentMap()
+            self.clusters = []
+            self.size = 0
+            return
+        if fs.dedup is not None:
+            # 第一块可能与其他文件共享，全部释放后重新分配一块
+            with fs.dedup.lock:
+                removed = fs.release_blocks(self.block_array)
+                self.block_array = ExtentMap()
+                self.add_new_block()
+        else:
+            removed = self.block_array.truncate(1)
+            fs.release_blocks(removed)
+        logging.debug('文件%s释放块%s', self.file_name, removed)
+        self.size = 0
+        fs.cache.invalidate(self.block_array[0])
+        fs.disk.clear(self.block_array[0])
+        fs.journal.log_block(self.block_array[0], b'')
 
 
 # 目录类
 class Directory(object):
-    file_num = 0
-    # 文件信息：文件描述符和文件描述符二元组列表
-    file_fd_name = list()
-
-    def __init__(self, fd, dir_name):
+    def __init__(self, fs, fd, dir_name, parent=None):
+        self.fs = fs
         self.name = dir_name
         self.fd = fd
+        self.parent = parent
+        # 目录项：文件名到文件描述符的字典
+        self.entries = dict()
 
-    # 添加文件到文件夹中
+    # 目录中的文件个数
+    @property
+    def file_num(self):
+        return len(self.entries)
+
+    # 添加文件或子目录到文件夹中
     def add_file(self, fd, file_name):
-        self.file_fd_name.append((fd, file_name))
-        self.file_num += 1
+        self.entries[file_name] = fd
+        self.fs.created_file[fd].parent = self
 
     # 根据文件名删除文件,返回文件描述符
     def delete_file(self, file_name):
-        fd = -1
-        for f in self.file_fd_name:
-            if f[1] == file_name:
-                fd = f[0]
-                target_file = CREATED_FILE[fd]
-                for i in target_file.block_array:
-                    BIT_MAP[i] = 0
-                    DISK[i] = [0] * 10
-                    logging.info(msg='释放内存块%d' % i)
-                CREATED_FILE.pop(fd)
-                self.file_fd_name.remove(f)
-                logging.info(msg='删除文件%s' % file_name)
-                self.file_num -= 1
-                return fd
-        if fd == -1:
+        fs = self.fs
+        fd = self.entries.get(file_name, -1)
+        if fd == -1 or not isinstance(fs.created_file[fd], File):
             logging.info(msg='待删除文件名不存在于文件夹%s中' % self.name)
-
-    # 依据文件名得到文件描述符
+            return -1
+        target_file = fs.created_file.pop(fd)
+        if target_file.codec:
+            fs.cluster_cache.invalidate(target_file)
+        fs.release_blocks(target_file.block_array)
+        del self.entries[file_name]
+        fs.dentry_cache.invalidate(fd)
+        logging.info('删除文件%s，释放磁盘块%s', file_name, target_file.block_array)
+        return fd
+
+    # 根据名称删除空的子目录,返回文件描述符
+    def delete_dir(self, dir_name):
+        fs = self.fs
+        fd = self.entries.get(dir_name, -1)
+        if fd == -1 or not isinstance(fs.created_file[fd], Directory):
+            logging.info(msg='待删除目录不存在于文件夹%s中' % self.name)
+            return -1
+        if fs.created_file[fd].entries:
+            logging.info(msg='目录%s不为空,无法删除' % dir_name)
+            return -1
+        fs.created_file.pop(fd)
+        del self.entries[dir_name]
+        fs.dentry_cache.invalidate(fd)
+        logging.info(msg='删除目录%s' % dir_name)
+        return fd
+
+    # 依据文件名得到文件描述符,不存在则返回-1
     def get_fd(self, file_name):
-        fd = -1
-        for f in self.file_fd_name:
-            if f[1] == file_name:
-                fd = f[0]
-                self.file_num -= 1
-                # 更新位图
-                return fd
-        if fd == -1:
-            raise Exception(msg='待删除文件名不存在于文件夹%s中' % self.name)
+        return self.entries.get(file_name, -1)
+
+    # 先序遍历目录树，返回(路径，文件或目录)
+    def walk(self, prefix=''):
+        created_file = self.fs.created_file
+        for name, fd in self.entries.items():
+            path = prefix + '/' + name
+            yield path, created_file[fd]
+            if isinstance(created_file[fd], Directory):
+                for item in created_file[fd].walk(path):
+                    yield item
+
+
+# 目录项缓存：路径到文件描述符，按LRU淘汰
+class DentryCache(object):
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        # 文件描述符到缓存路径的反向索引，用于删除时失效
+        self.paths = dict()
+        # 多个线程可以同时查找路径
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        with self._lock:
+            fd = self.entries.get(path)
+            if fd is not None:
+                self.entries.move_to_end(path)
+            return fd
+
+    def put(self, path, fd):
+        with self._lock:
+            self.entries[path] = fd
+            self.paths.setdefault(fd, set()).add(path)
+            if len(self.entries) > self.capacity:
+                old_path, old_fd = self.entries.popitem(last=False)
+                self.paths[old_fd].discard(old_path)
+
+    # 删除文件或目录时使其全部缓存路径失效
+    def invalidate(self, fd):
+        with self._lock:
+            for path in self.paths.pop(fd, ()):
+                self.entries.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.paths.clear()
 
 
 # 文件描述符类
+# fd[i]为1表示第i个描述符已使用，空闲描述符保存在栈中，分配和释放都是O(1)，
+# 描述符用完时容量翻倍，最多FD_LIMIT个
 class FileDescriptor(object):
-    def __init__(self, fd_num):
+    def __init__(self, fd_num, created_file):
         self.fd_num = fd_num
-        self.fd = [0] * fd_num
+        self.fd = bytearray(fd_num)
+        # 空闲描述符栈，栈顶是下一个分配的描述符
+        # 按指定描述符分配时栈中会留下已使用的项，取用时跳过
+        self.free = list(range(fd_num - 1, -1, -1))
+        self.used = 0
+        # 文件描述符到文件或目录对象
+        self.created_file = created_file
+
+    # 扩大到至少size个描述符，新增的描述符排在原有空闲描述符之后
+    def _grow(self, size):
+        size = min(max(size, self.fd_num * 2), FD_LIMIT)
+        self.free[:0] = range(size - 1, self.fd_num - 1, -1)
+        self.fd.extend(bytes(size - self.fd_num))
+        logging.info(msg='文件描述符表扩大到%d' % size)
+        self.fd_num = size
 
     # 返回未使用过的的文件描述符
     # 没有空闲的则返回-1
     def get_free_fd(self):
-        for cnt, fd in enumerate(self.fd):
-            if fd == 0:
-                return cnt
-        return -1
+        free = self.free
+        while free and self.fd[free[-1]]:
+            free.pop()
+        if not free:
+            if self.fd_num >= FD_LIMIT:
+                return -1
+            self._grow(self.fd_num * 2)
+        return free[-1]
 
     # 使用文件或者目录对象指针代替
     # 文件描述符列表中对应位置的0
     def fd_allocate(self, fd, file):
-        if fd < 0 or fd > self.fd_num - 1:
-            raise ValueError(msg='文件描述符必须在0~%d之间' % (self.fd_num - 1))
+        if fd < 0 or fd > FD_LIMIT - 1:
+            raise ValueError('文件描述符必须在0~%d之间' % (FD_LIMIT - 1))
+        if fd >= self.fd_num:
+            self._grow(fd + 1)
         if self.fd[fd] != 0:
-            raise Exception(msg='申请的文件描述符已被使用')
+            raise ValueError('申请的文件描述符已被使用')
 
         self.fd[fd] = 1
+        self.used += 1
+        if self.free and self.free[-1] == fd:
+            self.free.pop()
         # 将文件保存到产生的文件中
-        CREATED_FILE[fd] = file
+        self.created_file[fd] = file
 
     # 释放文件描述符
     def fd_release(self, fd):
         if fd < 0 or fd > self.fd_num - 1:
-            raise ValueError(msg='文件描述符必须在0~%d之间' %
-                                 (self.fd_num - 1))
+            raise ValueError('文件描述符必须在0~%d之间' % (self.fd_num - 1))
+        if self.fd[fd]:
+            self.used -= 1
+            self.free.append(fd)
         self.fd[fd] = 0
-        logging.info(msg='释放文件描述符%d' % fd)
+        logging.info('释放文件描述符%d', fd)
 
 
 # 打开文件对象
@@ -161,19 +343,15 @@ class OpenFile(object):
     write_ptr = 0
     # 表示缓冲区当前存放的是文件的第几块内容
     block_ptr = 0
-    # 读写互斥
-    read_flag = 0
-    write_flag = 0
 
-    def __init__(self, fd):
+    def __init__(self, fs, fd):
+        self.fs = fs
         self.fd = fd
-        self.file = CREATED_FILE[fd]
-        self.buffer = [i for i in DISK[self.file.block_array[0]] if i != 0]
-
-    # 将文件中的下一块的内容读到缓冲区中
-    def buffer_next_block(self):
-        self.block_ptr += 1
-        self.buffer = DISK[self.file.block_array[self.block_ptr]]
+        self.file = fs.created_file[fd]
+        # 预读窗口最多占用一半缓存，避免挤掉热点块
+        self.readahead = ReadAhead(READAHEAD_MIN, max(1, min(READAHEAD_MAX, fs.cache.capacity // 2)))
+        # 缓冲区是缓存中当前块的视图，读写时载入
+        self.buffer = None
 
     # 返回当前缓冲区存放的是文件内容的第几块
     def get_block_ptr(self):
@@ -187,334 +365,1796 @@ class OpenFile(object):
     def get_fd(self):
         return self.fd
 
-    # 将缓冲区的内容写入文件相应块
+    # 将数据写入缓冲区所在块的offset处
+    def write_buffer(self, data, offset):
+        cache = self.fs.cache
+        block = self.file.block_array[self.block_ptr]
+        cache.write(block, data, offset)
+        self.buffer = memoryview(cache.get(block))
+        self.fs.journal.log_block(block, self.buffer)
+
+    # 将文件在缓存中的脏块写回磁盘
     def dump_buffer(self):
-        DISK[self.file.block_array[self.block_ptr]][0:len(self.buffer)] = self.buffer
-        # 如果当前缓冲区是最后一块且已满，则再申请一块内容
-        if self.block_ptr == len(self.file.block_array) - 1 and len(self.buffer) == BLOCK_SIZE:
-            self.file.add_new_block()
-            self.block_ptr += 1
-            self.buffer = []
-
-    # 在缓冲区中载入最后一块内存
-    def buffer_tail_block(self):
-        self.buffer = [i for i in DISK[self.file.block_array[-1]] if i != 0]
-        self.block_ptr = len(self.file.block_array) - 1
+        if self.file.codec:
+            self.fs.cluster_cache.flush(self.file)
+        else:
+            self.fs.cache.flush(self.file.block_array)
+
+    # 在缓冲区中载入写指针所在的块
+    def buffer_write_block(self):
+        self.block_ptr = self.write_ptr // self.fs.block_size
+        self.buffer = memoryview(self.fs.cache.get(self.file.block_array[self.block_ptr]))
 
     # 为读操作重新设置缓冲区内容
     def read_buffer(self):
-        self.block_ptr = self.read_ptr // BLOCK_SIZE
-        self.buffer = [i for i in DISK[self.file.block_array[self.block_ptr]] if i != 0]
-
-    # 进入读状态
-    def enter_read(self):
-        if self.write_flag == 1:
+        self.block_ptr = self.read_ptr // self.fs.block_size
+        self.buffer = self.fs.fetch_block(self, self.block_ptr)
+
+
+# 打开文件表：文件描述符到打开文件句柄，一个线程或一个客户端连接使用一个
+# 最多保持capacity个活动句柄，超出时淘汰最久未使用的句柄：写回其脏块，只保留读写指针，
+# 再次访问时重建句柄，调用者看到的仍是同一个打开的文件。
+# 句柄记住打开时的文件对象，文件被删除后描述符可能被新文件重用，此时旧句柄作废，不会指向新文件
+class OpenTable(object):
+    def __init__(self, capacity=OPEN_FILE_MAX):
+        if capacity < 1:
+            raise ValueError('打开文件表至少保持1个活动句柄')
+        self.capacity = capacity
+        self.active = OrderedDict()
+        # 被淘汰的句柄：文件描述符到(文件系统，文件，读指针，写指针)
+        self.parked = dict()
+        self.evictions = 0
+
+    # 句柄是否仍属于描述符当前对应的文件，作废的句柄从表中删除
+    def _valid(self, fd):
+        opened = self.active.get(fd)
+        if opened is not None:
+            if opened.fs.created_file.get(fd) is opened.file:
+                return True
+            del self.active[fd]
             return False
+        parked = self.parked.get(fd)
+        if parked is not None:
+            if parked[0].created_file.get(fd) is parked[1]:
+                return True
+            del self.parked[fd]
+        return False
+
+    def __contains__(self, fd):
+        return self._valid(fd)
+
+    def __len__(self):
+        return len(self._fds())
+
+    def __iter__(self):
+        return iter(self._fds())
+
+    # 全部有效的描述符
+    def _fds(self):
+        return [fd for fd in list(self.active) + list(self.parked) if self._valid(fd)]
+
+    # 返回句柄并标记为最近使用，被淘汰的句柄在此重建
+    def __getitem__(self, fd):
+        if not self._valid(fd):
+            raise KeyError(fd)
+        opened = self.active.get(fd)
+        if opened is not None:
+            self.active.move_to_end(fd)
+            return opened
+        fs, file, read_ptr, write_ptr = self.parked.pop(fd)
+        opened = OpenFile(fs, fd)
+        opened.read_ptr = read_ptr
+        opened.write_ptr = write_ptr
+        self[fd] = opened
+        return opened
+
+    def __setitem__(self, fd, opened):
+        self.parked.pop(fd, None)
+        self.active[fd] = opened
+        self.active.move_to_end(fd)
+        while len(self.active) > self.capacity:
+            self.evict()
+
+    def pop(self, fd):
+        opened = self[fd]
+        del self.active[fd]
+        return opened
+
+    # 删除描述符对应的句柄，不存在时什么也不做
+    def discard(self, fd):
+        self.active.pop(fd, None)
+        self.parked.pop(fd, None)
+
+    def items(self):
+        return [(fd, self[fd]) for fd in self]
+
+    # 淘汰最久未使用的活动句柄，作废的句柄直接丢弃
+    def evict(self):
+        fd, opened = self.active.popitem(last=False)
+        if opened.fs.created_file.get(fd) is not opened.file:
+            return
+        with opened.file.lock.reading():
+            opened.dump_buffer()
+        self.parked[fd] = (opened.fs, opened.file, opened.read_ptr, opened.write_ptr)
+        self.evictions += 1
+
+
+# 批量操作：先排队，退出with时由文件系统一次检查、分配并应用，作为一个事务写入日志
+# with块中抛出异常时排队的操作全部丢弃
+class Batch(object):
+    def __init__(self, fs):
+        self.fs = fs
+        self.ops = []
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
         else:
-            self.read_flag = 1
-            return True
-
-    # 进入写状态
-    def enter_write(self):
-        if self.read_flag == 1:
-            return False
+            self.ops = []
+        return False
+
+    # codec为压缩算法，默认使用卷的设置
+    def create(self, file_name, codec=None):
+        self.ops.append(('create', file_name, codec))
+
+    def destroy(self, file_name):
+        self.ops.append(('destroy', file_name))
+
+    # 数据在排队时复制，调用者之后可以修改自己的缓冲区
+    def append_data(self, file_name, data):
+        self.ops.append(('append', file_name, bytes(data)))
+
+    def pwrite(self, file_name, offset, data):
+        self.ops.append(('pwrite', file_name, offset, bytes(data)))
+
+    # 应用排队的操作，返回操作个数，失败时已做的修改全部撤销并抛出IOError
+    def commit(self):
+        ops, self.ops = self.ops, []
+        return self.fs.apply_batch(ops) if ops else 0
+
+
+# 文件系统：一个卷的磁盘、缓存、分配器、目录树、打开文件表、日志和统计信息
+# root为卷镜像和日志所在的目录，一个进程中可以同时挂载多个文件系统
+# 给出disk_path时磁盘块映射到该文件，数据块不再写入卷镜像，多个进程可以共享同一个块存储，
+# 各自只在分配组group内分配磁盘块
+class FileSystem(object):
+    def __init__(self, root='.', block_num=BLOCK_NUM, block_size=BLOCK_SIZE, reserved=RESERVED_SIZE,
+                 fd_num=FD_NUM, cache_size=CACHE_SIZE, cache_policy=CACHE_POLICY,
+                 alloc_policy=ALLOC_POLICY, journal_data=JOURNAL_DATA, disk_path=None, group=None,
+                 compression=COMPRESSION, dedup=DEDUP, lazy=LAZY_MOUNT):
+        if compression not in CODECS:
+            raise ValueError('压缩算法必须是%s之一' % '/'.join(CODECS))
+        self.root = root
+        self.block_num = block_num
+        self.block_size = block_size
+        self.reserved = reserved
+        self.fd_num = fd_num
+        self.cache_size = cache_size
+        self.cache_policy = cache_policy
+        self.alloc_policy = alloc_policy
+        self.journal_data = journal_data
+        self.disk_path = disk_path
+        self.group = group
+        # 新建文件默认使用的压缩算法
+        self.compression = compression
+        # 是否按内容去重
+        self.deduplicate = dedup
+        # 是否懒挂载
+        self.lazy = lazy
+        self.image_path = os.path.join(root, IMAGE_NAME)
+        self.journal_path = os.path.join(root, JOURNAL_NAME)
+        self._setup()
+
+    # 建立未挂载时的空文件系统
+    def _setup(self):
+        self.mounted = False
+        # 内存块内容
+        self.memory = bytearray(range(1, MEM_SIZE + 1))
+        # 磁盘，全部磁盘块存放在一段连续内存中
+        self.disk = Disk(self.block_num, self.block_size, self.disk_path)
+        # 所有打开文件共享的磁盘块缓存
+        self.cache = BlockCache(self.disk, self.cache_size, self.cache_policy)
+        # 压缩文件的解压簇缓存
+        self.cluster_cache = ClusterCache(CLUSTER_CACHE_SIZE, self.load_cluster, self.store_cluster)
+        # 空闲块分配器和位图
+        self.allocator = Allocator(self.block_num, self.reserved, self.alloc_policy, self.group)
+        self.bit_map = self.allocator.bitmap
+        # 块引用计数和去重的内容索引，去重模式或有块被多个文件共享(克隆、快照)时才建立
+        self.dedup = None
+        # 已生成的全部文件
+        self.created_file = dict()
+        # 打开文件表,有序字典
+        self.open_file_table = OpenTable()
+        # 每个线程有自己的打开文件表，创建文件系统的线程使用open_file_table
+        self._local = threading.local()
+        self._local.table = self.open_file_table
+        # 命名空间锁：读写文件时共享持有，新建删除文件和目录、保存恢复卷时独占持有
+        self.namespace_lock = RWLock()
+        self.metrics = Metrics(METRICS_ENABLED, TRACE_SIZE)
+        self.file_descriptor = FileDescriptor(self.fd_num, self.created_file)
+        # 卷镜像和日志
+        self.volume = Volume(self.image_path)
+        self.journal = Journal(self.journal_path, self.journal_data)
+        # 有序模式下日志组落盘前先写数据块，写卷镜像时与dump_disk互斥
+        self.volume_lock = threading.Lock()
+        if not self.journal_data:
+            self.journal.before_sync = self.order_data
+        self.dentry_cache = DentryCache(DENTRY_CACHE_SIZE)
+        # 新建文件夹
+        self.directory = Directory(self, 0, DIR_NAME)
+        self.file_descriptor.fd_allocate(0, self.directory)
+        # 导出统计快照时收集各模块的统计信息
+        self.metrics.register('cache', self.cache.stats)
+        self.metrics.register('allocator', self.allocator.stats)
+        self.metrics.register('compression', self.compression_stats)
+        # 碎片整理器，整理时才建立
+        self.defragmenter = None
+        self.metrics.register('journal', lambda: {'records': self.journal.records, 'groups': self.journal.groups})
+        self.metrics.register('open_files', lambda: len(self.open_table()))
+        self.metrics.register('descriptors', lambda: {'capacity': self.file_descriptor.fd_num,
+                                                      'used': self.file_descriptor.used})
+
+    # 挂载：从卷镜像和日志恢复文件系统
+    def mount(self, alloc_policy=None):
+        if self.mounted:
+            raise IOError('%s已经挂载' % self.root)
+        self.load_disk(alloc_policy or self.alloc_policy)
+
+    # 卸载：保存到卷镜像，关闭卷镜像和日志，恢复为未挂载的空文件系统
+    def unmount(self):
+        if not self.mounted:
+            return
+        if self.defragmenter is not None:
+            self.defragmenter.stop()
+        self.dump_disk()
+        # 关闭中途出错时也恢复为未挂载状态
+        try:
+            self.disk.close()
+            self.journal.close()
+            self.volume.close()
+        finally:
+            self._setup()
+        logging.info(msg='卸载%s' % self.root)
+
+    # 返回当前线程的打开文件表
+    def open_table(self):
+        table = getattr(self._local, 'table', None)
+        if table is None:
+            table = self._local.table = OpenTable()
+        return table
+
+    # 让当前线程使用table作为打开文件表，多个客户端共用线程时由调用者切换
+    def use_table(self, table):
+        self._local.table = table
+
+    """""""""
+    IO系统
+    """""""""
+    # 读取磁盘块的内容num个字节到内存
+    def read_block(self, block_data, mem_begin, num):
+        if num + mem_begin > MEM_SIZE - 1:
+            raise IOError('写入内存位置不当，没有足够位置存储')
+        self.memory[mem_begin:mem_begin + num] = block_data[0:num]
+
+    # 为读操作取得文件第index块，顺序读时预读后续的块
+    def fetch_block(self, file_opened, index):
+        blocks = file_opened.file.block_array
+        window = file_opened.readahead.access(index, len(blocks))
+        if window:
+            self.cache.prefetch(blocks[window[0]:window[1]])
+        # 顺序读时读过的块很少再用，先于预读的块淘汰
+        if file_opened.readahead.window and index > 0:
+            self.cache.demote(blocks[index - 1])
+        return memoryview(self.cache.get(blocks[index]))
+
+    # 保存内存内容mem_begin开始num个字节到磁盘块，这里返回是交给打开文件的缓冲区处理
+    def write_block(self, mem_begin, num):
+        if num + mem_begin > MEM_SIZE - 1:
+            logging.info(msg='读取内存位置不当，没有足够字节内容')
+            return 0
+        return self.memory[mem_begin:mem_begin + num]
+
+    # 返回内存中begin开始num个字节的内容，用于日志输出
+    def memory_text(self, begin, num):
+        return ' '.join(map(str, self.memory[begin:begin + num]))
+
+    # 返回文件的全部内容，用于日志输出
+    def file_text(self, file):
+        buffer = bytearray(file.size)
+        self.read_range(file, 0, buffer)
+        return ' '.join(map(str, buffer))
+
+    # 返回文件或目录的索引节点记录
+    def inode_record(self, file):
+        if not isinstance(file, File):
+            return file.fd, file.parent.fd, TYPE_DIR, file.name, 0, [], 0, []
+        if file.codec is None:
+            return file.fd, file.parent.fd, TYPE_FILE, file.file_name, file.size, file.block_array.runs, 0, []
+        # 簇信息可能正在被淘汰写回修改
+        with self.cluster_cache.lock:
+            return (file.fd, file.parent.fd, TYPE_FILE, file.file_name, file.size, list(file.block_array.runs),
+                    CODECS.index(file.codec), [length for runs, length in file.clusters])
+
+    # 依据索引节点记录新建文件，版本1的记录没有文件长度，按最后一块中的非0字节数推算
+    # 压缩文件的块按簇的顺序排列，依据各簇压缩后的长度切分
+    def inode_file(self, fd, name, size, runs, codec=0, clusters=()):
+        file = File(self, fd, name, new=0, codec=CODECS[codec] if codec else None)
+        file.block_array = ExtentMap(runs)
+        if size is None and len(file.block_array):
+            size = self.block_size * (len(file.block_array) - 1) + self.disk.used(file.block_array[-1])
+        file.size = size or 0
+        pos = 0
+        for length in clusters:
+            num = -(-length // self.block_size)
+            file.clusters.append((to_runs(file.block_array.blocks(pos, pos + num)), length))
+            pos += num
+        return file
+
+    # 释放文件不再使用的块并清空，返回归还分配器的块
+    # 建立引用计数后只有引用计数减到0的块才归还
+    def release_blocks(self, blocks):
+        if self.dedup is not None:
+            with self.dedup.lock:
+                blocks = self.dedup.release(blocks)
+        self.allocator.free(blocks)
+        for i in blocks:
+            self.cache.invalidate(i)
+            self.disk.clear(i)
+        return blocks
+
+    # 依据全部文件建立块的引用计数，去重模式下再登记未压缩文件中写满的块
+    # force为假时只在有块被多个文件引用时才建立，懒挂载时不读块内容，块在重写后才登记
+    def enable_refs(self, force=True):
+        if self.dedup is not None:
+            return
+        files = [file for path, file in self.directory.walk() if isinstance(file, File)]
+        if not force and not self._blocks_shared(files):
+            return
+        dedup = DedupIndex(self.block_num)
+        for file in files:
+            dedup.acquire(file.block_array)
+        if self.deduplicate and not self.lazy:
+            for file in files:
+                if file.codec:
+                    continue
+                for block in file.block_array.blocks(0, file.size // self.block_size):
+                    if not dedup.keys[block]:
+                        dedup.add(block, dedup.key(self.disk[block]))
+        self.dedup = dedup
+        self.metrics.register('dedup', dedup.stats)
+        logging.info(msg='建立块引用计数%s' % dedup.stats())
+
+    # 是否有区间重叠，即有块被多个文件引用，只比较区间不展开块
+    def _blocks_shared(self, files):
+        end = -1
+        for start, num in sorted(run for file in files for run in file.block_array.runs):
+            if start < end:
+                return True
+            end = start + num
+        return False
+
+    # 返回块的当前内容，缓存中的脏数据优先
+    def block_content(self, block):
+        entry = self.cache.peek(block)
+        return self.disk[block] if entry is None else memoryview(entry)
+
+    # 建立引用计数后写入文件第index块的begin处
+    # 共享的块先复制一份再写，去重模式下写到块末尾后按内容查找相同的块，找到则改为引用该块
+    def _shared_write(self, file, index, begin, data):
+        dedup = self.dedup
+        with dedup.lock:
+            block = file.block_array[index]
+            if dedup.shared(block):
+                copy = self.allocator.allocate_runs(1)[0][0]
+                self.disk[copy] = self.block_content(block)
+                dedup.acquire([copy])
+                dedup.copies += 1
+                file.block_array[index] = copy
+                self.release_blocks([block])
+                block = copy
+            else:
+                dedup.remove(block)
+            self._write_block(block, data, begin)
+            if not self.deduplicate or begin + len(data) < self.block_size:
+                return
+            content = self.block_content(block)
+            key = dedup.key(content)
+            for other in dedup.candidates(key):
+                if other != block and self.block_content(other) == content:
+                    dedup.acquire([other])
+                    dedup.hits += 1
+                    file.block_array[index] = other
+                    self.release_blocks([block])
+                    return
+            dedup.add(block, key)
+
+    # 读出压缩文件第index簇的压缩数据，簇不存在时返回None
+    def load_cluster(self, file, index):
+        if index >= len(file.clusters) or not file.clusters[index][1]:
+            return None
+        runs, length = file.clusters[index]
+        data = b''.join(self.disk.read_run(start, num) for start, num in runs)
+        return file.codec, data[:length]
+
+    # 为压缩后的簇分配新的磁盘块写入，再释放原来的块
+    def store_cluster(self, file, index, data):
+        block_size = self.block_size
+        runs = self.allocator.allocate_runs(-(-len(data) // block_size))
+        pos = 0
+        for start, num in runs:
+            for block in range(start, start + num):
+                self.disk[block] = data[pos:pos + block_size]
+                self.journal.log_block(block, self.disk[block])
+                pos += block_size
+        if self.dedup is not None:
+            self.dedup.acquire(from_runs(runs))
+        # 淘汰顺序与簇序号无关，前面尚未写回的簇先占位
+        while len(file.clusters) < index:
+            file.clusters.append(([], 0))
+        if index < len(file.clusters):
+            old = file.clusters[index][0]
+            file.clusters[index] = (runs, len(data))
+            self.release_blocks(from_runs(old))
+            file.block_array = ExtentMap(run for item in file.clusters for run in item[0])
         else:
-            self.write_flag = 1
-            return True
-
-"""""""""
-IO系统
-"""""""""
-# 读取磁盘块的内容num个字节到内存
-def read_block(block_data, mem_begin, num):
-    if num + mem_begin > MEM_SIZE - 1:
-        raise IOError('写入内存位置不当，没有足够位置存储')
-    MEMORY[mem_begin:mem_begin + num] = block_data[0:num]
-# 保存内存内容mem_begin开始num个字节到磁盘块，这里返回是交给打开文件的缓冲区处理
-def write_block(mem_begin, num):
-    if num + mem_begin > MEM_SIZE - 1:
-        logging.info(msg='读取内存位置不当，没有足够字节内容')
-        return 0
-    return MEMORY[mem_begin:mem_begin + num]
-
-
-# 将磁盘内容保存到文件中
-def dump_disk():
-    # 保存磁盘内容
-    disk = ''
-    for block in DISK:
-        disk += '\t'.join([str(i) for i in block]) + '\n'
-    with open('disk.txt', 'w')as f:
-        f.write(disk)
-    # 保存文件
-    file_info = '',
-    for fd, file in CREATED_FILE.items():
-        if isinstance(file, File):
-            file_info += str(fd) + ' ' + file.file_name + ' ' + \
-                         ' '.join([str(i) for i in file.block_array]) + '\n'
-    with open('file.txt', 'w') as f:
-        f.write(file_info)
-    logging.info(msg='将磁盘和文件保存到本地文件中')
-
-
-# 将文件内容恢复到磁盘
-def load_disk():
-    # 恢复磁盘文件
-    disk_file = 'disk.txt'
-    file_file = 'file.txt'
-    if disk_file in os.listdir('.') and file_file in os.listdir('.'):
-        global DISK
-        with open('disk.txt', 'r')as f:
-            disk = [block.strip().split('\t') for block in f.readlines()]
-        for cnt, block in enumerate(disk):
-            DISK[cnt] = list(map(lambda x: int(x) if x == '0' else x, block))
-
-        # 恢复创建的文件
-        with open('file.txt', 'r')as f:
-            file = [line.strip().split() for line in f.readlines()]
-        CREATED_FILE[0] = directory
-        for line in file:
-            new_file = File(int(line[0]), line[1], new=0)
-            new_file.block_array = [int(i) for i in line[2:]]
-            for i in new_file.block_array:
-                BIT_MAP[i] = 1
-            file_descriptor.fd_allocate(int(line[0]), new_file)
-            directory.add_file(int(line[0]), line[1])
-
-
-"""""""""""""""
-用户与文件系统接口
-"""""""""""""""
-
-# 根据文件名创建文件
-def create(file_name):
-    # 检查文件名是否存在
-    if file_name in [f[1] for f in directory.file_fd_name]:
-        logging.info(msg='文件名%s已存在,新建失败' % file_name)
-        return 0
-    free_fd = file_descriptor.get_free_fd()
-    if free_fd == -1:
-        logging.info(msg='没有空余的文件描述符可以使用')
-        return 0
-    new_file = File(free_fd, file_name)
-    # 用新的文件替换原来文件描述符
-    file_descriptor.fd_allocate(free_fd, new_file)
-    directory.add_file(free_fd, file_name)
-    logging.info(msg='文件%s新建成功，文件描述符为%d\n' % (file_name, free_fd))
-    return 1
-
-
-# 根据文件名删除文件
-def destroy(file_name):
-    fd = directory.delete_file(file_name)
-    file_descriptor.fd_release(fd)
-
-
-# 打开文件
-def open_file(file_name):
-    if file_name not in [f[1] for f in directory.file_fd_name]:
-        logging.info(msg='文件%s不存在,无法打开' % file_name)
-        return 0
-    fd = directory.get_fd(file_name)
-    file_opened = OpenFile(fd)
-    OPEN_FILE_TABLE[fd] = file_opened
-    logging.info(msg='成功打开文件%s' % file_name)
-    return 1
-
-# 关闭文件
-def close_file(file_name):
-    if file_name not in [f[1] for f in directory.file_fd_name]:
-        logging.info(msg='文件%s不存在' % file_name)
-        return 0
-    fd = directory.get_fd(file_name)
-    if fd not in OPEN_FILE_TABLE.keys():
-        logging.info(msg='文件%s未打开' % file_name)
-        return 0
-    file_opened = OPEN_FILE_TABLE[fd]
-    file_opened.dump_buffer()
-    OPEN_FILE_TABLE.pop(fd)
-    logging.info(msg='成功关闭文件%s' % file_name)
-
-
-# 从指定文件读取num个字节到mem_begin开始的内存区中
-def read(file_name, mem_begin, num):
-    # 判断文件是否存在
-    if file_name not in [f[1] for f in directory.file_fd_name]:
-        logging.info(msg='文件%s不存在' % file_name)
-        return 0
-    # 判断文件是否打开
-    fd = directory.get_fd(file_name)
-    if fd not in OPEN_FILE_TABLE.keys():
-        logging.info(msg='文件%s未打开,无法写' % file_name)
-        return 0
-    file_opened = OPEN_FILE_TABLE[fd]
-    # 判断文件是否在写
-    if not file_opened.enter_read():
-        logging.info(msg='正在写文件，不可读')
-        return 0
-    file_length = file_opened.file.get_file_length()
-    # 如果请求的大小超过了文件的长度则视为读取整个文件
-    num = min(num, file_length)
-    # 重新设置缓冲区
-    file_opened.read_buffer()
-    contents = []
-    while num:
-        # 读指针在当前缓冲区的位置
-        buffer_read_pos = file_opened.read_ptr % BLOCK_SIZE
-        if num + buffer_read_pos >= BLOCK_SIZE:
-            read_block(file_opened.get_buffer()[buffer_read_pos:], mem_begin, BLOCK_SIZE - buffer_read_pos)
-            contents += file_opened.get_buffer()[buffer_read_pos:]
-            file_opened.buffer_next_block()
-            num -= BLOCK_SIZE - buffer_read_pos
-            file_opened.read_ptr += BLOCK_SIZE - buffer_read_pos
-        elif 0 < num + buffer_read_pos < BLOCK_SIZE:
-            read_block(file_opened.get_buffer()[buffer_read_pos:], mem_begin, num)
-            contents += file_opened.get_buffer()[buffer_read_pos:buffer_read_pos + num]
-            file_opened.read_ptr += num
-            num = 0
-    logging.debug(msg='读取文件%s信息%s' % (file_opened.file.file_name, ' '.join(contents)))
-
-
-# 将内存数据添加到文件中,不覆盖原来的内容
-def append(file_name, begin, num):
-    # 判断文件是否存在
-    if file_name not in [f[1] for f in directory.file_fd_name]:
-        logging.info(msg='文件%s不存在' % file_name)
-        return 0
-    # 判断文件是否打开
-    fd = directory.get_fd(file_name)
-    if fd not in OPEN_FILE_TABLE.keys():
-        logging.info(msg='文件%s未打开,无法写' % file_name)
-        return 0
-    file_opened = OPEN_FILE_TABLE[fd]
-    # 判断文件是否在读
-    if not file_opened.enter_write():
-        logging.info(msg='正在读文件，不可写')
-        return 0
-    file_opened.write_ptr = file_opened.file.get_file_length()
-    write_info = []
-    while num:
-        file_opened.buffer_tail_block()
-        buffer = file_opened.get_buffer()
-        if num + len(buffer) >= BLOCK_SIZE:
-            write_size = BLOCK_SIZE - len(buffer)
-            buffer += write_block(begin, write_size)
-            write_info += buffer[-write_size:]
-            num -= write_size
-            begin += write_size
-            file_opened.dump_buffer()
-            file_opened.write_ptr += BLOCK_SIZE
-        elif num + len(buffer) < BLOCK_SIZE:
-            buffer += write_block(begin, num)
-            write_info += buffer[-num:]
-            num = 0
-            begin += num
-            file_opened.write_ptr += num
-    logging.info(msg='向文件%s添加%s' % (file_name, ' '.join(write_info)))
-
-
-# 将内存内容写入到文件中，覆盖原文件
-def write(file_name, begin, num):
-    # 判断文件是否存在
-    if file_name not in [f[1] for f in directory.file_fd_name]:
-        logging.info(msg='文件%s不存在' % file_name)
-        return 0
-    # 判断文件是否打开
-    fd = directory.get_fd(file_name)
-    if fd not in OPEN_FILE_TABLE.keys():
-        logging.info(msg='文件%s未打开,无法写' % file_name)
-        return 0
-    file_opened = OPEN_FILE_TABLE[fd]
-    # 判断文件是否在读
-    if not file_opened.enter_write():
-        logging.info(msg='正在读文件，不可写')
-        return 0
-    # 初始化文件
-    if file_opened.file.get_file_length() != 0:
-        file_opened.file.initial()
-    write_info = []
-    while num:
-        file_opened.buffer_tail_block()
-        buffer = file_opened.get_buffer()
-        if num + len(buffer) >= BLOCK_SIZE:
-            write_size = BLOCK_SIZE - len(buffer)
-            buffer += write_block(begin, write_size)
-            write_info += buffer[-write_size:]
-            num -= write_size
-            begin += write_size
+            file.clusters.append((runs, len(data)))
+            for start, num in runs:
+                file.block_array.add_run(start, num)
+        self.journal.log_inode(pack_inodes([self.inode_record(file)]))
+
+    # 压缩统计：解压簇缓存的命中和压缩耗时，以及压缩文件当前的逻辑和物理字节数
+    def compression_stats(self):
+        stats = self.cluster_cache.stats()
+        files = [file for file in list(self.created_file.values()) if isinstance(file, File) and file.codec]
+        logical = sum(file.size for file in files)
+        physical = sum(len(file.block_array) for file in files) * self.block_size
+        stats.update({
+            'default': self.compression,
+            'files': len(files),
+            'logical_bytes': logical,
+            'physical_bytes': physical,
+            'volume_ratio': logical / physical if physical else 0.0,
+        })
+        return stats
+
+    # 生成索引节点表，父目录总在子项之前
+    def inode_table(self):
+        return pack_inodes([self.inode_record(file) for path, file in self.directory.walk()])
+
+    # 将磁盘内容保存到卷镜像中，只写回上次保存后修改过的块
+    @exclusive
+    def dump_disk(self):
+        bit_map = self.bit_map
+        with self.volume_lock:
+            # 先将压缩文件的脏簇和缓存中的脏块写回磁盘
+            self.cluster_cache.flush()
+            self.cache.flush()
+            if self.volume.fd == -1:
+                self.volume.create(self.block_num, self.block_size, self.reserved)
+                # 新镜像需要完整的位图
+                bit_map.dirty.update(range(len(bit_map.words)))
+            if self.disk_path is None:
+                blocks = self.disk.dirty
+            else:
+                # 共享块存储中的数据块由mmap写回
+                self.disk.flush()
+                blocks = ()
+            self.volume.flush(self.disk.data, blocks, bit_map.words, bit_map.dirty, self.inode_table())
+            self.disk.dirty.clear()
+            bit_map.dirty.clear()
+        # 卷镜像已包含日志中的全部修改
+        self.journal.checkpoint()
+        logging.info(msg='将磁盘和文件保存到卷镜像%s中' % self.image_path)
+
+    # 有序模式下日志组落盘前调用：先将脏簇和缓存中的脏块写回磁盘，再把修改过的数据块写入卷镜像并fdatasync，
+    # 崩溃后重放的索引节点记录不会指向尚未写入的数据
+    def order_data(self):
+        with self.volume_lock:
+            self.cluster_cache.flush()
+            self.cache.flush()
+            if self.disk_path is not None:
+                self.disk.flush()
+                return
+            blocks, self.disk.dirty = self.disk.dirty, set()
+            self.volume.write_blocks(self.disk.data, blocks)
+            self.volume.sync()
+
+    # 将卷镜像内容恢复到磁盘，alloc_policy为挂载后使用的分配策略
+    @exclusive
+    def load_disk(self, alloc_policy=ALLOC_POLICY):
+        volume = self.volume
+        self.allocator.set_policy(alloc_policy)
+        if volume.exists():
+            volume.open()
+            if (volume.block_num, volume.block_size, volume.reserved) != (self.block_num, self.block_size,
+                                                                          self.reserved):
+                volume.close()
+                raise IOError('卷镜像%s的磁盘参数与当前设置不一致' % self.image_path)
+            # 位图直接从位图区恢复，不再遍历全部文件
+            self.bit_map.load(volume.read_bitmap())
+            self.allocator.rebuild_extents()
+            if self.disk_path is None:
+                data = volume.map_blocks() if self.lazy else None
+                if data is not None:
+                    self.disk.attach(data)
+                else:
+                    volume.read_blocks(self.disk.data)
+            for fd, parent_fd, kind, name, size, runs, codec, clusters in unpack_inodes(volume.read_inodes(),
+                                                                                        volume.version):
+                if kind == TYPE_DIR:
+                    new_file = Directory(self, fd, name)
+                else:
+                    new_file = self.inode_file(fd, name, size, runs, codec, clusters)
+                self.file_descriptor.fd_allocate(fd, new_file)
+                self.created_file[parent_fd].add_file(fd, name)
+            self.disk.dirty.clear()
+            logging.info(msg='从卷镜像%s恢复磁盘和文件' % self.image_path)
+        # 兼容旧的文本格式，下次保存时转换为卷镜像
+        elif os.path.exists(os.path.join(self.root, 'disk.txt')) and \
+                os.path.exists(os.path.join(self.root, 'file.txt')):
+            with open(os.path.join(self.root, 'disk.txt'), 'r')as f:
+                disk = [block.strip().split('\t') for block in f.readlines()]
+            for cnt, block in enumerate(disk):
+                self.disk[cnt] = bytes(map(int, block))
+
+            # 恢复创建的文件
+            with open(os.path.join(self.root, 'file.txt'), 'r')as f:
+                file = [line.strip().split() for line in f.readlines()]
+            used_blocks = []
+            for line in file:
+                parent, name = self.resolve(line[1])
+                if line[1].endswith('/'):
+                    new_file = Directory(self, int(line[0]), name)
+                else:
+                    blocks = [int(i) for i in line[2:]]
+                    new_file = self.inode_file(int(line[0]), name, None, [(block, 1) for block in blocks])
+                    used_blocks += blocks
+                self.file_descriptor.fd_allocate(int(line[0]), new_file)
+                parent.add_file(int(line[0]), name)
+            self.allocator.mark_used(used_blocks)
+        self.enable_refs(self.deduplicate)
+        # 重放上次未同步到卷镜像的日志
+        self.journal.open()
+        self.mounted = True
+        if os.path.getsize(self.journal_path):
+            self.replay_journal()
+            self.dump_disk()
+        elif self.volume.fd == -1 and not self.journal_data:
+            # 有序模式下数据块随日志组写入卷镜像，新卷挂载时就建立镜像
+            self.dump_disk()
+
+    # 重放日志，返回重放的记录数
+    def replay_journal(self):
+        num = 0
+        for kind, body in self.journal.replay():
+            if kind == REC_INODE:
+                self.apply_inode(body)
+            elif kind == REC_FREE:
+                self.apply_free(FD.unpack(body)[0])
+            elif kind == REC_BLOCK:
+                self.disk[FD.unpack_from(body)[0]] = body[FD.size:]
+            num += 1
+        logging.info(msg='从日志%s重放%d条记录' % (self.journal_path, num))
+        return num
+
+    # 依据日志中的索引节点记录新建或更新文件和目录
+    def apply_inode(self, record):
+        for fd, parent_fd, kind, name, size, runs, codec, clusters in unpack_inodes(record):
+            old = self.created_file.get(fd)
+            blocks = from_runs(runs)
+            if isinstance(old, File) and kind == TYPE_FILE:
+                owned = set(old.block_array)
+                if any(self.bit_map[i] for i in blocks if i not in owned):
+                    self.enable_refs()
+                # 只调整分配情况，不改动块中的数据
+                self.allocator.claim([i for i in set(blocks) if not self.bit_map[i]])
+                if self.dedup is not None:
+                    # 其他文件仍在引用的块不能释放
+                    self.dedup.acquire(blocks)
+                    self.dedup.release(old.block_array)
+                    self.allocator.free([i for i in set(old.block_array) if not self.dedup.refs[i]])
+                else:
+                    self.allocator.free(set(old.block_array) - set(blocks))
+                new = self.inode_file(fd, name, size, runs, codec, clusters)
+                self.cluster_cache.invalidate(old)
+                old.block_array, old.size, old.codec, old.clusters = new.block_array, new.size, new.codec, new.clusters
+                continue
+            if old is not None:
+                self.apply_free(fd)
+            if kind == TYPE_DIR:
+                new_file = Directory(self, fd, name)
+            else:
+                new_file = self.inode_file(fd, name, size, runs, codec, clusters)
+                # 克隆出的文件与已有文件共享块
+                if any(self.bit_map[i] for i in blocks):
+                    self.enable_refs()
+                self.allocator.claim([i for i in set(blocks) if not self.bit_map[i]])
+                if self.dedup is not None:
+                    self.dedup.acquire(blocks)
+            self.file_descriptor.fd_allocate(fd, new_file)
+            self.created_file[parent_fd].add_file(fd, name)
+
+    # 依据日志中的删除记录删除文件或目录
+    def apply_free(self, fd):
+        old = self.created_file.get(fd)
+        if old is None:
+            return
+        if isinstance(old, File):
+            old.parent.delete_file(old.file_name)
+        else:
+            old.parent.delete_dir(old.name)
+        self.file_descriptor.fd_release(fd)
+
+    # 将尚未提交的日志立即写入磁盘
+    def sync(self):
+        self.journal.commit(force=True)
+
+    # 碎片统计：每个文件的块数、区间数和第一块，整个卷的区间数和空闲区间情况
+    @shared
+    def fragmentation(self):
+        files = {}
+        for path, item in self.directory.walk():
+            if isinstance(item, File) and len(item.block_array):
+                runs = item.block_array.runs
+                files[path] = {'blocks': len(item.block_array), 'extents': len(runs), 'start': runs[0][0]}
+        extents = sum(item['extents'] for item in files.values())
+        allocator = self.allocator.stats()
+        return {
+            'files': files,
+            'fragmented_files': sum(1 for item in files.values() if item['extents'] > 1),
+            # 每个文件只占一个区间时为0
+            'extra_extents': extents - len(files),
+            'extents_per_file': extents / len(files) if files else 0.0,
+            'free_blocks': allocator['free'],
+            'free_extents': allocator['extents'],
+            'largest_free_extent': allocator['largest_extent'],
+        }
+
+    # 将文件搬到一段连续的空闲区间，完成后一次替换块映射，返回搬移的块数
+    # compact为真时搬到最靠前的空闲区间，已连续的文件只在能前移时搬移
+    # 压缩文件和与其他文件共享块的文件不搬移
+    @shared
+    def relocate_file(self, path, compact=False):
+        fd = self.lookup_file(path)
+        if fd == -1:
+            return 0
+        file = self.created_file[fd]
+        with file.lock.writing():
+            blocks = list(file.block_array)
+            runs = file.block_array.runs
+            if file.codec or not blocks or (len(runs) == 1 and not compact):
+                return 0
+            if self.dedup is not None and any(self.dedup.shared(block) for block in blocks):
+                return 0
+            try:
+                if len(runs) > 1:
+                    new = self.allocator.allocate_runs(len(blocks), True, self.block_num if compact else None)
+                else:
+                    new = self.allocator.allocate_runs(len(blocks), True, runs[0][0])
+            except IOError:
+                return 0
+            start = new[0][0]
+            for offset, block in enumerate(blocks):
+                self.disk[start + offset] = self.block_content(block)
+                self.journal.log_block(start + offset, self.disk[start + offset])
+            if self.dedup is not None:
+                self.dedup.acquire(range(start, start + len(blocks)))
+            file.block_array = ExtentMap(new)
+            self.release_blocks(blocks)
+            self.journal.log_inode(pack_inodes([self.inode_record(file)]))
+        self.journal.commit()
+        logging.debug('文件%s搬到区间%s', path, new)
+        return len(blocks)
+
+    # 碎片整理：background为假时整理完成后返回搬移的块数，为真时在后台线程中按budget分轮整理
+    def defrag(self, background=False, budget=DEFRAG_BUDGET, compact=False):
+        if self.defragmenter is not None:
+            self.defragmenter.stop()
+        self.defragmenter = Defragmenter(lambda: self.fragmentation()['files'], self.relocate_file,
+                                         budget, compact=compact)
+        self.metrics.register('defrag', self.defragmenter.stats)
+        if background:
+            self.defragmenter.start()
+            return 0
+        moved = self.defragmenter.run()
+        report = self.fragmentation()
+        del report['files']
+        logging.info(msg='碎片整理搬移%d块，%s' % (moved, report))
+        return moved
+
+    # 开启或关闭接口调用追踪，rate为采样率，0表示关闭
+    def set_trace(self, rate):
+        if rate:
+            self.metrics.tracer.start(rate)
+        else:
+            self.metrics.tracer.stop()
+
+    # 将统计快照导出到文件，或以'tcp:主机:端口'、'unix:路径'的形式导出到套接字
+    def export_metrics(self, target):
+        self.metrics.export(target)
+        logging.info('统计信息已导出到%s', target)
+
+    # 将路径拆分为所在目录和最后一级名称，所在目录不存在时返回(None, 名称)
+    # 路径以/分隔，相对路径从根目录开始解析
+    def resolve(self, path):
+        names = [name for name in path.split('/') if name and name != '.']
+        if not names:
+            return None, ''
+        current = self.directory
+        for name in names[:-1]:
+            if name == '..':
+                current = current.parent or current
+                continue
+            fd = current.entries.get(name, -1)
+            if fd == -1 or not isinstance(self.created_file[fd], Directory):
+                return None, names[-1]
+            current = self.created_file[fd]
+        return current, names[-1]
+
+    # 依据路径得到文件或目录的文件描述符，不存在则返回-1
+    def lookup(self, path):
+        fd = self.dentry_cache.get(path)
+        if fd is not None:
+            return fd
+        parent, name = self.resolve(path)
+        if parent is None:
+            # 根目录
+            return self.directory.fd if not name else -1
+        if name == '..':
+            fd = (parent.parent or parent).fd
+        else:
+            fd = parent.entries.get(name, -1)
+        if fd != -1:
+            self.dentry_cache.put(path, fd)
+        return fd
+
+    # 依据路径得到普通文件的文件描述符，不存在或不是文件则返回-1
+    def lookup_file(self, path):
+        fd = self.lookup(path)
+        if fd != -1 and not isinstance(self.created_file[fd], File):
+            return -1
+        return fd
+
+    """""""""""""""
+    用户与文件系统接口
+    """""""""""""""
+
+    # 根据文件名创建文件，codec为压缩算法，默认使用卷的设置
+    @timed('create')
+    @exclusive
+    def create(self, file_name, codec=None):
+        codec = codec or self.compression
+        if codec not in CODECS:
+            logging.info(msg='压缩算法必须是%s之一' % '/'.join(CODECS))
+            return 0
+        parent, name = self.resolve(file_name)
+        if parent is None:
+            logging.info(msg='文件%s所在目录不存在,新建失败' % file_name)
+            return 0
+        # 检查文件名是否存在
+        if name in parent.entries:
+            logging.info(msg='文件名%s已存在,新建失败' % file_name)
+            return 0
+        free_fd = self.file_descriptor.get_free_fd()
+        if free_fd == -1:
+            logging.info(msg='没有空余的文件描述符可以使用')
+            return 0
+        new_file = File(self, free_fd, name, codec=None if codec == 'none' else codec)
+        # 用新的文件替换原来文件描述符
+        self.file_descriptor.fd_allocate(free_fd, new_file)
+        parent.add_file(free_fd, name)
+        self.journal.log_inode(pack_inodes([self.inode_record(new_file)]))
+        self.journal.commit()
+        logging.info('文件%s新建成功，文件描述符为%d\n', file_name, free_fd)
+        return 1
+
+    # 根据文件名删除文件
+    @timed('destroy')
+    @exclusive
+    def destroy(self, file_name):
+        parent, name = self.resolve(file_name)
+        if parent is None:
+            logging.info(msg='文件%s不存在' % file_name)
+            return 0
+        fd = parent.delete_file(name)
+        if fd == -1:
+            return 0
+        # 描述符释放后可能被新文件重用，本线程的句柄先删除，其他表中的句柄在访问时作废
+        self.open_table().discard(fd)
+        self.file_descriptor.fd_release(fd)
+        self.journal.log_free(fd)
+        self.journal.commit()
+        return 1
+
+    # 新建目录
+    @exclusive
+    def mkdir(self, dir_name):
+        parent, name = self.resolve(dir_name)
+        if parent is None:
+            logging.info(msg='目录%s的上级目录不存在,新建失败' % dir_name)
+            return 0
+        if name in parent.entries:
+            logging.info(msg='目录名%s已存在,新建失败' % dir_name)
+            return 0
+        free_fd = self.file_descriptor.get_free_fd()
+        if free_fd == -1:
+            logging.info(msg='没有空余的文件描述符可以使用')
+            return 0
+        new_dir = Directory(self, free_fd, name)
+        self.file_descriptor.fd_allocate(free_fd, new_dir)
+        parent.add_file(free_fd, name)
+        self.journal.log_inode(pack_inodes([self.inode_record(new_dir)]))
+        self.journal.commit()
+        logging.info(msg='目录%s新建成功，文件描述符为%d' % (dir_name, free_fd))
+        return 1
+
+    # 删除空目录
+    @exclusive
+    def rmdir(self, dir_name):
+        parent, name = self.resolve(dir_name)
+        if parent is None:
+            logging.info(msg='目录%s不存在' % dir_name)
+            return 0
+        fd = parent.delete_dir(name)
+        if fd == -1:
+            return 0
+        self.file_descriptor.fd_release(fd)
+        self.journal.log_free(fd)
+        self.journal.commit()
+        return 1
+
+    # 生成与source共享全部磁盘块的新文件，块在任一方修改时才复制
+    def _clone_file(self, source, fd, name):
+        self.enable_refs()
+        if source.codec:
+            # 脏簇写回后克隆才能看到
+            self.cluster_cache.flush(source)
+        file = File(self, fd, name, new=0, codec=source.codec)
+        file.block_array = ExtentMap(source.block_array.runs)
+        file.size = source.size
+        file.clusters = [(list(runs), length) for runs, length in source.clusters]
+        self.dedup.acquire(file.block_array)
+        return file
+
+    # 将source目录下除exclude外的全部文件和子目录克隆到target目录下，返回新建项的索引节点记录
+    def _clone_tree(self, source, target, exclude=()):
+        records = []
+        for name, fd in list(source.entries.items()):
+            if name in exclude:
+                continue
+            item = self.created_file[fd]
+            free_fd = self.file_descriptor.get_free_fd()
+            if isinstance(item, Directory):
+                new_item = Directory(self, free_fd, name)
+            else:
+                new_item = self._clone_file(item, free_fd, name)
+            self.file_descriptor.fd_allocate(free_fd, new_item)
+            target.add_file(free_fd, name)
+            records.append(self.inode_record(new_item))
+            if isinstance(item, Directory):
+                records.extend(self._clone_tree(item, new_item))
+        return records
+
+    # 删除目录下的全部文件和子目录，返回删除的个数
+    def _remove_tree(self, directory):
+        num = 0
+        for name, fd in list(directory.entries.items()):
+            item = self.created_file[fd]
+            if isinstance(item, Directory):
+                num += self._remove_tree(item)
+                directory.delete_dir(name)
+            else:
+                directory.delete_file(name)
+            self.file_descriptor.fd_release(fd)
+            self.journal.log_free(fd)
+            num += 1
+        return num
+
+    # 克隆文件：dst与src共享磁盘块，只复制元数据
+    @timed('clone')
+    @exclusive
+    def clone(self, src, dst):
+        fd = self.lookup_file(src)
+        if fd == -1:
+            logging.info(msg='文件%s不存在' % src)
+            return 0
+        parent, name = self.resolve(dst)
+        if parent is None:
+            logging.info(msg='文件%s所在目录不存在,克隆失败' % dst)
+            return 0
+        if name in parent.entries:
+            logging.info(msg='文件名%s已存在,克隆失败' % dst)
+            return 0
+        free_fd = self.file_descriptor.get_free_fd()
+        if free_fd == -1:
+            logging.info(msg='没有空余的文件描述符可以使用')
+            return 0
+        new_file = self._clone_file(self.created_file[fd], free_fd, name)
+        self.file_descriptor.fd_allocate(free_fd, new_file)
+        parent.add_file(free_fd, name)
+        self.journal.log_inode(pack_inodes([self.inode_record(new_file)]))
+        self.journal.commit()
+        logging.info('文件%s克隆为%s，文件描述符为%d', src, dst, free_fd)
+        return 1
+
+    # 为blocks分配一批新块并按顺序复制内容，返回新块的区间列表
+    # 物理上连续且没有脏缓存的部分整段复制，其余的逐块复制缓存中的最新内容
+    def _copy_blocks(self, blocks):
+        runs = self.allocator.allocate_runs(len(blocks))
+        sources = to_runs(blocks)
+        i = j = source_done = target_done = 0
+        while i < len(sources):
+            source, source_num = sources[i]
+            target, target_num = runs[j]
+            num = min(source_num - source_done, target_num - target_done)
+            source += source_done
+            target += target_done
+            if self.cache.first_dirty(source, num) is None:
+                self.disk.copy_run(source, target, num)
+            else:
+                for k in range(num):
+                    self.disk[target + k] = self.block_content(source + k)
+            if self.journal.data:
+                for k in range(num):
+                    self.journal.log_block(target + k, self.disk[target + k])
+            source_done += num
+            target_done += num
+            if source_done == source_num:
+                i += 1
+                source_done = 0
+            if target_done == target_num:
+                j += 1
+                target_done = 0
+        if self.dedup is not None:
+            self.dedup.acquire(from_runs(runs))
+        return runs
+
+    # 复制文件：在卷内把src的磁盘块复制到一批新分配的块中，不经过内存区
+    # 压缩文件按压缩后的簇原样复制，不重新压缩；去重模式下内容相同的块只存一份，复制退化为克隆
+    @timed('copy')
+    @exclusive
+    def copy_file(self, src, dst):
+        fd = self.lookup_file(src)
+        if fd == -1:
+            logging.info(msg='文件%s不存在' % src)
+            return 0
+        parent, name = self.resolve(dst)
+        if parent is None:
+            logging.info(msg='文件%s所在目录不存在,复制失败' % dst)
+            return 0
+        if name in parent.entries:
+            logging.info(msg='文件名%s已存在,复制失败' % dst)
+            return 0
+        free_fd = self.file_descriptor.get_free_fd()
+        if free_fd == -1:
+            logging.info(msg='没有空余的文件描述符可以使用')
+            return 0
+        source = self.created_file[fd]
+        if self.deduplicate:
+            new_file = self._clone_file(source, free_fd, name)
+        else:
+            with source.lock.reading():
+                if source.codec:
+                    self.cluster_cache.flush(source)
+                    blocks = list(source.block_array)
+                else:
+                    blocks = source.block_array.blocks(0, max(1, -(-source.size // self.block_size)))
+                try:
+                    runs = self._copy_blocks(blocks) if blocks else []
+                except IOError as e:
+                    logging.info(msg='复制%s失败:%s' % (src, e))
+                    return 0
+                new_file = File(self, free_fd, name, new=0, codec=source.codec)
+                new_file.block_array = ExtentMap(runs)
+                new_file.size = source.size
+                # 新块按原簇的顺序排列，逐簇取出相同的块数
+                targets = iter(new_file.block_array)
+                for cluster_runs, length in source.clusters:
+                    num = sum(num for start, num in cluster_runs)
+                    new_file.clusters.append((to_runs(next(targets) for k in range(num)), length))
+        self.file_descriptor.fd_allocate(free_fd, new_file)
+        parent.add_file(free_fd, name)
+        self.journal.log_inode(pack_inodes([self.inode_record(new_file)]))
+        self.journal.commit()
+        logging.info('文件%s复制为%s，文件描述符为%d', src, dst, free_fd)
+        return 1
+
+    # 生成卷快照：将根目录下除快照目录外的全部内容克隆到快照目录下的name目录中
+    @timed('snapshot')
+    @exclusive
+    def snapshot(self, name):
+        root = self.directory
+        if not name or '/' in name:
+            logging.info(msg='快照名%s不合法' % name)
+            return 0
+        snapshots = self.created_file.get(root.entries.get(SNAPSHOT_DIR, -1))
+        if snapshots is not None and name in snapshots.entries:
+            logging.info(msg='快照%s已存在' % name)
+            return 0
+        records = []
+        if snapshots is None:
+            fd = self.file_descriptor.get_free_fd()
+            snapshots = Directory(self, fd, SNAPSHOT_DIR)
+            self.file_descriptor.fd_allocate(fd, snapshots)
+            root.add_file(fd, SNAPSHOT_DIR)
+            records.append(self.inode_record(snapshots))
+        fd = self.file_descriptor.get_free_fd()
+        target = Directory(self, fd, name)
+        self.file_descriptor.fd_allocate(fd, target)
+        snapshots.add_file(fd, name)
+        records.append(self.inode_record(target))
+        records.extend(self._clone_tree(root, target, (SNAPSHOT_DIR,)))
+        self.journal.log_inode(pack_inodes(records))
+        self.journal.commit()
+        logging.info(msg='生成快照%s，包含%d项' % (name, len(records) - 1))
+        return 1
+
+    # 列出全部快照
+    @shared
+    def list_snapshots(self):
+        snapshots = self.created_file.get(self.directory.entries.get(SNAPSHOT_DIR, -1))
+        return sorted(snapshots.entries) if snapshots is not None else []
+
+    # 删除快照，只有不再被其他文件引用的块才释放
+    @exclusive
+    def delete_snapshot(self, name):
+        snapshots = self.created_file.get(self.directory.entries.get(SNAPSHOT_DIR, -1))
+        fd = snapshots.entries.get(name, -1) if snapshots is not None else -1
+        if fd == -1:
+            logging.info(msg='快照%s不存在' % name)
+            return 0
+        num = self._remove_tree(self.created_file[fd])
+        snapshots.delete_dir(name)
+        self.file_descriptor.fd_release(fd)
+        self.journal.log_free(fd)
+        self.journal.commit()
+        logging.info(msg='删除快照%s，共%d项' % (name, num))
+        return 1
+
+    # 列出目录内容
+    @shared
+    def list_dir(self, dir_name='/'):
+        fd = self.lookup(dir_name)
+        if fd == -1 or not isinstance(self.created_file[fd], Directory):
+            logging.info(msg='目录%s不存在' % dir_name)
+            return []
+        names = sorted(self.created_file[fd].entries)
+        logging.info(msg='目录%s包含%s' % (dir_name, ' '.join(names)))
+        return names
+
+    # 打开文件
+    @timed('open')
+    @shared
+    def open_file(self, file_name):
+        fd = self.lookup_file(file_name)
+        if fd == -1:
+            logging.info(msg='文件%s不存在,无法打开' % file_name)
+            return 0
+        file_opened = OpenFile(self, fd)
+        self.open_table()[fd] = file_opened
+        logging.info('成功打开文件%s', file_name)
+        return 1
+
+    # 关闭文件
+    @timed('close')
+    @shared
+    def close_file(self, file_name):
+        fd = self.lookup_file(file_name)
+        if fd == -1:
+            logging.info(msg='文件%s不存在' % file_name)
+            return 0
+        table = self.open_table()
+        if fd not in table:
+            logging.info(msg='文件%s未打开' % file_name)
+            return 0
+        file_opened = table.pop(fd)
+        with file_opened.file.lock.reading():
             file_opened.dump_buffer()
-            file_opened.write_ptr += BLOCK_SIZE
-        elif num + len(buffer) < BLOCK_SIZE:
-            buffer += write_block(begin, num)
-            write_info += buffer[-num:]
+            record = pack_inodes([self.inode_record(file_opened.file)])
+        self.journal.log_inode(record)
+        self.journal.commit()
+        logging.info('成功关闭文件%s', file_name)
+
+    # 从指定文件读取num个字节到mem_begin开始的内存区中
+    @timed('read')
+    @shared
+    def read(self, file_name, mem_begin, num):
+        block_size = self.block_size
+        # 判断文件是否存在
+        fd = self.lookup_file(file_name)
+        if fd == -1:
+            logging.info(msg='文件%s不存在' % file_name)
+            return 0
+        # 判断文件是否打开
+        table = self.open_table()
+        if fd not in table:
+            logging.info(msg='文件%s未打开,无法写' % file_name)
+            return 0
+        file_opened = table[fd]
+        # 读文件期间其他线程可以读但不能写
+        with file_opened.file.lock.reading():
+            file_length = file_opened.file.get_file_length()
+            # 如果请求的大小超过了文件剩余的长度则视为读取到文件末尾
+            num = max(0, min(num, file_length - file_opened.read_ptr))
+            start, total = mem_begin, num
+            # 压缩文件经解压簇缓存读取
+            if file_opened.file.codec and num:
+                chunk = bytearray(num)
+                self.read_range(file_opened.file, file_opened.read_ptr, chunk)
+                self.read_block(chunk, mem_begin, num)
+                file_opened.read_ptr += num
+                num = 0
+            while num:
+                # 在缓冲区中载入读指针所在的块
+                file_opened.read_buffer()
+                # 读指针在当前缓冲区的位置
+                buffer_read_pos = file_opened.read_ptr % block_size
+                read_size = min(num, block_size - buffer_read_pos)
+                chunk = file_opened.get_buffer()[buffer_read_pos:buffer_read_pos + read_size]
+                self.read_block(chunk, mem_begin, read_size)
+                num -= read_size
+                mem_begin += read_size
+                file_opened.read_ptr += read_size
+        logging.debug('读取文件%s信息%s', file_opened.file.file_name, Lazy(self.memory_text, start, total))
+
+    # 将内存数据添加到文件中,不覆盖原来的内容
+    @timed('append')
+    @shared
+    def append(self, file_name, begin, num):
+        # 判断文件是否存在
+        fd = self.lookup_file(file_name)
+        if fd == -1:
+            logging.info(msg='文件%s不存在' % file_name)
+            return 0
+        # 判断文件是否打开
+        table = self.open_table()
+        if fd not in table:
+            logging.info(msg='文件%s未打开,无法写' % file_name)
+            return 0
+        file_opened = table[fd]
+        data = self.write_block(begin, num)
+        if not data and num:
+            return 0
+        # 写文件期间其他线程不能读写该文件
+        with file_opened.file.lock.writing():
+            file_opened.write_ptr = file_opened.file.get_file_length()
+            # 一次分配本次写入需要的全部磁盘块
+            try:
+                file_opened.file.reserve(file_opened.write_ptr + num)
+            except IOError as e:
+                logging.info(msg='添加到%s失败:%s' % (file_name, e))
+                return 0
+            start, total = begin, num
+            self._write_memory(file_opened, data)
+            self.journal.log_inode(pack_inodes([self.inode_record(file_opened.file)]))
+        self.journal.commit()
+        logging.info('向文件%s添加%s', file_name, Lazy(self.memory_text, start, total))
+
+    # 将内存内容写入到文件中，覆盖原文件
+    @timed('write')
+    @shared
+    def write(self, file_name, begin, num):
+        # 判断文件是否存在
+        fd = self.lookup_file(file_name)
+        if fd == -1:
+            logging.info(msg='文件%s不存在' % file_name)
+            return 0
+        # 判断文件是否打开
+        table = self.open_table()
+        if fd not in table:
+            logging.info(msg='文件%s未打开,无法写' % file_name)
+            return 0
+        file_opened = table[fd]
+        data = self.write_block(begin, num)
+        if not data and num:
+            return 0
+        with file_opened.file.lock.writing():
+            # 初始化文件
+            if file_opened.file.get_file_length() != 0:
+                file_opened.file.initial()
+            file_opened.write_ptr = 0
+            # 一次分配本次写入需要的全部磁盘块
+            try:
+                file_opened.file.reserve(num)
+            except IOError as e:
+                logging.info(msg='写入%s失败:%s' % (file_name, e))
+                # 文件已经清空，记录清空后的索引节点
+                self.journal.log_inode(pack_inodes([self.inode_record(file_opened.file)]))
+                return 0
+            start, total = begin, num
+            self._write_memory(file_opened, data)
+            self.journal.log_inode(pack_inodes([self.inode_record(file_opened.file)]))
+        self.journal.commit()
+        logging.info('向文件%s写入%s', file_name, Lazy(self.memory_text, start, total))
+
+    # 从写指针处逐块写入从内存中取出的data
+    # 压缩文件和建立引用计数后经write_range写入
+    def _write_memory(self, file_opened, data):
+        if file_opened.file.codec or self.dedup is not None:
+            if data:
+                file_opened.write_ptr += self.write_range(file_opened.file, file_opened.write_ptr, data)
+            return
+        pos = 0
+        while pos < len(data):
+            file_opened.buffer_write_block()
+            # 写指针在当前缓冲区的位置
+            buffer_write_pos = file_opened.write_ptr % self.block_size
+            write_size = min(len(data) - pos, self.block_size - buffer_write_pos)
+            file_opened.write_buffer(data[pos:pos + write_size], buffer_write_pos)
+            pos += write_size
+            file_opened.write_ptr += write_size
+        file_opened.file.size = max(file_opened.file.size, file_opened.write_ptr)
+
+    # 依据文件名得到已打开的文件，不存在或未打开时返回None
+    def get_opened(self, file_name):
+        fd = self.lookup_file(file_name)
+        if fd == -1:
+            logging.info(msg='文件%s不存在' % file_name)
+            return None
+        table = self.open_table()
+        if fd not in table:
+            logging.info(msg='文件%s未打开' % file_name)
+            return None
+        return table[fd]
+
+    # 将文件offset开始的内容读入buffer，返回读取的字节数
+    # 在缓存中的块从缓存复制，其余的块直接从磁盘复制，不占用缓存
+    def read_range(self, file, offset, buffer):
+        block_size = self.block_size
+        view = memoryview(buffer)
+        length = min(len(view), file.get_file_length() - offset)
+        if length <= 0:
+            return 0
+        if file.codec:
+            return self._read_clusters(file, offset, view[:length])
+        pos = 0
+        for block in file.block_array.blocks(offset // block_size, (offset + length - 1) // block_size + 1):
+            begin = (offset + pos) % block_size
+            size = min(block_size - begin, length - pos)
+            entry = self.cache.peek(block)
+            source = self.disk[block] if entry is None else memoryview(entry)
+            view[pos:pos + size] = source[begin:begin + size]
+            pos += size
+        return length
+
+    # 将data写入文件offset处，超出文件末尾的部分追加到文件中，返回写入的字节数
+    def write_range(self, file, offset, data):
+        block_size = self.block_size
+        view = memoryview(data)
+        if file.codec:
+            return self._write_clusters(file, offset, view)
+        # 一次分配本次写入需要的全部磁盘块
+        file.reserve(offset + len(view))
+        blocks = file.block_array
+        pos = 0
+        while pos < len(view):
+            index = (offset + pos) // block_size
+            begin = (offset + pos) % block_size
+            size = min(block_size - begin, len(view) - pos)
+            if self.dedup is not None:
+                self._shared_write(file, index, begin, view[pos:pos + size])
+            else:
+                self._write_block(blocks[index], view[pos:pos + size], begin)
+            pos += size
+        file.size = max(file.size, offset + pos)
+        return pos
+
+    # 从块的begin处写入data，块在缓存中时写入缓存，否则直接写磁盘
+    def _write_block(self, block, data, begin):
+        cache = self.cache
+        if block in cache:
+            cache.write(block, data, begin)
+            self.journal.log_block(block, cache.peek(block))
+        else:
+            self.disk.write(block, data, begin)
+            self.journal.log_block(block, self.disk[block])
+
+    # 经解压簇缓存读取压缩文件offset开始的内容，填满view
+    def _read_clusters(self, file, offset, view):
+        pos = 0
+        while pos < len(view):
+            index, begin = divmod(offset + pos, CLUSTER_SIZE)
+            size = min(CLUSTER_SIZE - begin, len(view) - pos)
+            with self.cluster_cache.lock:
+                entry = self.cluster_cache.get(file, index)
+                chunk = entry[begin:begin + size]
+            # 文件中间从未写过的部分读出0
+            view[pos:pos + len(chunk)] = chunk
+            view[pos + len(chunk):pos + size] = bytes(size - len(chunk))
+            pos += size
+        return pos
+
+    # 经解压簇缓存写入压缩文件，簇在淘汰或同步时压缩写回
+    def _write_clusters(self, file, offset, view):
+        pos = 0
+        while pos < len(view):
+            index, begin = divmod(offset + pos, CLUSTER_SIZE)
+            size = min(CLUSTER_SIZE - begin, len(view) - pos)
+            with self.cluster_cache.lock:
+                entry = self.cluster_cache.get(file, index)
+                # 簇内写入位置之前的空洞补0
+                if len(entry) < begin:
+                    entry.extend(bytes(begin - len(entry)))
+                self.cluster_cache.write(file, index, view[pos:pos + size], begin)
+            pos += size
+        file.size = max(file.size, offset + pos)
+        return pos
+
+    # 从文件offset处读取length个字节，不改变读写指针，失败返回None
+    @shared
+    def pread(self, file_name, offset, length):
+        file_opened = self.get_opened(file_name)
+        if file_opened is None:
+            return None
+        if offset < 0:
+            logging.info(msg='读取位置不能为负数')
+            return None
+        file = file_opened.file
+        with file.lock.reading():
+            # 按文件末尾截断后再分配缓冲区，length远超文件大小时不会申请大块内存
+            buffer = bytearray(max(0, min(length, file.get_file_length() - offset)))
+            del buffer[self.read_range(file, offset, buffer):]
+        return buffer
+
+    # 从文件offset处读取内容填满调用者提供的buffer，返回读取的字节数，失败返回None
+    @shared
+    def pread_into(self, file_name, offset, buffer):
+        file_opened = self.get_opened(file_name)
+        if file_opened is None:
+            return None
+        if offset < 0:
+            logging.info(msg='读取位置不能为负数')
+            return None
+        with file_opened.file.lock.reading():
+            return self.read_range(file_opened.file, offset, buffer)
+
+    # 一次读取文件的多个区间，ranges为(offset, length)列表，失败返回None
+    @shared
+    def preadv(self, file_name, ranges):
+        file_opened = self.get_opened(file_name)
+        if file_opened is None:
+            return None
+        result = []
+        with file_opened.file.lock.reading():
+            size = file_opened.file.get_file_length()
+            for offset, length in ranges:
+                offset = max(0, offset)
+                buffer = bytearray(max(0, min(length, size - offset)))
+                del buffer[self.read_range(file_opened.file, offset, buffer):]
+                result.append(buffer)
+        return result
+
+    # 将data写入文件offset处，不改变读写指针，返回写入的字节数
+    def pwrite(self, file_name, offset, data):
+        return self.pwritev(file_name, [(offset, data)])
+
+    # 一次写入文件的多个区间，ranges为(offset, data)列表，返回写入的总字节数
+    @shared
+    def pwritev(self, file_name, ranges):
+        file_opened = self.get_opened(file_name)
+        if file_opened is None:
+            return 0
+        file = file_opened.file
+        with file.lock.writing():
+            # 文件中不能留下空洞
+            length = file.get_file_length()
+            for offset, data in ranges:
+                if offset < 0 or offset > length:
+                    logging.info(msg='写入位置必须在0~%d之间' % length)
+                    return 0
+                length = max(length, offset + len(data))
+            file.reserve(length)
             num = 0
-            begin += num
-            file_opened.write_ptr += num
-    logging.info(msg='向文件%s写入%s' % (file_name, ' '.join(write_info)))
-
-
-# 修改已打开文件的读写指针
-def read_write_seek(file_name, pos):
-    # 判断文件是否存在
-    if file_name not in [f[1] for f in directory.file_fd_name]:
-        logging.info(msg='文件%s不存在' % file_name)
-        return 0
-    # 判断文件是否打开
-    fd = directory.get_fd(file_name)
-    if fd not in OPEN_FILE_TABLE.keys():
-        logging.info(msg='文件%s未打开,无法写' % file_name)
-        return 0
-    # 判断文件pos是否合法
-    file_opened = OPEN_FILE_TABLE[fd]
-    if pos < 0 or pos > file_opened.file.get_file_length() - 1:
-        logging.info(msg='pos值必须在0~%d之间' % (file_opened.file.file_length - 1))
-
-    file_opened.write_ptr = pos
-    file_opened.read_ptr = pos
-
-
-# 查看文件内容
-def view_file(file_name):
-    if file_name not in [f[1] for f in directory.file_fd_name]:
-        logging.info(msg='文件%s不存在' % file_name)
-        return 0
-    fd = directory.get_fd(file_name)
-    file = CREATED_FILE[fd]
-    contents = []
-    for block in file.block_array[:-1]:
-        contents += DISK[block]
-    contents += [i for i in DISK[file.block_array[-1]] if i != 0]
-    logging.info(msg='文件%s的内容为%s' % (file_name, ' '.join([str(i) for i in contents])))
-
-
-# 打印当前文件情况
-def file_status():
-    logging.info('*' * 30)
-    # 打印文件夹和文件信息
-    logging.info(msg='文件夹名称%s,文件描述符%d' % (directory.name, directory.fd))
-    logging.info(msg='文件夹包含%d个文件' % len(directory.file_fd_name))
-    for file_info in directory.file_fd_name:
-        file = CREATED_FILE[int(file_info[0])]
-        file_size = file.get_file_length()
-        file_block_range = ' '.join([str(i) for i in file.block_array])
-        logging.info(msg='文件描述符%s,文件名%s,文件大小%d个字节,占据磁盘块%s' %
-                         (file_info[0], file_info[1], file_size, file_block_range))
-    # 打印打开文件表信息
-    logging.info(msg='打开的文件共%d个' % len(OPEN_FILE_TABLE))
-    for fd, opened_file in OPEN_FILE_TABLE.items():
-        file = CREATED_FILE[fd]
-        file_size = file.get_file_length()
-        file_block_range = ' '.join([str(i) for i in file.block_array])
-        logging.info(msg='文件描述符%s,文件名%s,文件大小%d个字节,占据磁盘块%s' %
-                         (file_info[0], file_info[1], file_size, file_block_range))
-    logging.info('*' * 30 + '\n')
-
-
-# 新建文件描述符实例
-file_descriptor = FileDescriptor(FD_NUM)
-# 新建文件夹
-directory = Directory(0, DIR_NAME)
-file_descriptor.fd_allocate(0, directory)
-logging.info(msg='文件夹%s新建成功，文件描述符为%d' % (DIR_NAME, 0))
+            for offset, data in ranges:
+                num += self.write_range(file, offset, data)
+            self.journal.log_inode(pack_inodes([self.inode_record(file)]))
+        self.journal.commit()
+        return num
+
+    # 将data追加到已打开文件的末尾，返回写入的字节数，失败返回None
+    @shared
+    def append_data(self, file_name, data):
+        file_opened = self.get_opened(file_name)
+        if file_opened is None:
+            return None
+        file = file_opened.file
+        with file.lock.writing():
+            num = self.write_range(file, file.get_file_length(), data)
+            self.journal.log_inode(pack_inodes([self.inode_record(file)]))
+        self.journal.commit()
+        return num
+
+    # 返回批量操作对象，用法：with fs.batch() as batch: batch.create(name); batch.append_data(name, data)
+    def batch(self):
+        return Batch(self)
+
+    # 应用一批操作：按队列顺序在各路径的状态副本上检查全部操作，每个路径只解析一次；
+    # 检查通过后一次分配全部新块，新建的未压缩文件整段写入磁盘；
+    # 全部成功后删除的文件才释放，所有日志记录作为一组写入，只fsync一次。
+    # 检查失败时不做任何修改，应用中途失败时按相反顺序撤销已做的修改，两种情况都抛出IOError
+    @timed('batch')
+    @exclusive
+    def apply_batch(self, ops):
+        block_size = self.block_size
+        places = dict()
+        states = dict()
+        order = []
+        for op in ops:
+            kind, path = op[0], op[1]
+            place = places.get(path)
+            if place is None:
+                parent, name = self.resolve(path)
+                if parent is None or name == '..':
+                    raise IOError('%s所在目录不存在' % path)
+                place = places[path] = (parent, name)
+            state = states.get((place[0].fd, place[1]))
+            if state is None:
+                fd = place[0].entries.get(place[1], -1)
+                old = None if fd == -1 else self.created_file[fd]
+                if old is not None and not isinstance(old, File):
+                    raise IOError('%s是目录' % path)
+                state = states[(place[0].fd, place[1])] = {
+                    'parent': place[0], 'name': place[1], 'old': old, 'exists': old is not None,
+                    'new': False, 'drop': False, 'codec': None, 'size': 0 if old is None else old.size,
+                    'writes': [],
+                }
+                order.append(state)
+            if kind == 'create':
+                if state['exists']:
+                    raise IOError('文件名%s已存在' % path)
+                codec = op[2] or self.compression
+                if codec not in CODECS:
+                    raise IOError('压缩算法必须是%s之一' % '/'.join(CODECS))
+                state.update(exists=True, new=True, codec=None if codec == 'none' else codec, size=0, writes=[])
+                continue
+            if not state['exists']:
+                raise IOError('文件%s不存在' % path)
+            if kind == 'destroy':
+                # 本批新建的文件直接撤销，已有的文件在提交时删除，之前排队的写入不再需要
+                if not state['new']:
+                    state['drop'] = True
+                state.update(exists=False, new=False, size=0, writes=[])
+                continue
+            offset = state['size'] if kind == 'append' else op[2]
+            if offset < 0 or offset > state['size']:
+                raise IOError('%s的写入位置必须在0~%d之间' % (path, state['size']))
+            state['writes'].append((offset, op[-1]))
+            state['size'] = max(state['size'], offset + len(op[-1]))
+        # 一次分配全部未压缩文件需要的新块
+        need = 0
+        for state in order:
+            blocks = max(1, -(-state['size'] // block_size))
+            if state['new']:
+                need += 0 if state['codec'] else blocks
+            elif state['exists'] and state['writes'] and not state['old'].codec:
+                need += max(0, blocks - len(state['old'].block_array))
+        pool = from_runs(self.allocator.allocate_runs(need)) if need else []
+        used = 0
+        undo = []
+        self.journal.begin()
+        try:
+            for state in order:
+                parent, name, old = state['parent'], state['name'], state['old']
+                if state['drop']:
+                    # 先只从目录中摘下，提交时再释放；删除记录排在同名新文件的记录之前，重放时不会误删新文件
+                    del parent.entries[name]
+                    self.dentry_cache.invalidate(old.fd)
+                    self.journal.log_free(old.fd)
+                    undo.append(functools.partial(parent.entries.__setitem__, name, old.fd))
+                if state['new']:
+                    fd = self.file_descriptor.get_free_fd()
+                    if fd == -1:
+                        raise IOError('没有空余的文件描述符可以使用')
+                    file = File(self, fd, name, new=0, codec=state['codec'])
+                    if not file.codec:
+                        num = max(1, -(-state['size'] // block_size))
+                        file.block_array = ExtentMap(to_runs(pool[used:used + num]))
+                        used += num
+                        if self.dedup is not None:
+                            self.dedup.acquire(file.block_array)
+                    self.file_descriptor.fd_allocate(fd, file)
+                    parent.add_file(fd, name)
+                    state['file'] = file
+                    undo.append(functools.partial(self._undo_create, parent, name, fd))
+                    self._fill_file(file, state['size'], state['writes'])
+                elif state['exists'] and state['writes']:
+                    # 保存将被覆盖的内容，撤销时写回
+                    saved = []
+                    for offset, data in state['writes']:
+                        if offset < old.size:
+                            buffer = bytearray(min(len(data), old.size - offset))
+                            self.read_range(old, offset, buffer)
+                            saved.append((offset, buffer))
+                    undo.append(functools.partial(self._undo_write, old, old.size, len(old.block_array), saved))
+                    if not old.codec:
+                        num = max(0, max(1, -(-state['size'] // block_size)) - len(old.block_array))
+                        for start, length in to_runs(pool[used:used + num]):
+                            old.block_array.add_run(start, length)
+                        if self.dedup is not None:
+                            self.dedup.acquire(pool[used:used + num])
+                        used += num
+                    for offset, data in state['writes']:
+                        self.write_range(old, offset, data)
+            # 压缩文件的脏簇在事务内写回，与其他修改一起落盘
+            for state in order:
+                file = state.get('file') or state['old']
+                if (state['new'] or state['writes']) and file.codec:
+                    self.cluster_cache.flush(file)
+        except Exception:
+            for action in reversed(undo):
+                action()
+            self.allocator.free(pool[used:])
+            self.journal.end(commit=False)
+            raise
+        records = []
+        for state in order:
+            if state['drop']:
+                self._drop_file(state['old'])
+            if state['new']:
+                records.append(self.inode_record(state['file']))
+            elif state['exists'] and state['writes']:
+                records.append(self.inode_record(state['old']))
+        if records:
+            self.journal.log_inode(pack_inodes(records))
+        self.journal.end()
+        logging.info('批量应用%d个操作，涉及%d个文件', len(ops), len(order))
+        return len(ops)
+
+    # 写入批量新建的文件，未压缩且不需要去重的文件按区间整段写入磁盘
+    def _fill_file(self, file, size, writes):
+        if file.codec or self.dedup is not None:
+            for offset, data in writes:
+                self.write_range(file, offset, data)
+            return
+        if len(writes) == 1:
+            content = memoryview(writes[0][1])
+        else:
+            content = bytearray(size)
+            for offset, data in writes:
+                content[offset:offset + len(data)] = data
+            content = memoryview(content)
+        pos = 0
+        for start, num in file.block_array.runs:
+            if pos >= size:
+                break
+            self.disk.write_run(start, content[pos:pos + num * self.block_size])
+            pos += num * self.block_size
+        if self.journal.data:
+            for block in file.block_array:
+                self.journal.log_block(block, self.disk[block])
+        file.size = size
+
+    # 撤销批量新建的文件
+    def _undo_create(self, parent, name, fd):
+        parent.delete_file(name)
+        self.file_descriptor.fd_release(fd)
+
+    # 撤销对已有文件的写入：写回被覆盖的内容，恢复长度并释放新加的块
+    def _undo_write(self, file, size, blocks, saved):
+        for offset, data in reversed(saved):
+            self.write_range(file, offset, data)
+        file.size = size
+        if not file.codec:
+            self.release_blocks(file.block_array.truncate(blocks))
+
+    # 释放已从目录中摘下的文件
+    def _drop_file(self, file):
+        self.created_file.pop(file.fd)
+        if file.codec:
+            self.cluster_cache.invalidate(file)
+        self.release_blocks(file.block_array)
+        self.file_descriptor.fd_release(file.fd)
+
+    # 返回文件或目录的文件描述符、类型、长度和块数，不存在时返回None
+    @shared
+    def stat(self, path):
+        fd = self.lookup(path)
+        if fd == -1:
+            logging.info(msg='%s不存在' % path)
+            return None
+        item = self.created_file[fd]
+        if isinstance(item, Directory):
+            return {'fd': fd, 'type': TYPE_DIR, 'size': 0, 'blocks': 0}
+        with item.lock.reading():
+            return {'fd': fd, 'type': TYPE_FILE, 'size': item.get_file_length(), 'blocks': len(item.block_array),
+                    'codec': item.codec or 'none'}
+
+    # 返回文件内容的SHA-256摘要，文件不存在时返回None
+    @shared
+    def file_digest(self, file_name):
+        fd = self.lookup_file(file_name)
+        if fd == -1:
+            logging.info(msg='文件%s不存在' % file_name)
+            return None
+        file = self.created_file[fd]
+        digest = hashlib.sha256()
+        # 持锁期间分段读取，内存占用不随文件长度增长
+        with file.lock.reading():
+            length = file.get_file_length()
+            buffer = memoryview(bytearray(min(length, STREAM_CHUNK)))
+            pos = 0
+            while pos < length:
+                num = self.read_range(file, pos, buffer)
+                digest.update(buffer[:num])
+                pos += num
+        return digest.hexdigest()
+
+    # 按文件名取得文件，用于开始流式读取，文件不存在时返回None
+    @shared
+    def _stream_file(self, file_name):
+        fd = self.lookup_file(file_name)
+        if fd == -1:
+            logging.info(msg='文件%s不存在' % file_name)
+            return None
+        return self.created_file[fd]
+
+    # 返回文件pos开始、end之前不超过chunk_size个字节的视图，已到末尾或文件已删除时返回None
+    # 物理上连续且没有脏缓存的块直接返回磁盘的视图，其余情况复制到新的缓冲区
+    @shared
+    def _stream_chunk(self, file, pos, end, chunk_size):
+        if self.created_file.get(file.fd) is not file:
+            logging.info(msg='文件%s已被删除' % file.file_name)
+            return None
+        with file.lock.reading():
+            stop = file.get_file_length() if end is None else min(end, file.get_file_length())
+            size = min(chunk_size, stop - pos)
+            if size <= 0:
+                return None
+            if not file.codec:
+                block_size = self.block_size
+                index, begin = divmod(pos, block_size)
+                block, num = file.block_array.extent(index)
+                size = min(size, num * block_size - begin)
+                dirty = self.cache.first_dirty(block, -(-(begin + size) // block_size))
+                if dirty is None or dirty > block:
+                    if dirty is not None:
+                        size = (dirty - block) * block_size - begin
+                    return self.disk.view[block * block_size + begin:block * block_size + begin + size]
+            buffer = bytearray(size)
+            self.read_range(file, pos, buffer)
+            return memoryview(buffer)
+
+    # 以生成器逐段产生文件offset开始length个字节(None表示到文件末尾)的内容，每段不超过chunk_size字节
+    # 只在取每段时持锁，段的视图可能直接指向磁盘块，文件被修改后内容随之改变，需要保留时由调用者复制
+    def iter_bytes(self, file_name, offset=0, length=None, chunk_size=STREAM_CHUNK):
+        if chunk_size < 1:
+            raise ValueError('每段至少1个字节')
+        file = self._stream_file(file_name)
+        if file is None:
+            return
+        pos = max(0, offset)
+        end = None if length is None else pos + length
+        while True:
+            chunk = self._stream_chunk(file, pos, end, chunk_size)
+            if chunk is None:
+                return
+            yield chunk
+            pos += len(chunk)
+
+    # 以生成器逐段产生文件的内容，每段由不超过chunk_size字节的整块组成，最后一段截到文件末尾
+    def iter_blocks(self, file_name, chunk_size=STREAM_CHUNK):
+        chunk_size = max(self.block_size, chunk_size // self.block_size * self.block_size)
+        return self.iter_bytes(file_name, 0, None, chunk_size)
+
+    # 修改已打开文件的读写指针
+    @timed('seek')
+    @shared
+    def read_write_seek(self, file_name, pos):
+        # 判断文件是否存在
+        fd = self.lookup_file(file_name)
+        if fd == -1:
+            logging.info(msg='文件%s不存在' % file_name)
+            return 0
+        # 判断文件是否打开
+        table = self.open_table()
+        if fd not in table:
+            logging.info(msg='文件%s未打开,无法写' % file_name)
+            return 0
+        # 判断文件pos是否合法
+        file_opened = table[fd]
+        if pos < 0 or pos > file_opened.file.get_file_length() - 1:
+            logging.info(msg='pos值必须在0~%d之间' % (file_opened.file.get_file_length() - 1))
+            return 0
 
+        file_opened.write_ptr = pos
+        file_opened.read_ptr = pos
 
+    # 查看文件内容
+    @shared
+    def view_file(self, file_name):
+        fd = self.lookup_file(file_name)
+        if fd == -1:
+            logging.info(msg='文件%s不存在' % file_name)
+            return 0
+        file = self.created_file[fd]
+        with file.lock.reading():
+            logging.info('文件%s的内容为%s', file_name, Lazy(self.file_text, file))
+
+    # 打印当前文件情况
+    @shared
+    def file_status(self):
+        directory = self.directory
+        logging.info('*' * 30)
+        # 打印文件夹和文件信息
+        logging.info(msg='文件夹名称%s,文件描述符%d' % (directory.name, directory.fd))
+        logging.info(msg='文件夹包含%d个文件' % directory.file_num)
+        for path, file in directory.walk():
+            if isinstance(file, Directory):
+                logging.info(msg='文件描述符%s,目录%s,包含%d个文件' % (file.fd, path, file.file_num))
+                continue
+            file_size = file.get_file_length()
+            file_block_range = str(file.block_array)
+            logging.info(msg='文件描述符%s,文件名%s,文件大小%d个字节,占据磁盘块%s' %
+                             (file.fd, path, file_size, file_block_range))
+        # 打印打开文件表信息
+        table = self.open_table()
+        logging.info(msg='打开的文件共%d个' % len(table))
+        for fd in table:
+            file = self.created_file[fd]
+            file_size = file.get_file_length()
+            file_block_range = str(file.block_array)
+            logging.info(msg='文件描述符%s,文件名%s,文件大小%d个字节,占据磁盘块%s' %
+                             (fd, file.file_name, file_size, file_block_range))
+        logging.info(msg='磁盘块缓存%s' % self.cache.stats())
+        logging.info(msg='磁盘块分配%s' % self.allocator.stats())
+        logging.info(msg='压缩%s' % self.compression_stats())
+        if self.dedup is not None:
+            logging.info(msg='块引用%s' % self.dedup.stats())
+        logging.info('*' * 30 + '\n')
+
+
+# 默认文件系统，位于当前目录，模块级的接口都作用于它
+FS = FileSystem()
+logging.info(msg='文件夹%s新建成功，文件描述符为%d' % (DIR_NAME, 0))
+mount = FS.mount
+unmount = FS.unmount
+load_disk = FS.load_disk
+dump_disk = FS.dump_disk
+sync = FS.sync
+set_trace = FS.set_trace
+export_metrics = FS.export_metrics
+open_table = FS.open_table
+use_table = FS.use_table
+resolve = FS.resolve
+lookup = FS.lookup
+lookup_file = FS.lookup_file
+get_opened = FS.get_opened
+create = FS.create
+destroy = FS.destroy
+mkdir = FS.mkdir
+rmdir = FS.rmdir
+clone = FS.clone
+copy_file = FS.copy_file
+snapshot = FS.snapshot
+list_snapshots = FS.list_snapshots
+delete_snapshot = FS.delete_snapshot
+list_dir = FS.list_dir
+open_file = FS.open_file
+close_file = FS.close_file
+read = FS.read
+append = FS.append
+write = FS.write
+read_write_seek = FS.read_write_seek
+view_file = FS.view_file
+file_status = FS.file_status
+pread = FS.pread
+pread_into = FS.pread_into
+preadv = FS.preadv
+pwrite = FS.pwrite
+pwritev = FS.pwritev
+append_data = FS.append_data
+stat = FS.stat
+file_digest = FS.file_digest
+batch = FS.batch
+iter_bytes = FS.iter_bytes
+iter_blocks = FS.iter_blocks
+fragmentation = FS.fragmentation
+defrag = FS.defrag
+read_range = FS.read_range
+write_range = FS.write_range
@@ -0,0 +1,111 @@
+from bisect import bisect_right
+
+
+# 文件的块映射：按文件内顺序保存物理上连续的区间
+# starts[i]为第i个区间第一块在文件内的序号，用二分查找定位文件内第index块，O(log n)
+class ExtentMap(object):
+    def __init__(self, runs=()):
+        self.starts = []
+        # 区间(物理起始块号，长度)
+        self.runs = []
+        self.count = 0
+        for start, num in runs:
+            self.add_run(start, num)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for start, num in self.runs:
+            for block in range(start, start + num):
+                yield block
+
+    # 文件内第index块的物理块号，切片时返回块号列表
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.blocks(*index.indices(self.count)[:2])
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('块序号%d超出文件范围' % index)
+        position = bisect_right(self.starts, index) - 1
+        return self.runs[position][0] + index - self.starts[position]
+
+    # 将文件内第index块改为映射到物理块block，按需拆分所在区间
+    def __setitem__(self, index, block):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('块序号%d超出文件范围' % index)
+        position = bisect_right(self.starts, index) - 1
+        start, num = self.runs[position]
+        offset = index - self.starts[position]
+        if start + offset == block:
+            return
+        runs = [(block, 1)]
+        if offset:
+            runs.insert(0, (start, offset))
+        if offset + 1 < num:
+            runs.append((start + offset + 1, num - offset - 1))
+        base = self.starts[position]
+        starts = []
+        for run in runs:
+            starts.append(base)
+            base += run[1]
+        self.runs[position:position + 1] = runs
+        self.starts[position:position + 1] = starts
+
+    # 返回文件内第index块的物理块号，以及从该块起物理上连续的块数
+    def extent(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError('块序号%d超出文件范围' % index)
+        position = bisect_right(self.starts, index) - 1
+        start, num = self.runs[position]
+        offset = index - self.starts[position]
+        return start + offset, num - offset
+
+    # 返回文件内第begin到end块(不含)的物理块号列表
+    def blocks(self, begin, end):
+        result = []
+        if begin >= end:
+            return result
+        position = bisect_right(self.starts, begin) - 1
+        while begin < end:
+            start, num = self.runs[position]
+            offset = begin - self.starts[position]
+            take = min(num - offset, end - begin)
+            result.extend(range(start + offset, start + offset + take))
+            begin += take
+            position += 1
+        return result
+
+    # 在文件末尾添加从start开始的num块，与最后一个区间物理相邻时合并
+    def add_run(self, start, num):
+        if num <= 0:
+            return
+        if self.runs and self.runs[-1][0] + self.runs[-1][1] == start:
+            self.runs[-1] = (self.runs[-1][0], self.runs[-1][1] + num)
+        else:
+            self.starts.append(self.count)
+            self.runs.append((start, num))
+        self.count += num
+
+    # 只保留前num块，返回截掉的物理块号列表
+    def truncate(self, num):
+        removed = self.blocks(num, self.count)
+        if num >= self.count:
+            return removed
+        position = bisect_right(self.starts, num) - 1
+        keep = num - self.starts[position]
+        if keep:
+            self.runs[position] = (self.runs[position][0], keep)
+            position += 1
+        del self.runs[position:]
+        del self.starts[position:]
+        self.count = num
+        return removed
+
+    # 用于日志输出，连续区间写成起始-结束
+    def __str__(self):
+        return ' '.join(str(start) if num == 1 else '%d-%d' % (start, start + num - 1)
+                        for start, num in self.runs)
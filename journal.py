@@ -0,0 +1,210 @@
+import logging
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+
+# 日志组头：魔数，组序号，负载长度，负载校验和
+GROUP = struct.Struct('<4sQII')
+GROUP_MAGIC = b'JRNL'
+# 日志记录头：记录类型，记录长度
+RECORD = struct.Struct('<BI')
+# 记录类型：索引节点的新内容，删除索引节点，数据块内容
+REC_INODE = 1
+REC_FREE = 2
+REC_BLOCK = 3
+FD = struct.Struct('<I')
+
+
+# 预写日志
+# 记录先缓存在内存中，提交的线程等到自己的记录写入并fdatasync后才返回
+# 同一时刻只有一个线程负责写入，写入期间其他线程提交的记录攒成下一组一次写入，称为一次组提交
+# 不记录数据块时为有序模式，每组写入前先调用before_sync把组内记录引用的数据块写入卷镜像
+class Journal(object):
+    def __init__(self, path, data=False):
+        self.path = path
+        # 为真时数据块内容也写入日志
+        self.data = data
+        self.fd = -1
+        self.seq = 0
+        self.pending = []
+        # 事务中的记录，不在事务中时为None，只收集开始事务的线程的记录
+        self.transaction = None
+        self._owner = None
+        # 有序模式下写入一组记录前调用
+        self.before_sync = None
+        # 正在写入的线程在before_sync中产生的记录，与本组一起写入
+        self._leader = None
+        self._extra = []
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        # 已记录和已落盘的记录条数，记录按顺序编号
+        self.appended = 0
+        self.synced = 0
+        # 是否有线程正在写入一组记录
+        self.flushing = False
+        # 各线程最后一条记录的编号和推迟提交的层数
+        self._local = threading.local()
+        # 统计信息
+        self.records = 0
+        self.groups = 0
+
+    def open(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _log(self, kind, body):
+        if self.fd == -1:
+            return
+        with self._lock:
+            me = threading.get_ident()
+            if self.transaction is not None and self._owner == me:
+                self.transaction.append(RECORD.pack(kind, len(body)) + body)
+                return
+            if self._leader == me:
+                self._extra.append(RECORD.pack(kind, len(body)) + body)
+            else:
+                self.pending.append(RECORD.pack(kind, len(body)) + body)
+            self.appended += 1
+            self._local.lsn = self.appended
+
+    # 记录索引节点的新内容
+    def log_inode(self, record):
+        self._log(REC_INODE, record)
+
+    # 记录删除索引节点
+    def log_free(self, fd):
+        self._log(REC_FREE, FD.pack(fd))
+
+    # 数据日志模式下记录数据块内容
+    def log_block(self, index, data):
+        if self.data:
+            self._log(REC_BLOCK, FD.pack(index) + bytes(data))
+
+    # 一次操作结束时调用，等到本线程的记录落盘后返回，force为真时等到已有的全部记录落盘
+    # 在deferred()中时只登记，由调用者在释放命名空间锁后调用wait()等待
+    def commit(self, force=False):
+        if getattr(self._local, 'depth', 0) and not force:
+            return
+        self._wait(self.appended if force else getattr(self._local, 'lsn', 0))
+
+    # 推迟本线程的提交，持有命名空间锁期间不等待落盘，其他线程的记录得以并入同一组
+    @contextmanager
+    def deferred(self):
+        local = self._local
+        local.depth = getattr(local, 'depth', 0) + 1
+        try:
+            yield
+        finally:
+            local.depth -= 1
+
+    # 最外层的deferred()结束后调用，等到本线程的记录落盘
+    def wait(self):
+        if not getattr(self._local, 'depth', 0):
+            self._wait(getattr(self._local, 'lsn', 0))
+
+    # 等到编号不超过lsn的记录全部落盘，没有线程在写入时由本线程写入已有的全部记录
+    def _wait(self, lsn):
+        with self._cond:
+            while self.synced < lsn and self.fd != -1:
+                if self.flushing:
+                    self._cond.wait()
+                else:
+                    self._flush()
+
+    # 持有_lock时调用，写入期间释放_lock，使其他线程可以继续记录
+    def _flush(self):
+        records, self.pending = self.pending, []
+        upto = self.appended
+        self.seq += 1
+        seq = self.seq
+        self.flushing = True
+        self._leader = threading.get_ident()
+        self._lock.release()
+        done = False
+        try:
+            if self.before_sync is not None:
+                # 取出记录之后再写数据块，本组记录引用的数据都已在内存中
+                self.before_sync()
+                with self._lock:
+                    records += self._extra
+                    self._extra = []
+            payload = b''.join(records)
+            os.write(self.fd, GROUP.pack(GROUP_MAGIC, seq, len(payload), zlib.crc32(payload)) + payload)
+            getattr(os, 'fdatasync', os.fsync)(self.fd)
+            done = True
+        finally:
+            self._lock.acquire()
+            self._leader = None
+            # 写入失败时记录放回，下次提交时重试
+            if not done:
+                self.pending[:0] = records + self._extra
+            self._extra = []
+            self.flushing = False
+            self._cond.notify_all()
+        self.synced = max(self.synced, upto)
+        self.records += len(records)
+        self.groups += 1
+
+    # 开始事务：之后的记录攒在事务中，不参与组提交
+    def begin(self):
+        with self._lock:
+            self.transaction = []
+            self._owner = threading.get_ident()
+
+    # 结束事务：提交时事务中的全部记录与之前未写入的记录一起作为一组写入，
+    # 组是重放的最小单位，事务要么全部重放要么全部丢弃；回滚时丢弃事务中的记录
+    def end(self, commit=True):
+        with self._lock:
+            records, self.transaction = self.transaction, None
+            self._owner = None
+            if commit and self.fd != -1:
+                self.pending.extend(records)
+                self.appended += len(records)
+                self._local.lsn = self.appended
+        if commit:
+            self.commit(force=True)
+
+    # 按顺序返回日志中完整且校验正确的记录(类型，内容)
+    def replay(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset + GROUP.size <= len(data):
+            magic, seq, length, crc = GROUP.unpack_from(data, offset)
+            payload = data[offset + GROUP.size:offset + GROUP.size + length]
+            # 崩溃时未写完的组直接丢弃
+            if magic != GROUP_MAGIC or len(payload) != length or zlib.crc32(payload) != crc:
+                logging.info(msg='日志在偏移%d处不完整,停止重放' % offset)
+                break
+            self.seq = seq
+            position = 0
+            while position < length:
+                kind, size = RECORD.unpack_from(payload, position)
+                position += RECORD.size
+                yield kind, payload[position:position + size]
+                position += size
+            offset += GROUP.size + length
+
+    # 卷镜像同步完成后清空日志，尚未写入的记录已包含在卷镜像中，视为已落盘
+    def checkpoint(self):
+        with self._cond:
+            while self.flushing:
+                self._cond.wait()
+            if self.fd == -1:
+                return
+            self.pending = []
+            self.synced = self.appended
+            os.ftruncate(self.fd, 0)
+            os.fsync(self.fd)
+            self._cond.notify_all()
+
+    def close(self):
+        self.commit(force=True)
+        with self._cond:
+            while self.flushing:
+                self._cond.wait()
+            if self.fd != -1:
+                os.close(self.fd)
+                self.fd = -1
+            self._cond.notify_all()
@@ -0,0 +1,87 @@
+import threading
+
+
+# 读写锁的上下文管理器
+class _Guard(object):
+    __slots__ = ('acquire', 'release')
+
+    def __init__(self, acquire, release):
+        self.acquire = acquire
+        self.release = release
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# 读写锁，多个读者可以同时持有，写者独占
+# 有写者等待时新的读者也等待，避免写者饿死；持有写锁的线程可以重入，也可以再加读锁
+# 没有竞争时加锁解锁都只需一次互斥锁操作
+class RWLock(object):
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._cond = threading.Condition(self._mutex)
+        self._readers = 0
+        self._readers_waiting = 0
+        self._writers_waiting = 0
+        # 持有写锁的线程和重入次数
+        self._owner = None
+        self._depth = 0
+        self._read_guard = _Guard(self.acquire_read, self.release_read)
+        self._write_guard = _Guard(self.acquire_write, self.release_write)
+
+    def acquire_read(self):
+        with self._mutex:
+            if self._owner is None and not self._writers_waiting:
+                self._readers += 1
+                return
+            if self._owner == threading.get_ident():
+                self._depth += 1
+                return
+            self._readers_waiting += 1
+            while self._owner is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers_waiting -= 1
+            self._readers += 1
+
+    def release_read(self):
+        with self._mutex:
+            if self._owner is not None:
+                # 只有持有写锁的线程自己能在此时持有读锁
+                self._depth -= 1
+                return
+            self._readers -= 1
+            if not self._readers and self._writers_waiting:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._mutex:
+            if self._owner == me:
+                self._depth += 1
+                return
+            self._writers_waiting += 1
+            while self._owner is not None or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._owner = me
+            self._depth = 1
+
+    def release_write(self):
+        with self._mutex:
+            self._depth -= 1
+            if self._depth:
+                return
+            self._owner = None
+            if self._readers_waiting or self._writers_waiting:
+                self._cond.notify_all()
+
+    # 在with语句中持有读锁
+    def reading(self):
+        return self._read_guard
+
+    # 在with语句中持有写锁
+    def writing(self):
+        return self._write_guard
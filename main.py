@@ -1,3 +1,8 @@
+import argparse
+import json
+import sys
+
+import replay
 from file import *
 
 
@@ -103,7 +108,52 @@ def menu_drive():
             logging.info(msg='输入选项无效')
         file_status()
 
+# 解析命令行参数
+def parse_args():
+    parser = argparse.ArgumentParser(description='文件系统模拟程序')
+    parser.add_argument('--replay', metavar='TRACE', help='不进入菜单，重放JSONL格式的操作轨迹')
+    parser.add_argument('--timing', metavar='FILE', help='重放时输出每条操作的耗时，-表示标准输出')
+    parser.add_argument('--checksum', action='store_true', help='重放结束后输出整个卷的校验和')
+    parser.add_argument('--record', metavar='TRACE', help='将菜单中执行的操作记录为操作轨迹')
+    parser.add_argument('--verbose', action='store_true', help='重放时输出文件系统日志')
+    parser.add_argument('--trace', metavar='RATE', type=float, default=0.0, help='按采样率追踪接口调用')
+    parser.add_argument('--metrics', metavar='TARGET',
+                        help='退出时导出统计信息到文件，或tcp:主机:端口、unix:路径形式的套接字')
+    return parser.parse_args()
+
+
+# 重放操作轨迹并输出统计结果
+def replay_drive(args):
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    timing = None
+    if args.timing == '-':
+        timing = sys.stdout
+    elif args.timing:
+        timing = open(args.timing, 'w')
+    result = replay.replay(args.replay, timing)
+    if timing not in (None, sys.stdout):
+        timing.close()
+    if args.checksum:
+        result['checksum'] = replay.checksum()
+    print(json.dumps(result))
+
+
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
+    args = parse_args()
+    set_trace(args.trace)
     load_disk()
-    menu_drive()
-    dump_disk()
\ No newline at end of file
+    if args.replay:
+        replay_drive(args)
+    else:
+        recorder = None
+        if args.record:
+            recorder = replay.Recorder(args.record)
+            recorder.install(globals())
+        menu_drive()
+        if recorder is not None:
+            recorder.close()
+    dump_disk()
+    if args.metrics:
+        export_metrics(args.metrics)
\ No newline at end of file
@@ -0,0 +1,206 @@
+import functools
+import json
+import os
+import random
+import socket
+import threading
+import time
+from collections import deque
+
+# 延迟直方图的桶数，第i个桶统计耗时小于2^i微秒且不小于2^(i-1)微秒的操作
+BUCKETS = 32
+
+
+# 日志参数的延迟求值，只有日志真正输出时才调用function
+class Lazy(object):
+    __slots__ = ('function', 'args')
+
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def __str__(self):
+        return str(self.function(*self.args))
+
+
+# 以2的幂划分桶的延迟直方图，记录一次只需一次整数运算
+class Histogram(object):
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    # 记录一次耗时(秒)
+    def observe(self, seconds):
+        us = seconds * 1e6
+        self.buckets[min(int(us).bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    # 估计第p百分位的耗时(微秒)，取所在桶的上界
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, num in enumerate(self.buckets):
+            seen += num
+            if seen >= rank:
+                return min(float(1 << i), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_us': self.total / self.count if self.count else 0.0,
+            'p50_us': self.percentile(50),
+            'p90_us': self.percentile(90),
+            'p99_us': self.percentile(99),
+            'max_us': self.max,
+        }
+
+
+# 将追踪事件中的参数和返回值转换为可以写入JSON的值，字节串只记录长度
+def _plain(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    try:
+        return '<%s %d>' % (type(value).__name__, len(value))
+    except TypeError:
+        return '<%s>' % type(value).__name__
+
+
+# 采样追踪器，按rate的概率记录一次接口调用，只保留最近capacity条
+class Tracer(object):
+    def __init__(self, capacity=1024):
+        self.rate = 0.0
+        self.events = deque(maxlen=capacity)
+        self.sampled = 0
+        self._random = random.Random()
+
+    # 开始追踪，rate为采样率
+    def start(self, rate=1.0, capacity=None):
+        if not 0 < rate <= 1:
+            raise ValueError('采样率必须在(0, 1]之间')
+        if capacity is not None:
+            self.events = deque(self.events, maxlen=capacity)
+        self.rate = rate
+
+    # 停止追踪，已记录的事件保留到clear为止
+    def stop(self):
+        self.rate = 0.0
+
+    def clear(self):
+        self.events.clear()
+
+    def record(self, name, args, elapsed, result, kwargs=None):
+        if self.rate < 1 and self._random.random() >= self.rate:
+            return
+        self.sampled += 1
+        event = {
+            'time': time.time(),
+            'op': name,
+            'args': _plain(args),
+            'us': round(elapsed * 1e6, 1),
+            'result': _plain(result),
+        }
+        if kwargs:
+            event['kwargs'] = {key: _plain(value) for key, value in kwargs.items()}
+        self.events.append(event)
+
+
+# 计数器、延迟直方图和追踪器
+# 其他模块的统计信息通过register注册，导出快照时才收集
+class Metrics(object):
+    def __init__(self, enabled=True, trace_size=1024):
+        self.enabled = enabled
+        self.counters = dict()
+        self.histograms = dict()
+        self.sources = dict()
+        self.tracer = Tracer(trace_size)
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def count(self, name, num=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + num
+
+    # 记录一次name操作的耗时(秒)
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    # 注册统计来源，function返回可以写入JSON的字典
+    def register(self, name, function):
+        self.sources[name] = function
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+        self.tracer.clear()
+        self.started = time.time()
+
+    # 返回当前全部统计信息
+    def snapshot(self):
+        with self._lock:
+            snapshot = {
+                'time': time.time(),
+                'uptime': time.time() - self.started,
+                'counters': dict(self.counters),
+                'latency': {name: histogram.snapshot() for name, histogram in sorted(self.histograms.items())},
+            }
+        for name, function in self.sources.items():
+            snapshot[name] = function()
+        snapshot['trace'] = list(self.tracer.events)
+        return snapshot
+
+    # 将快照导出为一行JSON
+    # target为'tcp:主机:端口'或'unix:路径'时发送到套接字，否则写入本地文件
+    def export(self, target):
+        data = (json.dumps(self.snapshot(), ensure_ascii=False) + '\n').encode('utf-8')
+        if target.startswith('tcp:'):
+            host, port = target[4:].rsplit(':', 1)
+            with socket.create_connection((host, int(port)), timeout=5) as sock:
+                sock.sendall(data)
+        elif target.startswith('unix:'):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(5)
+                sock.connect(target[5:])
+                sock.sendall(data)
+        else:
+            # 先写临时文件再改名，读取方不会看到写了一半的快照
+            temp = target + '.tmp'
+            with open(temp, 'wb') as f:
+                f.write(data)
+            os.replace(temp, target)
+
+
+# 方法装饰器，统计耗时和失败(返回0)次数，追踪开启时按采样率记录调用
+# 统计信息记录在方法所属对象的metrics中
+def timed(name):
+    def decorate(method):
+        @functools.wraps(method)
+        def timed_method(owner, *args, **kwargs):
+            metrics = owner.metrics
+            if not metrics.enabled and not metrics.tracer.rate:
+                return method(owner, *args, **kwargs)
+            begin = time.perf_counter()
+            result = method(owner, *args, **kwargs)
+            elapsed = time.perf_counter() - begin
+            if metrics.enabled:
+                metrics.observe(name, elapsed)
+                if result == 0:
+                    metrics.count(name + '.failed')
+            if metrics.tracer.rate:
+                metrics.tracer.record(name, args, elapsed, result, kwargs)
+            return result
+        return timed_method
+    return decorate
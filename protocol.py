@@ -0,0 +1,67 @@
+import struct
+
+# 文件服务的二进制协议
+# 请求：请求头(负载长度，请求号，操作码) + 负载
+# 响应：响应头(负载长度，请求号，状态) + 负载，出错时负载为错误信息
+# 客户端可以连续发送多个请求而不等待响应，响应按请求号对应
+REQUEST = struct.Struct('<IIB')
+RESPONSE = struct.Struct('<IIB')
+# 负载的最大长度
+MAX_PAYLOAD = 16 << 20
+
+# 操作码及其负载：
+# 新建、删除、打开、查看文件时负载为路径，打开文件返回句柄
+OP_CREATE = 1
+OP_DESTROY = 2
+OP_OPEN = 3
+# 关闭文件：句柄
+OP_CLOSE = 4
+# 读：句柄，偏移，长度；返回读到的数据
+OP_PREAD = 5
+# 写：句柄，偏移，数据；返回写入的字节数
+OP_PWRITE = 6
+# 追加：句柄，数据；返回写入的字节数
+OP_APPEND = 7
+# 移动读写指针：句柄，位置
+OP_SEEK = 8
+# 查看文件：返回文件描述符，类型，长度，块数
+OP_STAT = 9
+OP_NAMES = {
+    OP_CREATE: 'create',
+    OP_DESTROY: 'destroy',
+    OP_OPEN: 'open',
+    OP_CLOSE: 'close',
+    OP_PREAD: 'pread',
+    OP_PWRITE: 'pwrite',
+    OP_APPEND: 'append',
+    OP_SEEK: 'seek',
+    OP_STAT: 'stat',
+}
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+HANDLE = struct.Struct('<I')
+PREAD = struct.Struct('<IQI')
+PWRITE = struct.Struct('<IQ')
+SEEK = struct.Struct('<IQ')
+COUNT = struct.Struct('<Q')
+STAT = struct.Struct('<IBQI')
+
+
+# 从buffer中取出全部完整的帧，返回[(请求号，操作码或状态，负载)]和已使用的字节数
+def split_frames(buffer, header=REQUEST):
+    frames = []
+    offset = 0
+    view = memoryview(buffer)
+    while len(buffer) - offset >= header.size:
+        length, number, code = header.unpack_from(buffer, offset)
+        if length > MAX_PAYLOAD:
+            raise ValueError('负载长度%d超过上限' % length)
+        end = offset + header.size + length
+        if end > len(buffer):
+            break
+        frames.append((number, code, bytes(view[offset + header.size:end])))
+        offset = end
+    view.release()
+    return frames, offset
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import time
+
+import file
+
+# 操作轨迹中的操作名到(文件系统接口名，参数名列表)
+OPS = {
+    'create': ('create', ('name',)),
+    'destroy': ('destroy', ('name',)),
+    'open': ('open_file', ('name',)),
+    'close': ('close_file', ('name',)),
+    'write': ('write', ('name', 'begin', 'num')),
+    'append': ('append', ('name', 'begin', 'num')),
+    'read': ('read', ('name', 'begin', 'num')),
+    'seek': ('read_write_seek', ('name', 'pos')),
+    'view': ('view_file', ('name',)),
+    'mkdir': ('mkdir', ('name',)),
+    'rmdir': ('rmdir', ('name',)),
+    'clone': ('clone', ('name', 'target')),
+    'copy': ('copy_file', ('name', 'target')),
+    'snapshot': ('snapshot', ('name',)),
+}
+
+
+# 逐行读取操作轨迹，跳过空行
+def load_trace(path):
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+# 执行一条操作，返回接口的返回值
+def apply(record):
+    function, args = OPS[record['op']]
+    return getattr(file, function)(*[record[arg] for arg in args])
+
+
+# 尽快重放操作轨迹
+# timing为可写文件时，每条操作输出一行JSON，包含序号、操作、文件名、耗时(微秒)和返回值
+def replay(path, timing=None):
+    count = 0
+    failed = 0
+    clock = time.perf_counter
+    start = clock()
+    for record in load_trace(path):
+        if record.get('op') not in OPS:
+            logging.warning(msg='第%d条操作%s无法识别' % (count + 1, record.get('op')))
+            failed += 1
+            continue
+        begin = clock()
+        result = apply(record)
+        elapsed = clock() - begin
+        count += 1
+        if result == 0:
+            failed += 1
+        if timing is not None:
+            timing.write(json.dumps({'seq': count, 'op': record['op'], 'name': record.get('name'),
+                                     'us': round(elapsed * 1e6, 1), 'result': result},
+                                    ensure_ascii=False) + '\n')
+    elapsed = clock() - start
+    return {
+        'ops': count,
+        'failed': failed,
+        'seconds': elapsed,
+        'ops_per_sec': count / elapsed if elapsed else 0.0,
+    }
+
+
+# 计算整个卷的校验和：按路径排序依次计入路径、类型、长度和文件内容
+def checksum():
+    digest = hashlib.sha256()
+    for path, item in sorted(file.FS.directory.walk(), key=lambda entry: entry[0]):
+        digest.update(path.encode('utf-8') + b'\0')
+        if isinstance(item, file.Directory):
+            digest.update(b'D')
+            continue
+        length = item.get_file_length()
+        buffer = bytearray(length)
+        file.read_range(item, 0, buffer)
+        digest.update(b'F' + str(length).encode() + b'\0')
+        digest.update(buffer)
+    return digest.hexdigest()
+
+
+# 记录交互过程中的操作，写入操作轨迹文件
+class Recorder(object):
+    def __init__(self, path):
+        self.out = open(path, 'a')
+
+    # 包装namespace中的文件系统接口，调用前先写一条记录
+    def install(self, namespace):
+        for op, (function, args) in OPS.items():
+            if function in namespace:
+                namespace[function] = self._wrap(op, args, namespace[function])
+
+    def _wrap(self, op, args, function):
+        def recorded(*values):
+            record = {'op': op}
+            record.update(zip(args, values))
+            self.out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.out.flush()
+            return function(*values)
+        return recorded
+
+    def close(self):
+        self.out.close()
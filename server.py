@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import file
+from protocol import (COUNT, HANDLE, MAX_PAYLOAD, OP_APPEND, OP_CLOSE, OP_CREATE, OP_DESTROY, OP_OPEN, OP_PREAD,
+                      OP_PWRITE, OP_SEEK, OP_STAT, PREAD, PWRITE, RESPONSE, SEEK, STAT, STATUS_ERROR,
+                      STATUS_OK, split_frames)
+
+
+# 一个客户端连接的状态，每个连接有自己的打开文件表和句柄
+class Session(object):
+    def __init__(self):
+        self.table = file.OpenTable()
+        # 句柄到文件名
+        self.handles = dict()
+        self.next_handle = 1
+
+    def name(self, handle):
+        name = self.handles.get(handle)
+        if name is None:
+            raise IOError('句柄%d无效' % handle)
+        return name
+
+
+def _path(payload):
+    return payload.decode('utf-8')
+
+
+def _create(session, payload):
+    if not file.create(_path(payload)):
+        raise IOError('新建%s失败' % _path(payload))
+    return b''
+
+
+def _destroy(session, payload):
+    if not file.destroy(_path(payload)):
+        raise IOError('删除%s失败' % _path(payload))
+    return b''
+
+
+def _open(session, payload):
+    name = _path(payload)
+    if not file.open_file(name):
+        raise IOError('打开%s失败' % name)
+    handle = session.next_handle
+    session.next_handle += 1
+    session.handles[handle] = name
+    return HANDLE.pack(handle)
+
+
+def _close(session, payload):
+    handle, = HANDLE.unpack(payload)
+    name = session.name(handle)
+    del session.handles[handle]
+    # 同一文件的其他句柄仍在使用时不关闭
+    if name not in session.handles.values():
+        file.close_file(name)
+    return b''
+
+
+def _pread(session, payload):
+    handle, offset, length = PREAD.unpack(payload)
+    # 响应负载不能超过上限，超长的读取在分配缓冲区之前拒绝
+    if length > MAX_PAYLOAD:
+        raise ValueError('读取长度%d超过上限%d' % (length, MAX_PAYLOAD))
+    data = file.pread(session.name(handle), offset, length)
+    if data is None:
+        raise IOError('读取失败')
+    return bytes(data)
+
+
+def _pwrite(session, payload):
+    handle, offset = PWRITE.unpack_from(payload)
+    data = memoryview(payload)[PWRITE.size:]
+    num = file.pwrite(session.name(handle), offset, data)
+    if not num and len(data):
+        raise IOError('写入位置%d无效' % offset)
+    return COUNT.pack(num)
+
+
+def _append(session, payload):
+    handle, = HANDLE.unpack_from(payload)
+    num = file.append_data(session.name(handle), memoryview(payload)[HANDLE.size:])
+    if num is None:
+        raise IOError('追加失败')
+    return COUNT.pack(num)
+
+
+def _seek(session, payload):
+    handle, pos = SEEK.unpack(payload)
+    if file.read_write_seek(session.name(handle), pos) == 0:
+        raise IOError('位置%d无效' % pos)
+    return b''
+
+
+def _stat(session, payload):
+    info = file.stat(_path(payload))
+    if info is None:
+        raise IOError('%s不存在' % _path(payload))
+    return STAT.pack(info['fd'], info['type'], info['size'], info['blocks'])
+
+
+HANDLERS = {
+    OP_CREATE: _create,
+    OP_DESTROY: _destroy,
+    OP_OPEN: _open,
+    OP_CLOSE: _close,
+    OP_PREAD: _pread,
+    OP_PWRITE: _pwrite,
+    OP_APPEND: _append,
+    OP_SEEK: _seek,
+    OP_STAT: _stat,
+}
+
+
+# 在线程池中依次执行一批请求，返回全部响应
+def execute(session, requests):
+    file.use_table(session.table)
+    responses = []
+    for number, op, payload in requests:
+        handler = HANDLERS.get(op)
+        try:
+            if handler is None:
+                raise ValueError('未知的操作码%d' % op)
+            status, body = STATUS_OK, handler(session, payload)
+        except (IOError, ValueError, struct.error, UnicodeDecodeError) as e:
+            status, body = STATUS_ERROR, str(e).encode('utf-8')
+        except Exception as e:
+            # 其他异常同样作为错误响应返回，不断开连接
+            logging.warning(msg='执行请求%d(操作码%d)出错：%r' % (number, op, e))
+            status, body = STATUS_ERROR, repr(e).encode('utf-8')
+        responses.append(RESPONSE.pack(len(body), number, status))
+        responses.append(body)
+    return b''.join(responses)
+
+
+# 连接断开时关闭其打开的全部文件
+def release(session):
+    file.use_table(session.table)
+    for name in set(session.handles.values()):
+        file.close_file(name)
+    session.handles.clear()
+
+
+# 文件服务
+# 每个连接上已到达的请求合并为一批交给线程池执行，客户端可以不等响应连续发送请求
+class FileServer(object):
+    def __init__(self, workers=8, read_size=1 << 16):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='file-server')
+        self.read_size = read_size
+        self.connections = 0
+        self.requests = 0
+        self.batches = 0
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        session = Session()
+        buffer = bytearray()
+        self.connections += 1
+        try:
+            while True:
+                data = await reader.read(self.read_size)
+                if not data:
+                    break
+                buffer += data
+                requests, used = split_frames(buffer)
+                del buffer[:used]
+                if not requests:
+                    continue
+                self.requests += len(requests)
+                self.batches += 1
+                writer.write(await loop.run_in_executor(self.executor, execute, session, requests))
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            logging.info(msg='连接异常断开:%s' % e)
+        finally:
+            self.connections -= 1
+            if session.handles:
+                await loop.run_in_executor(self.executor, release, session)
+            writer.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+
+async def serve(args):
+    server = FileServer(args.workers)
+    if args.unix:
+        listener = await asyncio.start_unix_server(server.handle, path=args.unix, backlog=args.backlog)
+        logging.info(msg='文件服务监听%s' % args.unix)
+    else:
+        listener = await asyncio.start_server(server.handle, args.host, args.port, backlog=args.backlog)
+        logging.info(msg='文件服务监听%s:%d' % (args.host, args.port))
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    async with listener:
+        await stop.wait()
+    server.close()
+    logging.info(msg='文件服务停止，共处理%d个请求，%d批' % (server.requests, server.batches))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m server', description='通过套接字提供文件系统接口')
+    parser.add_argument('--unix', metavar='PATH', help='Unix域套接字路径')
+    parser.add_argument('--host', default='127.0.0.1', help='TCP监听地址')
+    parser.add_argument('--port', type=int, default=7070, help='TCP监听端口')
+    parser.add_argument('--workers', type=int, default=8, help='执行文件操作的线程数')
+    parser.add_argument('--backlog', type=int, default=4096, help='等待接受的连接数上限')
+    parser.add_argument('--verbose', action='store_true', help='输出文件系统日志')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    file.load_disk()
+    if args.unix and os.path.exists(args.unix):
+        os.unlink(args.unix)
+    try:
+        asyncio.run(serve(args))
+    finally:
+        file.dump_disk()
+        if args.unix and os.path.exists(args.unix):
+            os.unlink(args.unix)
@@ -0,0 +1,267 @@
+import logging
+import multiprocessing
+import os
+import pickle
+import threading
+import zlib
+from collections import deque
+from multiprocessing.connection import wait
+from queue import Queue
+
+from file import ALLOC_POLICY, BLOCK_NUM, BLOCK_SIZE, FD_NUM, RESERVED_SIZE, FileSystem
+
+# 各分片共享的块存储文件名
+BLOCKS_NAME = 'blocks.img'
+# 分片目录名
+SHARD_NAME = 'shard%d'
+# 批量调用时每个分片最多同时未完成的请求数
+WINDOW = 64
+# 分片进程可以执行的操作
+OPS = frozenset(('create', 'destroy', 'mkdir', 'rmdir', 'list_dir', 'open_file', 'close_file', 'pread',
+                 'preadv', 'pwrite', 'pwritev', 'append_data', 'stat', 'file_digest', 'sync'))
+
+
+# 持续接收请求放入队列，使路由进程发送请求时不会因分片进程忙于回复而阻塞
+def _receive(requests, queue):
+    try:
+        while True:
+            request = requests.recv()
+            queue.put(request)
+            if request is None:
+                break
+    except EOFError:
+        logging.info(msg='路由进程已退出')
+        queue.put(None)
+
+
+# 发回一个结果，结果无法序列化时改为发回说明原因的IOError
+def _send(responses, result):
+    try:
+        data = pickle.dumps(result)
+    except Exception as e:
+        data = pickle.dumps(IOError('结果%r无法发回：%r' % (result, e)))
+    responses.send_bytes(data)
+
+
+# 分片进程：挂载一个分片，依次执行路由进程发来的请求
+# 挂载结果和每个请求的结果(或异常)按顺序发回
+def _serve(options, requests, responses):
+    fs = FileSystem(**options)
+    try:
+        fs.mount()
+    except Exception as e:
+        _send(responses, e)
+        return
+    responses.send(None)
+    queue = Queue()
+    threading.Thread(target=_receive, args=(requests, queue), daemon=True).start()
+    try:
+        while True:
+            request = queue.get()
+            if request is None:
+                break
+            op, args = request
+            try:
+                if op not in OPS:
+                    raise ValueError('分片不支持操作%s' % op)
+                result = getattr(fs, op)(*args)
+            except Exception as e:
+                # 任何异常都发回路由进程，分片进程继续服务
+                result = e
+            _send(responses, result)
+    finally:
+        fs.unmount()
+
+
+# 分片文件系统
+# 磁盘块映射到root下的同一个块存储文件中，数据区按分片数均分为分配组，
+# 每个分片由一个进程挂载，只在自己的分配组内分配磁盘块，
+# 命名空间按路径第一级名称的哈希划分，路由进程把每个操作发给所属的分片
+class ShardedFileSystem(object):
+    def __init__(self, root='.', shards=2, block_num=BLOCK_NUM, block_size=BLOCK_SIZE,
+                 reserved=RESERVED_SIZE, fd_num=FD_NUM, alloc_policy=ALLOC_POLICY):
+        if shards < 1 or block_num - reserved < shards:
+            raise ValueError('分片数必须在1~%d之间' % max(1, block_num - reserved))
+        self.root = root
+        self.shards = shards
+        self.block_num = block_num
+        self.block_size = block_size
+        self.reserved = reserved
+        self.fd_num = fd_num
+        self.alloc_policy = alloc_policy
+        self.disk_path = os.path.join(root, BLOCKS_NAME)
+        span = (block_num - reserved) // shards
+        self.groups = [(reserved + i * span, reserved + (i + 1) * span if i < shards - 1 else block_num)
+                       for i in range(shards)]
+        self.processes = []
+        # 发往各分片的请求管道和接收结果的管道
+        self.requests = []
+        self.responses = []
+
+    @property
+    def mounted(self):
+        return bool(self.processes)
+
+    # 启动分片进程并挂载全部分片，有分片挂载失败时卸载已挂载的分片并抛出异常
+    def mount(self):
+        if self.processes:
+            raise IOError('%s已经挂载' % self.root)
+        context = multiprocessing.get_context('spawn')
+        for index, group in enumerate(self.groups):
+            options = {
+                'root': os.path.join(self.root, SHARD_NAME % index),
+                'block_num': self.block_num,
+                'block_size': self.block_size,
+                'reserved': self.reserved,
+                'fd_num': self.fd_num,
+                'alloc_policy': self.alloc_policy,
+                'disk_path': self.disk_path,
+                'group': group,
+            }
+            os.makedirs(options['root'], exist_ok=True)
+            request_reader, request_writer = context.Pipe(duplex=False)
+            response_reader, response_writer = context.Pipe(duplex=False)
+            process = context.Process(target=_serve, args=(options, request_reader, response_writer),
+                                      name=SHARD_NAME % index)
+            process.daemon = True
+            process.start()
+            request_reader.close()
+            response_writer.close()
+            self.processes.append(process)
+            self.requests.append(request_writer)
+            self.responses.append(response_reader)
+        errors = []
+        for conn in self.responses:
+            try:
+                error = conn.recv()
+            except EOFError:
+                error = IOError('分片进程意外退出')
+            if error is not None:
+                errors.append(error)
+        if errors:
+            self.unmount()
+            raise errors[0]
+        logging.info(msg='挂载%s的%d个分片' % (self.root, self.shards))
+
+    # 卸载全部分片并结束分片进程
+    def unmount(self):
+        for conn, process in zip(self.requests, self.processes):
+            if process.is_alive():
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+        for process in self.processes:
+            process.join()
+        for conn in self.requests + self.responses:
+            conn.close()
+        self.processes = []
+        self.requests = []
+        self.responses = []
+        logging.info(msg='卸载%s' % self.root)
+
+    # 返回路径所属的分片，根目录返回-1
+    def shard(self, path):
+        for name in path.split('/'):
+            if name and name != '.':
+                return zlib.crc32(name.encode('utf-8')) % self.shards
+        return -1
+
+    def _result(self, result):
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    # 接收第index个分片的结果，分片进程退出时抛出IOError
+    def _recv(self, index):
+        try:
+            return self.responses[index].recv()
+        except EOFError:
+            raise IOError('分片%d进程意外退出' % index)
+
+    # 在path所属的分片上执行操作op
+    def call(self, op, path, *args):
+        if not self.processes:
+            raise IOError('%s未挂载' % self.root)
+        index = self.shard(path)
+        self.requests[index].send((op, (path,) + args))
+        return self._result(self._recv(index))
+
+    # 批量执行(操作，路径，参数...)列表，不同分片的请求并行执行，按原顺序返回结果
+    def call_many(self, calls, window=WINDOW):
+        if not self.processes:
+            raise IOError('%s未挂载' % self.root)
+        # 每个分片待发送和已发送未完成的请求序号
+        pending = [deque() for _ in range(self.shards)]
+        for number, call in enumerate(calls):
+            pending[self.shard(call[1])].append(number)
+        sent = [deque() for _ in range(self.shards)]
+        results = [None] * len(calls)
+        remaining = len(calls)
+        while remaining:
+            for index, conn in enumerate(self.requests):
+                while pending[index] and len(sent[index]) < window:
+                    number = pending[index].popleft()
+                    conn.send((calls[number][0], tuple(calls[number][1:])))
+                    sent[index].append(number)
+            for conn in wait([self.responses[i] for i in range(self.shards) if sent[i]]):
+                index = self.responses.index(conn)
+                results[sent[index].popleft()] = self._recv(index)
+                remaining -= 1
+        return [self._result(result) for result in results]
+
+    # 在全部分片上执行操作，返回各分片的结果
+    def broadcast(self, op, *args):
+        if not self.processes:
+            raise IOError('%s未挂载' % self.root)
+        for conn in self.requests:
+            conn.send((op, args))
+        return [self._result(self._recv(index)) for index in range(self.shards)]
+
+    def create(self, file_name):
+        return self.call('create', file_name)
+
+    def destroy(self, file_name):
+        return self.call('destroy', file_name)
+
+    def mkdir(self, dir_name):
+        return self.call('mkdir', dir_name)
+
+    def rmdir(self, dir_name):
+        return self.call('rmdir', dir_name)
+
+    # 根目录的内容由全部分片的根目录合并而成
+    def list_dir(self, dir_name='/'):
+        if self.shard(dir_name) == -1:
+            return sorted(name for names in self.broadcast('list_dir', '/') for name in names)
+        return self.call('list_dir', dir_name)
+
+    def open_file(self, file_name):
+        return self.call('open_file', file_name)
+
+    def close_file(self, file_name):
+        return self.call('close_file', file_name)
+
+    def pread(self, file_name, offset, length):
+        return self.call('pread', file_name, offset, length)
+
+    def preadv(self, file_name, ranges):
+        return self.call('preadv', file_name, ranges)
+
+    def pwrite(self, file_name, offset, data):
+        return self.call('pwrite', file_name, offset, data)
+
+    def pwritev(self, file_name, ranges):
+        return self.call('pwritev', file_name, ranges)
+
+    def append_data(self, file_name, data):
+        return self.call('append_data', file_name, data)
+
+    def stat(self, path):
+        return self.call('stat', path)
+
+    def file_digest(self, file_name):
+        return self.call('file_digest', file_name)
+
+    def sync(self):
+        self.broadcast('sync')
@@ -0,0 +1,232 @@
+import logging
+import mmap
+import os
+import struct
+
+# 卷镜像格式：
+# 超级块 | 位图区 | 数据块区 | 索引节点表
+# 各区起始位置按页对齐，索引节点表放在最后以便长度变化，
+# 更新时在数据区之后的两个位置间交替写入，超级块记录当前表的位置
+MAGIC = b'FMVOLUME'
+# 版本2的索引节点记录中增加了文件长度，版本3增加了压缩算法和各簇的压缩后长度，旧版本的镜像仍可读取
+VERSION = 3
+PAGE_SIZE = 4096
+# 魔数，版本，块数，块大小，保留区大小，位图区偏移和长度，数据区偏移，索引节点表偏移和长度
+SUPERBLOCK = struct.Struct('<8sIIIIQQQQQ')
+# 索引节点记录：文件描述符，所在目录，类型，名称长度，文件长度，区间个数，压缩算法，簇个数
+INODE = struct.Struct('<IIBHQIBI')
+# 版本1和版本2的索引节点记录
+INODE_V1 = struct.Struct('<IIBHI')
+INODE_V2 = struct.Struct('<IIBHQI')
+# 压缩簇的压缩后长度
+CLUSTER = struct.Struct('<I')
+# 磁盘块区间：起始块号，长度
+RUN = struct.Struct('<II')
+# 索引节点类型
+TYPE_FILE = 0
+TYPE_DIR = 1
+
+
+def _align(offset):
+    return (offset + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+
+
+# 将块号列表压缩为连续区间
+def to_runs(blocks):
+    runs = []
+    for block in blocks:
+        if runs and runs[-1][0] + runs[-1][1] == block:
+            runs[-1][1] += 1
+        else:
+            runs.append([block, 1])
+    return runs
+
+
+# 将连续区间展开为块号列表
+def from_runs(runs):
+    blocks = []
+    for start, num in runs:
+        blocks.extend(range(start, start + num))
+    return blocks
+
+
+# 将索引节点记录打包为字节串
+# 记录为(文件描述符，所在目录，类型，名称，文件长度，区间列表，压缩算法序号，各簇压缩后长度列表)，
+# 压缩文件的区间按簇的顺序排列，每簇占用的块数由压缩后长度算出
+def pack_inodes(records):
+    data = bytearray()
+    for fd, parent, kind, name, size, runs, codec, clusters in records:
+        name = name.encode('utf-8')
+        data += INODE.pack(fd, parent, kind, len(name), size, len(runs), codec, len(clusters))
+        data += name
+        for start, num in runs:
+            data += RUN.pack(start, num)
+        for length in clusters:
+            data += CLUSTER.pack(length)
+    return bytes(data)
+
+
+# 解析索引节点表，逐条返回索引节点记录，版本1的记录文件长度为None
+def unpack_inodes(data, version=VERSION):
+    offset = 0
+    while offset < len(data):
+        codec = cluster_num = 0
+        if version == 1:
+            fd, parent, kind, name_len, run_num = INODE_V1.unpack_from(data, offset)
+            size = None
+            offset += INODE_V1.size
+        elif version == 2:
+            fd, parent, kind, name_len, size, run_num = INODE_V2.unpack_from(data, offset)
+            offset += INODE_V2.size
+        else:
+            fd, parent, kind, name_len, size, run_num, codec, cluster_num = INODE.unpack_from(data, offset)
+            offset += INODE.size
+        name = bytes(data[offset:offset + name_len]).decode('utf-8')
+        offset += name_len
+        runs = [RUN.unpack_from(data, offset + i * RUN.size) for i in range(run_num)]
+        offset += run_num * RUN.size
+        clusters = [CLUSTER.unpack_from(data, offset + i * CLUSTER.size)[0] for i in range(cluster_num)]
+        offset += cluster_num * CLUSTER.size
+        yield fd, parent, kind, name, size, runs, codec, clusters
+
+
+# 将排好序的编号合并为连续区间
+def _spans(indexes):
+    spans = []
+    for i in sorted(indexes):
+        if spans and spans[-1][1] == i:
+            spans[-1][1] += 1
+        else:
+            spans.append([i, i + 1])
+    return spans
+
+
+# 卷镜像文件
+class Volume(object):
+    def __init__(self, path):
+        self.path = path
+        self.fd = -1
+        self.version = VERSION
+        self.block_num = 0
+        self.block_size = 0
+        self.reserved = 0
+        self.bitmap_offset = 0
+        self.bitmap_size = 0
+        self.data_offset = 0
+        self.inode_offset = 0
+        self.inode_size = 0
+        # 上次写入的索引节点表，未变化时不再写入
+        self._inodes = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _layout(self, block_num, block_size, reserved):
+        self.block_num = block_num
+        self.block_size = block_size
+        self.reserved = reserved
+        self.bitmap_offset = PAGE_SIZE
+        self.bitmap_size = (block_num + 63) // 64 * 8
+        self.data_offset = _align(self.bitmap_offset + self.bitmap_size)
+        self.inode_offset = self._inode_base()
+
+    def _write_superblock(self):
+        os.pwrite(self.fd, SUPERBLOCK.pack(
+            MAGIC, self.version, self.block_num, self.block_size, self.reserved,
+            self.bitmap_offset, self.bitmap_size, self.data_offset,
+            self.inode_offset, self.inode_size), 0)
+
+    # 新建卷镜像，数据区不实际写入，由文件系统补零
+    def create(self, block_num, block_size, reserved):
+        self._layout(block_num, block_size, reserved)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(self.fd, self.inode_offset)
+        self.version = VERSION
+        self._write_superblock()
+        self._inodes = None
+        logging.info(msg='新建卷镜像%s' % self.path)
+
+    # 打开已有的卷镜像并读取超级块
+    def open(self):
+        self.fd = os.open(self.path, os.O_RDWR)
+        fields = SUPERBLOCK.unpack(os.pread(self.fd, SUPERBLOCK.size, 0))
+        if fields[0] != MAGIC or not 1 <= fields[1] <= VERSION:
+            os.close(self.fd)
+            self.fd = -1
+            raise IOError('%s不是有效的卷镜像' % self.path)
+        (_, self.version, self.block_num, self.block_size, self.reserved, self.bitmap_offset,
+         self.bitmap_size, self.data_offset, self.inode_offset, self.inode_size) = fields
+        self._inodes = None
+
+    # 读取位图区
+    def read_bitmap(self):
+        return os.pread(self.fd, self.bitmap_size, self.bitmap_offset)
+
+    # 将数据块区整体读入内存
+    def read_blocks(self, buffer):
+        size = self.block_num * self.block_size
+        view = memoryview(buffer)
+        done = 0
+        while done < size:
+            done += os.preadv(self.fd, [view[done:size]], self.data_offset + done)
+
+    # 以写时复制方式映射数据块区，块在第一次访问时才由操作系统读入，修改只留在内存中
+    # 数据块区的位置不满足映射的对齐要求时返回None
+    def map_blocks(self):
+        if self.data_offset % mmap.ALLOCATIONGRANULARITY:
+            return None
+        return mmap.mmap(self.fd, self.block_num * self.block_size, access=mmap.ACCESS_COPY,
+                         offset=self.data_offset)
+
+    # 读取索引节点表
+    def read_inodes(self):
+        self._inodes = os.pread(self.fd, self.inode_size, self.inode_offset)
+        return self._inodes
+
+    # 数据区之后索引节点表的起始位置
+    def _inode_base(self):
+        return _align(self.data_offset + self.block_num * self.block_size)
+
+    # 只写回上次同步后修改过的数据块和位图字，索引节点表变化时整体写回
+    # blocks和bitmap_words为脏块号和脏字号集合
+    # 新的索引节点表写到不与当前表重叠的位置，fsync后再改超级块指向它，
+    # 写超级块前崩溃时旧表仍然完整，由日志重放补上修改
+    def flush(self, data, blocks, bitmap, bitmap_words, inodes):
+        self.write_blocks(data, blocks)
+        words = memoryview(bitmap).cast('B')
+        for begin, end in _spans(bitmap_words):
+            os.pwrite(self.fd, words[begin * 8:end * 8], self.bitmap_offset + begin * 8)
+        if inodes != self._inodes:
+            base = self._inode_base()
+            if self.inode_offset != base and base + len(inodes) <= self.inode_offset:
+                offset = base
+            else:
+                offset = _align(self.inode_offset + self.inode_size)
+            os.pwrite(self.fd, inodes, offset)
+            os.fsync(self.fd)
+            self.inode_offset = offset
+            self.inode_size = len(inodes)
+            # 索引节点表总是按当前版本写回
+            self.version = VERSION
+            self._write_superblock()
+            os.fsync(self.fd)
+            os.ftruncate(self.fd, offset + len(inodes))
+            self._inodes = inodes
+        os.fsync(self.fd)
+        logging.info(msg='同步%d个数据块和%d个位图字到卷镜像%s' %
+                         (len(blocks), len(bitmap_words), self.path))
+
+    # 将data中的blocks写入数据块区，不fsync
+    def write_blocks(self, data, blocks):
+        data = memoryview(data)
+        for begin, end in _spans(blocks):
+            os.pwrite(self.fd, data[begin * self.block_size:end * self.block_size],
+                      self.data_offset + begin * self.block_size)
+
+    def sync(self):
+        getattr(os, 'fdatasync', os.fsync)(self.fd)
+
+    def close(self):
+        if self.fd != -1:
+            os.close(self.fd)
+            self.fd = -1